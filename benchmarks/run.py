@@ -0,0 +1,404 @@
+"""
+Benchmarks of the client hot paths
+
+Run from the repository root:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare results.json
+
+Results are written as JSON, one entry per benchmark with the mean, minimum
+and median seconds per operation. `--compare` reports the ratio against a
+previous result file and exits with status 1 when a benchmark got slower
+than `--threshold`.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from time import perf_counter
+
+import pydantic
+from requests.models import Response
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from tw_invoice import schema  # noqa: E402
+from tw_invoice import AppAPIClient, AsyncAppAPIClient, __version__  # noqa: E402
+from tw_invoice.qrcode import decode_invoice_qrcodes  # noqa: E402
+from tw_invoice.stub import StubServer  # noqa: E402
+from tw_invoice.table import InvoiceTable  # noqa: E402
+from tw_invoice.utils import (  # noqa: E402
+    API_PATHS,
+    check_api_error,
+    sign,
+    validate_invoice_number,
+    validate_invoice_numbers,
+    validate_invoice_random,
+    validate_invoice_term,
+    validate_phone_barcode,
+    validate_phone_barcodes,
+)
+
+PAYLOAD_SIZES = (1, 100, 1000)
+BATCH_SIZE = 100000
+CONCURRENCY = (1, 4, 16)
+IMPORT_RUNS = 10
+IMPORTS = {
+    "package": "import tw_invoice",
+    "client": "from tw_invoice import AppAPIClient",
+    "async_client": "from tw_invoice import AsyncAppAPIClient",
+}
+QRCODE = (
+    "AB112233441020523999900000144000001540000000001234567ydXZt4LAN1UHN/j1juVcRA=="
+    ":**********:3:3:1:乾電池:1:105:口罩:1:210",
+    "**牛奶:1:25",
+)
+CARRIER = {"cardType": "3J0002", "cardNo": "/ABC+123", "cardEncrypt": "encrypt"}
+SIGN_DATA = {
+    "version": 0.1,
+    "serial": "0000000001",
+    "action": "carrierInvDnt",
+    "timeStamp": 1700000000,
+    "expTimeStamp": "2147483647",
+    "invDate": "2023/01/01",
+    "invNum": "AB12345678",
+    "npoBan": "1299",
+    "uuid": "00000000-0000-0000-0000-000000000000",
+    "appID": "stub_app_id",
+    **CARRIER,
+}
+MODELS = {
+    "QryWinningList": ("invapp", schema.LotteryNumberResponse, {"invTerm": "11202"}),
+    "qryInvHeader": (
+        "invapp",
+        schema.InvoiceHeaderResponse,
+        {"invNum": "AB12345678", "invDate": "2023/01/01"},
+    ),
+    "qryInvDetail": (
+        "invapp",
+        schema.InvoiceDetailResponse,
+        {"invNum": "AB12345678", "invDate": "2023/01/01"},
+    ),
+    "qryLoveCode": ("lovecode", schema.LoveCodeResponse, {"qKey": "基金會"}),
+    "carrierInvChk": (
+        "invserv",
+        schema.CarrierInvoicesHeaderResponse,
+        {"startDate": "2023/01/01", "endDate": "2023/01/31", "onlyWinningInv": "N"},
+    ),
+    "carrierInvDetail": (
+        "invserv",
+        schema.CarrierInvoicesDetailResponse,
+        {"invNum": "AB12345678", "invDate": "2023/01/01", "amount": "100"},
+    ),
+    "carrierInvDnt": (
+        "donate",
+        schema.CarrierInvoiceDonateResponse,
+        {
+            "serial": "0000000001",
+            "invNum": "AB12345678",
+            "invDate": "2023/01/01",
+            "npoBan": "1299",
+        },
+    ),
+    "qryCarrierAgg": (
+        "carrier",
+        schema.AggregateCarrierResponse,
+        {"serial": "0000000001"},
+    ),
+}
+
+
+def measure(name: str, func, params: dict = None, min_time: float = 0.2) -> dict:
+    """Time `func` with timeit, repeating until each run takes `min_time`"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [seconds / number for seconds in timer.repeat(repeat=5, number=number)]
+    return {
+        "name": name,
+        "params": params or {},
+        "iterations": number * len(runs),
+        "mean": statistics.mean(runs),
+        "min": min(runs),
+        "median": statistics.median(runs),
+    }
+
+
+def payload(server: StubServer, action: str) -> bytes:
+    endpoint, _, form = MODELS[action]
+    form = {"action": action, "appID": server.app_id, **CARRIER, **form}
+    if action in ("carrierInvDnt", "qryCarrierAgg"):
+        form["signature"] = sign(form, server.api_key)
+    status, content = server.handle(API_PATHS[endpoint], form)
+    assert status == 200 and int(content["code"]) == 200, content
+    return json.dumps(content, ensure_ascii=False).encode("utf-8")
+
+
+def response(content: bytes) -> Response:
+    result = Response()
+    result.status_code = 200
+    result._content = content
+    return result
+
+
+def bench_utils() -> list:
+    samples = {
+        "validate_invoice_number": (validate_invoice_number, "AB12345678"),
+        "validate_invoice_random": (validate_invoice_random, "1234"),
+        "validate_invoice_term": (validate_invoice_term, "11202"),
+        "validate_phone_barcode": (validate_phone_barcode, "/ABC+123"),
+    }
+    results = [measure("sign", lambda: sign(SIGN_DATA, "stub_api_key"))]
+    for name, (func, value) in samples.items():
+        results.append(measure(name, lambda: func(value)))
+
+    batches = {
+        "validate_invoice_numbers": (
+            validate_invoice_numbers,
+            [f"AB{number:08d}" for number in range(BATCH_SIZE)],
+        ),
+        "validate_phone_barcodes": (
+            validate_phone_barcodes,
+            [f"/AB{number:05d}" for number in range(BATCH_SIZE)],
+        ),
+    }
+    for name, (func, values) in batches.items():
+        params = {"size": BATCH_SIZE, "input": "list"}
+        results.append(measure(name, lambda: func(values), params))
+        if numpy is not None:
+            array = numpy.array(values)
+            params = {"size": BATCH_SIZE, "input": "numpy"}
+            results.append(measure(name, lambda: func(array), params))
+
+    payloads = [QRCODE] * BATCH_SIZE
+    for items in (False, True):
+        params = {"size": BATCH_SIZE, "items": items}
+        results.append(
+            measure(
+                "decode_invoice_qrcodes",
+                lambda: decode_invoice_qrcodes(payloads, items),
+                params,
+            )
+        )
+    return results
+
+
+def bench_import() -> list:
+    """Time imports in fresh interpreters, as in a cold start"""
+    results = []
+    for name, statement in IMPORTS.items():
+        if name == "async_client" and httpx is None:
+            continue
+        code = (
+            "from time import perf_counter; started = perf_counter(); "
+            f"{statement}; print(perf_counter() - started)"
+        )
+        runs = [
+            float(
+                subprocess.run(
+                    [sys.executable, "-c", code],
+                    cwd=str(ROOT),
+                    check=True,
+                    stdout=subprocess.PIPE,
+                ).stdout
+            )
+            for _ in range(IMPORT_RUNS)
+        ]
+        results.append(
+            {
+                "name": f"import.{name}",
+                "params": {},
+                "iterations": len(runs),
+                "mean": statistics.mean(runs),
+                "min": min(runs),
+                "median": statistics.median(runs),
+            }
+        )
+    return results
+
+
+def bench_parse() -> list:
+    results = []
+    for size in PAYLOAD_SIZES:
+        server = StubServer(payload_size=size)
+        for action, (_, model, _) in MODELS.items():
+            content = payload(server, action)
+            results.append(
+                measure(
+                    f"parse.{model.__name__}",
+                    lambda: model.parse_obj(check_api_error(response(content))),
+                    {"payload_size": size, "bytes": len(content)},
+                )
+            )
+        headers = payload(server, "carrierInvChk")
+        results.append(
+            measure(
+                "parse.InvoiceTable",
+                lambda: InvoiceTable.from_responses([json.loads(headers)]),
+                {"payload_size": size, "bytes": len(headers)},
+            )
+        )
+        server._httpd.server_close()
+    return results
+
+
+def summarize(name: str, params: dict, latencies: list, elapsed: float) -> dict:
+    latencies.sort()
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(latencies),
+        "mean": statistics.mean(latencies),
+        "min": latencies[0],
+        "median": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "throughput": len(latencies) / elapsed,
+    }
+
+
+def bench_end_to_end(requests: int, latency: float) -> list:
+    results = []
+    with StubServer(payload_size=100, latency=latency) as server:
+        for concurrency in CONCURRENCY:
+            client = AppAPIClient(
+                server.app_id,
+                server.api_key,
+                base_url=server.url,
+                pool_maxsize=concurrency,
+                pool_block=True,
+            )
+
+            def call(_):
+                started = perf_counter()
+                client.get_invoice_header("Barcode", "AB12345678", date(2023, 1, 1))
+                return perf_counter() - started
+
+            started = perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                latencies = list(executor.map(call, range(requests)))
+            results.append(
+                summarize(
+                    "end_to_end.sync",
+                    {"concurrency": concurrency, "latency": latency},
+                    latencies,
+                    perf_counter() - started,
+                )
+            )
+            client.session.close()
+
+        if httpx is None:
+            return results
+        for concurrency in CONCURRENCY:
+            results.append(
+                asyncio.run(bench_async(server, requests, concurrency, latency))
+            )
+    return results
+
+
+async def bench_async(
+    server: StubServer, requests: int, concurrency: int, latency: float
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            started = perf_counter()
+            await client.get_invoice_header("Barcode", "AB12345678", date(2023, 1, 1))
+            return perf_counter() - started
+
+    async with AsyncAppAPIClient(
+        server.app_id, server.api_key, base_url=server.url
+    ) as client:
+        started = perf_counter()
+        latencies = list(await asyncio.gather(*(call() for _ in range(requests))))
+    return summarize(
+        "end_to_end.async",
+        {"concurrency": concurrency, "latency": latency},
+        latencies,
+        perf_counter() - started,
+    )
+
+
+def key(result: dict) -> str:
+    return json.dumps([result["name"], result["params"]], sort_keys=True)
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> bool:
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = {key(result): result for result in json.load(file)["results"]}
+    regressed = False
+    for result in results:
+        previous = baseline.get(key(result))
+        if previous is None:
+            continue
+        ratio = result["median"] / previous["median"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{ratio:6.2f}x  {result['name']} {result['params']}{flag}")
+    return not regressed
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="compare against a previous result file")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument(
+        "--only",
+        choices=["import", "utils", "parse", "end_to_end"],
+        action="append",
+    )
+    options = parser.parse_args(args)
+
+    groups = {
+        "import": bench_import,
+        "utils": bench_utils,
+        "parse": bench_parse,
+        "end_to_end": lambda: bench_end_to_end(options.requests, options.latency),
+    }
+    results = []
+    for group in options.only or groups:
+        results.extend(groups[group]())
+
+    report = {
+        "tw_invoice": __version__,
+        "python": platform.python_version(),
+        "pydantic": pydantic.VERSION,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if options.compare:
+        return 0 if compare(results, options.compare, options.threshold) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
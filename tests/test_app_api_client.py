@@ -1,8 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
 import pytest
+from requests.models import Response
 
 from tw_invoice import AppAPIClient
+from tw_invoice.exception import APIError
+from tw_invoice.schema import CarrierInvoicesHeaderResponse, LoveCodeResponse
 from tw_invoice.utils import build_api_url
 
 TEST_API_KEY = "test_api_key"
@@ -66,16 +70,36 @@ def test_init_with_invalid_skip_validation():
         AppAPIClient(TEST_APP_ID, TEST_API_KEY, skip_validation="invalid")
 
 
+def test_request_templates(client):
+    assert client._template("QryWinningList") == {
+        "version": 0.2,
+        "action": "QryWinningList",
+        "UUID": TEST_UUID,
+        "appID": TEST_APP_ID,
+    }
+    # Templates are copies, and follow credential changes
+    client._template("QryWinningList")["invTerm"] = TEST_INVOICE_TERM
+    client.app_id = "other_app_id"
+    client.uuid = "other_uuid"
+    assert client._template("qryCarrierAgg") == {
+        "version": 1.0,
+        "action": "qryCarrierAgg",
+        "uuid": "other_uuid",
+        "appID": "other_app_id",
+    }
+    signature = client.signer.sign({"action": "qryCarrierAgg"})
+    client.api_key = "other_api_key"
+    assert client.signer.sign({"action": "qryCarrierAgg"}) != signature
+
+
 def test_get_lottery_numbers(client, mocker):
     with pytest.raises(ValueError):
         client.get_lottery_numbers("2022-04-23")
 
     # Mock the API response
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
-    mocked_parse_obj = mocker.patch(
-        "tw_invoice.app_client.LotteryNumberResponse.parse_obj"
-    )
+    mocked_parse_obj = mocker.patch("tw_invoice.schema.LotteryNumberResponse.parse_obj")
 
     client.get_lottery_numbers("11006")
     mocked_session_post.assert_called_once_with(
@@ -113,10 +137,10 @@ def test_get_invoice_header(client, mocker):
         mocked_validate_invoice_number = mocker.patch(
             "tw_invoice.app_client.validate_invoice_number"
         )
-        mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+        mocked_session_post = mocker.patch("requests.Session.post")
         mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
         mocked_parse_obj = mocker.patch(
-            "tw_invoice.app_client.InvoiceHeaderResponse.parse_obj"
+            "tw_invoice.schema.InvoiceHeaderResponse.parse_obj"
         )
 
         client.get_invoice_header(
@@ -224,11 +248,9 @@ def test_get_invoice_detail(client, mocker):
         )
 
     # Mock the API response
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
-    mocked_parse_obj = mocker.patch(
-        "tw_invoice.app_client.InvoiceDetailResponse.parse_obj"
-    )
+    mocked_parse_obj = mocker.patch("tw_invoice.schema.InvoiceDetailResponse.parse_obj")
 
     client.get_invoice_detail(
         barcode_type="QRCode",
@@ -260,11 +282,9 @@ def test_get_invoice_detail(client, mocker):
     mocked_parse_obj.assert_called_once()
 
     # Mock the API response
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
-    mocked_parse_obj = mocker.patch(
-        "tw_invoice.app_client.InvoiceDetailResponse.parse_obj"
-    )
+    mocked_parse_obj = mocker.patch("tw_invoice.schema.InvoiceDetailResponse.parse_obj")
 
     client.get_invoice_detail(
         barcode_type="Barcode",
@@ -297,9 +317,9 @@ def test_get_invoice_detail(client, mocker):
 
 def test_get_love_code(client, mocker):
     # Mock the API response
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
-    mocked_parse_obj = mocker.patch("tw_invoice.app_client.LoveCodeResponse.parse_obj")
+    mocked_parse_obj = mocker.patch("tw_invoice.schema.LoveCodeResponse.parse_obj")
 
     client.get_love_code("test-query")
     mocked_session_post.assert_called_once_with(
@@ -320,10 +340,10 @@ def test_get_love_code(client, mocker):
 def test_get_carrier_invoices_header(client, mocker):
     # Mock the API response
     mocked_time = mocker.patch("tw_invoice.app_client.time", return_value=TEST_TIME)
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
     mocked_parse_obj = mocker.patch(
-        "tw_invoice.app_client.CarrierInvoicesHeaderResponse.parse_obj"
+        "tw_invoice.schema.CarrierInvoicesHeaderResponse.parse_obj"
     )
 
     client.get_carrier_invoices_header(
@@ -369,10 +389,10 @@ def test_get_carrier_invoices_detail(client, mocker):
 
     # Mock the API response
     mocked_time = mocker.patch("tw_invoice.app_client.time", return_value=TEST_TIME)
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
     mocked_parse_obj = mocker.patch(
-        "tw_invoice.app_client.CarrierInvoicesDetailResponse.parse_obj"
+        "tw_invoice.schema.CarrierInvoicesDetailResponse.parse_obj"
     )
 
     client.get_carrier_invoices_detail(
@@ -419,10 +439,10 @@ def test_carrier_donate_invoice(client, mocker):
 
     # Mock the API response
     mocked_time = mocker.patch("tw_invoice.app_client.time", return_value=TEST_TIME)
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
     mocked_parse_obj = mocker.patch(
-        "tw_invoice.app_client.CarrierInvoiceDonateResponse.parse_obj"
+        "tw_invoice.schema.CarrierInvoiceDonateResponse.parse_obj"
     )
 
     client.carrier_donate_invoice(
@@ -462,10 +482,10 @@ def test_carrier_donate_invoice(client, mocker):
 def test_get_aggregate_carrier(client, mocker):
     # Mock the API response
     mocked_time = mocker.patch("tw_invoice.app_client.time", return_value=TEST_TIME)
-    mocked_session_post = mocker.patch("tw_invoice.app_client.Session.post")
+    mocked_session_post = mocker.patch("requests.Session.post")
     mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
     mocked_parse_obj = mocker.patch(
-        "tw_invoice.app_client.AggregateCarrierResponse.parse_obj"
+        "tw_invoice.schema.AggregateCarrierResponse.parse_obj"
     )
 
     client.get_aggregate_carrier(
@@ -493,3 +513,178 @@ def test_get_aggregate_carrier(client, mocker):
     mocked_check_api_error.assert_called_once()
     mocked_parse_obj.assert_called_once()
     assert client.serial == 2
+
+
+def test_concurrent_serials(client, mocker):
+    mocked_session_post = mocker.patch("requests.Session.post")
+    mocker.patch("tw_invoice.app_client.check_api_error")
+    mocker.patch("tw_invoice.schema.AggregateCarrierResponse.parse_obj")
+
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        for _ in range(256):
+            executor.submit(
+                client.get_aggregate_carrier,
+                TEST_CARD_TYPE,
+                TEST_CARD_NUMBER,
+                TEST_CARD_ENCRYPT,
+            )
+    serials = [
+        kwargs["data"]["serial"] for _, kwargs in mocked_session_post.call_args_list
+    ]
+    assert sorted(serials) == [f"{serial:0>10}" for serial in range(1, 257)]
+    assert client.serial == 257
+
+
+def test_connection_pool():
+    adapter = AppAPIClient(TEST_APP_ID, TEST_API_KEY).session.get_adapter(
+        build_api_url("invapp")
+    )
+    assert (adapter._pool_maxsize, adapter._pool_block) == (10, False)
+    client = AppAPIClient(
+        TEST_APP_ID, TEST_API_KEY, pool_connections=4, pool_maxsize=64, pool_block=True
+    )
+    adapter = client.session.get_adapter(build_api_url("invapp"))
+    assert adapter._pool_connections == 4
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 64
+    assert adapter.poolmanager.connection_pool_kw["block"] is True
+
+
+def carrier_invoice(invoice_number, day):
+    return {
+        "rowNum": "1",
+        "invNum": invoice_number,
+        "cardType": TEST_CARD_TYPE,
+        "cardNo": TEST_CARD_NUMBER,
+        "sellerName": "統一超商股份有限公司",
+        "invStatus": "已確認",
+        "invDonatable": True,
+        "amount": "81",
+        "invPeriod": "10902",
+        "donateMark": 0,
+        "sellerBan": "22555003",
+        "invoiceTime": "12:00:00",
+        "invDate": {
+            "year": 120,
+            "month": 0,
+            "date": day,
+            "day": 3,
+            "hours": 0,
+            "minutes": 0,
+            "seconds": 0,
+            "time": 1577808000000,
+            "timezoneOffset": -480,
+        },
+    }
+
+
+def test_iter_carrier_invoices_detail(client, mocker):
+    header = CarrierInvoicesHeaderResponse.parse_obj(
+        {
+            "v": "0.5",
+            "code": 200,
+            "msg": "執行成功",
+            "onlyWinningInv": "N",
+            "details": [
+                carrier_invoice(TEST_INVOICE_NUMBER, 1),
+                carrier_invoice("AB87654321", 2),
+            ],
+        }
+    )
+
+    def get_carrier_invoices_detail(**kwargs):
+        if kwargs["invoice_number"] != TEST_INVOICE_NUMBER:
+            raise APIError(915, "查無此發票詳細資料")
+        return kwargs
+
+    mocked_detail = mocker.patch.object(
+        client, "get_carrier_invoices_detail", side_effect=get_carrier_invoices_detail
+    )
+
+    results = {
+        result.invoice.invNum: result
+        for result in client.iter_carrier_invoices_detail(
+            card_type=TEST_CARD_TYPE,
+            card_number=TEST_CARD_NUMBER,
+            invoices=header,
+            card_encrypt=TEST_CARD_ENCRYPT,
+            max_workers=2,
+        )
+    }
+    assert mocked_detail.call_count == 2
+    assert results[TEST_INVOICE_NUMBER].error is None
+    assert results[TEST_INVOICE_NUMBER].detail == {
+        "card_type": TEST_CARD_TYPE,
+        "card_number": TEST_CARD_NUMBER,
+        "card_encrypt": TEST_CARD_ENCRYPT,
+        "invoice_number": TEST_INVOICE_NUMBER,
+        "invoice_date": TEST_DATE,
+        "seller_name": "統一超商股份有限公司",
+        "amount": "81",
+    }
+    assert results["AB87654321"].detail is None
+    assert isinstance(results["AB87654321"].error, APIError)
+
+
+def test_iter_carrier_invoices_header(client, mocker):
+    def get_carrier_invoices_header(start_date, **kwargs):
+        # The first invoice shows up in every window and must be merged
+        return {
+            "code": 200,
+            "details": [
+                carrier_invoice(TEST_INVOICE_NUMBER, 1),
+                carrier_invoice(f"AB0000000{start_date.month}", start_date.day),
+            ],
+        }
+
+    mocked_header = mocker.patch.object(
+        client, "get_carrier_invoices_header", side_effect=get_carrier_invoices_header
+    )
+
+    invoices = list(
+        client.iter_carrier_invoices_header(
+            card_type=TEST_CARD_TYPE,
+            card_number=TEST_CARD_NUMBER,
+            start_date=date(2020, 1, 15),
+            end_date=date(2020, 3, 10),
+            card_encrypt=TEST_CARD_ENCRYPT,
+        )
+    )
+    assert mocked_header.call_count == 3
+    windows = {
+        (kwargs["start_date"], kwargs["end_date"])
+        for _, kwargs in mocked_header.call_args_list
+    }
+    assert windows == {
+        (date(2020, 1, 15), date(2020, 1, 31)),
+        (date(2020, 2, 1), date(2020, 2, 29)),
+        (date(2020, 3, 1), date(2020, 3, 10)),
+    }
+    assert sorted(invoice["invNum"] for invoice in invoices) == [
+        "AB00000001",
+        "AB00000002",
+        "AB00000003",
+        TEST_INVOICE_NUMBER,
+    ]
+
+
+def test_fast_decode(mocker):
+    client = AppAPIClient(TEST_APP_ID, TEST_API_KEY, TEST_UUID, fast_decode=True)
+    response = Response()
+    response.status_code = 200
+    response._content = b'{"v": "0.2", "code": "200", "msg": "OK", "details": []}'
+    mocked_session_post = mocker.patch("requests.Session.post", return_value=response)
+    mocked_check_api_error = mocker.patch("tw_invoice.app_client.check_api_error")
+
+    results = client.get_love_code("test-query")
+    mocked_session_post.assert_called_once()
+    mocked_check_api_error.assert_not_called()
+    assert isinstance(results, LoveCodeResponse)
+    assert results.details == []
+
+    client.skip_validation = True
+    assert client.get_love_code("test-query") == {
+        "v": "0.2",
+        "code": "200",
+        "msg": "OK",
+        "details": [],
+    }
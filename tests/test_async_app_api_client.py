@@ -0,0 +1,365 @@
+import asyncio
+from datetime import date
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from tw_invoice import AsyncAppAPIClient
+from tw_invoice.cache import MemoryCache
+from tw_invoice.exception import APIError, CircuitOpen
+from tw_invoice.metrics import Metrics
+from tw_invoice.retry import RetryPolicy
+from tw_invoice.schema import AggregateCarrierResponse, LotteryNumberResponse
+from tw_invoice.utils import build_api_url
+
+TEST_API_KEY = "test_api_key"
+TEST_APP_ID = "test_app_id"
+TEST_CARD_ENCRYPT = "3f56c1f14f83b6eb"
+TEST_CARD_NUMBER = "/AB12+-."
+TEST_CARD_TYPE = "3J0002"
+TEST_UUID = "test_uuid"
+
+LOTTERY_NUMBERS = {
+    "v": "0.2",
+    "code": "200",
+    "msg": "查詢成功",
+    "invoYm": "11006",
+    "superPrizeNo": "12345678",
+    "spcPrizeNo": "23456789",
+    "firstPrizeNo1": "34567890",
+    "firstPrizeNo2": "45678901",
+    "firstPrizeNo3": "56789012",
+    "superPrizeAmt": "10000000",
+    "spcPrizeAmt": "2000000",
+    "firstPrizeAmt": "200000",
+    "secondPrizeAmt": "40000",
+    "thirdPrizeAmt": "10000",
+    "fourthPrizeAmt": "4000",
+    "fifthPrizeAmt": "1000",
+    "sixthPrizeAmt": "200",
+}
+
+
+def mock_client(handler, **kwargs):
+    client = AsyncAppAPIClient(TEST_APP_ID, TEST_API_KEY, TEST_UUID, **kwargs)
+    client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_get_lottery_numbers():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=LOTTERY_NUMBERS)
+
+    async def main():
+        async with mock_client(handler) as client:
+            return await client.get_lottery_numbers("11006")
+
+    results = asyncio.run(main())
+    assert isinstance(results, LotteryNumberResponse)
+    assert results.superPrizeNo == "12345678"
+    assert len(requests) == 1
+    assert str(requests[0].url) == build_api_url("invapp")
+    assert parse_qs(requests[0].content.decode()) == {
+        "version": ["0.2"],
+        "action": ["QryWinningList"],
+        "invTerm": ["11006"],
+        "UUID": [TEST_UUID],
+        "appID": [TEST_APP_ID],
+    }
+
+
+def test_invalid_params_raise_immediately():
+    client = AsyncAppAPIClient(TEST_APP_ID, TEST_API_KEY, TEST_UUID)
+    with pytest.raises(ValueError):
+        client.get_lottery_numbers("2022-04-23")
+
+
+def test_skip_validation():
+    def handler(request):
+        return httpx.Response(200, json=LOTTERY_NUMBERS)
+
+    async def main():
+        async with mock_client(handler, skip_validation=True) as client:
+            return await client.get_lottery_numbers("11006")
+
+    assert asyncio.run(main()) == LOTTERY_NUMBERS
+
+
+def test_api_error():
+    def handler(request):
+        return httpx.Response(200, json={"code": 998, "msg": "appID 不符合規定"})
+
+    async def main():
+        async with mock_client(handler) as client:
+            return await client.get_lottery_numbers("11006")
+
+    with pytest.raises(APIError) as exc_info:
+        asyncio.run(main())
+    assert exc_info.value.code == 998
+
+
+def test_retry_on_server_error(mocker):
+    mocker.patch("tw_invoice.async_client.RETRY_BACKOFF_FACTOR", 0)
+    responses = [httpx.Response(503), httpx.Response(200, json=LOTTERY_NUMBERS)]
+
+    def handler(request):
+        return responses.pop(0)
+
+    async def main():
+        async with mock_client(handler) as client:
+            return await client.get_lottery_numbers("11006")
+
+    assert asyncio.run(main()).invoYm == "11006"
+    assert not responses
+
+
+def test_retry_exhausted(mocker):
+    mocker.patch("tw_invoice.async_client.RETRY_BACKOFF_FACTOR", 0)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    async def main():
+        async with mock_client(handler, max_retries=2) as client:
+            return await client.get_lottery_numbers("11006")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(main())
+    assert len(calls) == 3
+
+
+def test_retry_backoff(mocker):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    mocker.patch("tw_invoice.async_client.asyncio.sleep", sleep)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    async def main():
+        async with mock_client(handler, max_retries=15) as client:
+            return await client.get_lottery_numbers("11006")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(main())
+    assert len(calls) == 16
+    # Same schedule as urllib3 Retry: no wait before the first retry, then
+    # exponential backoff capped at Retry.DEFAULT_BACKOFF_MAX
+    expected = [0.1 * 2**retries for retries in range(1, 11)] + [120] * 4
+    assert delays == pytest.approx(expected)
+
+
+def test_get_aggregate_carrier_signature(mocker):
+    mocker.patch("tw_invoice.app_client.time", return_value=1655654400)
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(
+            200,
+            json={
+                "v": "1.0",
+                "code": 200,
+                "hashSerial": "",
+                "msg": "執行成功",
+                "cardType": TEST_CARD_TYPE,
+                "cardNo": TEST_CARD_NUMBER,
+                "carriers": [],
+            },
+        )
+
+    async def main():
+        async with mock_client(handler) as client:
+            results = await client.get_aggregate_carrier(
+                card_type=TEST_CARD_TYPE,
+                card_number=TEST_CARD_NUMBER,
+                card_encrypt=TEST_CARD_ENCRYPT,
+            )
+            return client, results
+
+    client, results = asyncio.run(main())
+    assert isinstance(results, AggregateCarrierResponse)
+    assert client.serial == 2
+    form = parse_qs(requests[0].content.decode())
+    assert form["serial"] == ["0000000001"]
+    # Same signature as the sync client produces for identical inputs
+    assert form["signature"] == ["2pWN1GfP6S7oncE56OJetvpxGlE1tFYHeqgNwHmIuw4="]
+
+
+def test_iter_carrier_invoices_detail():
+    invoices = [
+        {
+            "invNum": invoice_number,
+            "sellerName": "統一超商股份有限公司",
+            "amount": "81",
+            "invDate": {"year": 120, "month": 0, "date": 1},
+        }
+        for invoice_number in ("AB12345678", "AB87654321", "invalid")
+    ]
+
+    def handler(request):
+        form = parse_qs(request.content.decode())
+        assert form["invDate"] == ["2020/01/01"]
+        assert form["sellerName"] == ["統一超商股份有限公司"]
+        if form["invNum"] == ["AB87654321"]:
+            return httpx.Response(200, json={"code": 915, "msg": "查無此發票詳細資料"})
+        return httpx.Response(200, json={"code": 200, "invNum": form["invNum"][0]})
+
+    async def main():
+        async with mock_client(handler, skip_validation=True) as client:
+            return [
+                result
+                async for result in client.iter_carrier_invoices_detail(
+                    card_type=TEST_CARD_TYPE,
+                    card_number=TEST_CARD_NUMBER,
+                    invoices=invoices,
+                    card_encrypt=TEST_CARD_ENCRYPT,
+                    max_workers=2,
+                )
+            ]
+
+    results = {result.invoice["invNum"]: result for result in asyncio.run(main())}
+    assert results["AB12345678"].detail["invNum"] == "AB12345678"
+    assert isinstance(results["AB87654321"].error, APIError)
+    assert isinstance(results["invalid"].error, ValueError)
+
+
+def test_iter_carrier_invoices_header():
+    def handler(request):
+        form = parse_qs(request.content.decode())
+        month = form["startDate"][0][5:7]
+        details = [{"invNum": "AB12345678"}, {"invNum": f"AB000000{month}"}]
+        return httpx.Response(200, json={"code": 200, "details": details})
+
+    async def main():
+        async with mock_client(handler, skip_validation=True) as client:
+            return [
+                invoice
+                async for invoice in client.iter_carrier_invoices_header(
+                    card_type=TEST_CARD_TYPE,
+                    card_number=TEST_CARD_NUMBER,
+                    start_date=date(2020, 1, 15),
+                    end_date=date(2020, 2, 10),
+                    card_encrypt=TEST_CARD_ENCRYPT,
+                )
+            ]
+
+    invoices = asyncio.run(main())
+    assert sorted(invoice["invNum"] for invoice in invoices) == [
+        "AB00000001",
+        "AB00000002",
+        "AB12345678",
+    ]
+
+
+def test_lottery_cache():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=LOTTERY_NUMBERS)
+
+    async def main():
+        async with mock_client(handler, lottery_cache=MemoryCache()) as client:
+            for _ in range(3):
+                results = await client.get_lottery_numbers("11006")
+            return results
+
+    assert asyncio.run(main()).invoYm == "11006"
+    assert len(calls) == 1
+
+
+def test_fast_decode():
+    def handler(request):
+        return httpx.Response(200, json=LOTTERY_NUMBERS)
+
+    async def main():
+        async with mock_client(handler, fast_decode=True) as client:
+            return await client.get_lottery_numbers("11006")
+
+    assert isinstance(asyncio.run(main()), LotteryNumberResponse)
+
+
+def test_stream_carrier_invoices_header():
+    details = [{"invNum": f"AB0000000{i}"} for i in range(3)]
+
+    def handler(request):
+        return httpx.Response(
+            200, json={"v": "0.5", "code": 200, "msg": "執行成功", "details": details}
+        )
+
+    async def main():
+        async with mock_client(handler, skip_validation=True) as client:
+            async with client.stream_carrier_invoices_header(
+                card_type=TEST_CARD_TYPE,
+                card_number=TEST_CARD_NUMBER,
+                start_date=date(2020, 1, 1),
+                end_date=date(2020, 1, 31),
+                card_encrypt=TEST_CARD_ENCRYPT,
+            ) as stream:
+                return [invoice async for invoice in stream], stream.code
+
+    assert asyncio.run(main()) == (details, 200)
+
+
+def test_stream_carrier_invoices_header_retry_policy():
+    statuses = [503, 200, 503, 503]
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(
+            statuses.pop(0), json={"v": "0.5", "code": 200, "msg": "", "details": []}
+        )
+
+    async def stream_codes(client):
+        async with client.stream_carrier_invoices_header(
+            card_type=TEST_CARD_TYPE,
+            card_number=TEST_CARD_NUMBER,
+            start_date=date(2020, 1, 1),
+            end_date=date(2020, 1, 31),
+            card_encrypt=TEST_CARD_ENCRYPT,
+        ) as stream:
+            return [invoice async for invoice in stream], stream.code
+
+    async def main():
+        policy = RetryPolicy(max_retries=1, base=0, cap=0, failure_threshold=1)
+        async with mock_client(handler, retry_policy=policy) as client:
+            # 5xx responses are retried
+            assert await stream_codes(client) == ([], 200)
+            with pytest.raises(httpx.HTTPStatusError):
+                await stream_codes(client)
+            # and count against the circuit of the endpoint
+            with pytest.raises(CircuitOpen):
+                await stream_codes(client)
+
+    asyncio.run(main())
+    assert not statuses
+    assert len(requests) == 4
+
+
+def test_metrics(mocker):
+    mocker.patch("tw_invoice.async_client.RETRY_BACKOFF_FACTOR", 0)
+    responses = [httpx.Response(503), httpx.Response(200, json=LOTTERY_NUMBERS)]
+    metrics = Metrics()
+
+    async def main():
+        async with mock_client(lambda request: responses.pop(0), metrics=metrics) as c:
+            return await c.get_lottery_numbers("11006")
+
+    asyncio.run(main())
+    snapshot = metrics.snapshot()
+    stages = {entry["stage"] for entry in snapshot["latency"]}
+    assert stages == {"request", "decode", "validate"}
+    assert snapshot["transfer"][0]["retries"] == 1
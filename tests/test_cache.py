@@ -0,0 +1,185 @@
+from datetime import date
+
+import pytest
+
+from tw_invoice import AppAPIClient
+from tw_invoice.cache import CachePolicy, MemoryCache, SQLiteCache, TieredCache
+from tw_invoice.exception import APIError
+
+TEST_RESULTS = {"code": "200", "msg": "查詢成功", "invoYm": "11006"}
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [1000.0]
+    mocker.patch("tw_invoice.cache.time", side_effect=lambda: now[0])
+    return now
+
+
+@pytest.fixture(params=["memory", "sqlite", "tiered"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCache()
+    if request.param == "tiered":
+        return TieredCache(disk=SQLiteCache(str(tmp_path / "cache.sqlite3")))
+    return SQLiteCache(str(tmp_path / "cache.sqlite3"))
+
+
+def test_cache(cache, clock):
+    assert cache.get("missing") is None
+
+    cache.set("forever", TEST_RESULTS)
+    cache.set("short", TEST_RESULTS, ttl=10)
+    assert cache.get("forever") == TEST_RESULTS
+    assert cache.get("short") == TEST_RESULTS
+    assert len(cache) == 2
+
+    clock[0] += 10
+    assert cache.get("short") is None
+    assert cache.get("forever") == TEST_RESULTS
+
+    cache.delete("forever")
+    assert cache.get("forever") is None
+
+    cache.set("key", TEST_RESULTS)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_sqlite_cache_persists(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path)
+    cache.set("key", TEST_RESULTS)
+    cache.close()
+    assert SQLiteCache(path).get("key") == TEST_RESULTS
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_sqlite_cache_maxsize(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    cache.set("c", 3)
+    assert cache.get("a") is None
+    assert len(cache) == 2
+
+    # Expired entries are evicted first
+    clock[0] += 10
+    cache.set("a", 1)
+    assert cache.get("c") == 3
+    assert cache.get("a") == 1
+
+
+def test_tiered_cache(tmp_path, clock):
+    disk = SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    cache = TieredCache(MemoryCache(maxsize=1), disk)
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2)
+    assert cache.get("b") == 2
+    assert len(cache.memory) == 1
+
+    # Disk hits are promoted with their remaining TTL
+    clock[0] += 5
+    assert cache.get("a") == 1
+    assert cache.memory.get("a") == 1
+    clock[0] += 5
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+    assert cache.stats == (1, 1, 2)
+    assert cache.stats.hits == 2
+    assert cache.stats.hit_ratio == 0.5
+
+    cache.delete("b")
+    assert disk.get("b") is None
+    assert cache.get("b") is None
+
+
+def test_cache_policy(clock):
+    cache = MemoryCache()
+    policy = CachePolicy(cache, "key", error_ttl=60, error_codes=(901,))
+    assert policy.lookup() is None
+
+    policy.store_error(APIError(903, "參數錯誤"))
+    assert policy.lookup() is None
+
+    policy.store_error(APIError(901, "無此期別資料"))
+    with pytest.raises(APIError):
+        policy.lookup()
+
+    clock[0] += 60
+    assert policy.lookup() is None
+
+    policy.store(TEST_RESULTS)
+    assert policy.lookup() == TEST_RESULTS
+
+
+def test_client_lottery_cache(mocker, clock):
+    client = AppAPIClient(
+        "test_app_id", "test_api_key", skip_validation=True, lottery_cache=MemoryCache()
+    )
+    mocked_send = mocker.patch.object(
+        client,
+        "_send",
+        side_effect=[TEST_RESULTS, APIError(901, "無此期別資料"), TEST_RESULTS],
+    )
+
+    # Published terms are cached forever
+    assert client.get_lottery_numbers("11006") == TEST_RESULTS
+    clock[0] += 86400 * 365
+    assert client.get_lottery_numbers("11006") == TEST_RESULTS
+    assert mocked_send.call_count == 1
+
+    # Unpublished terms are negatively cached for lottery_error_ttl
+    for _ in range(2):
+        with pytest.raises(APIError):
+            client.get_lottery_numbers("11008")
+    assert mocked_send.call_count == 2
+    clock[0] += client.lottery_error_ttl
+    assert client.get_lottery_numbers("11008") == TEST_RESULTS
+    assert mocked_send.call_count == 3
+
+
+def test_client_response_cache(mocker, clock):
+    cache = TieredCache()
+    client = AppAPIClient(
+        "test_app_id",
+        "test_api_key",
+        skip_validation=True,
+        response_cache=cache,
+        response_cache_ttls={"qryInvHeader": 60},
+    )
+    mocked_send = mocker.patch.object(client, "_send", return_value=TEST_RESULTS)
+    invoice_date = date(2023, 1, 1)
+
+    for _ in range(2):
+        client.get_invoice_header("Barcode", "AB12345678", invoice_date)
+        client.get_invoice_detail(
+            "Barcode", "AB12345678", invoice_date, "1234", invoice_term="11202"
+        )
+    assert mocked_send.call_count == 2
+    assert cache.stats.hits == 2
+
+    # Each method has its own TTL
+    clock[0] += 60
+    client.get_invoice_header("Barcode", "AB12345678", invoice_date)
+    client.get_invoice_detail(
+        "Barcode", "AB12345678", invoice_date, "1234", invoice_term="11202"
+    )
+    assert mocked_send.call_count == 3
+
+    client.invalidate_invoice("AB12345678", invoice_date, "1234")
+    client.get_invoice_header("Barcode", "AB12345678", invoice_date)
+    client.get_invoice_detail(
+        "Barcode", "AB12345678", invoice_date, "1234", invoice_term="11202"
+    )
+    assert mocked_send.call_count == 5
@@ -0,0 +1,135 @@
+import io
+import json
+
+import pytest
+
+from tw_invoice import AppAPIClient
+from tw_invoice.cli import main, run
+from tw_invoice.stub import StubServer
+
+QUERIES = [
+    {"id": "a", "method": "get_lottery_numbers", "params": {"invoice_term": "11202"}},
+    {
+        "method": "get_invoice_header",
+        "params": {
+            "barcode_type": "Barcode",
+            "invoice_number": "AB12345678",
+            "invoice_date": "2023-01-01",
+        },
+    },
+    {"method": "get_love_code", "params": {"query": "伊甸"}},
+    {
+        "method": "carrier_donate_invoice",
+        "params": {
+            "card_type": "3J0002",
+            "card_number": "/AB12+-.",
+            "invoice_date": "2023-01-01",
+            "invoice_number": "AB12345678",
+            "love_code": "919",
+            "card_encrypt": "3f56c1f14f83b6eb",
+        },
+    },
+    {
+        "method": "get_carrier_invoices_header",
+        "params": {
+            "card_type": "3J0002",
+            "card_number": "/AB12+-.",
+            "start_date": "2023-01-01",
+            "end_date": "2023-02-28",
+            "card_encrypt": "3f56c1f14f83b6eb",
+        },
+    },
+]
+
+
+@pytest.fixture
+def server():
+    with StubServer(payload_size=1) as server:
+        yield server
+
+
+def lines(queries):
+    return [json.dumps(query, ensure_ascii=False) + "\n" for query in queries]
+
+
+def test_cli(server, tmp_path):
+    path = tmp_path / "queries.jsonl"
+    path.write_text("".join(lines(QUERIES)) + "\nnot json\n", encoding="utf-8")
+    stdout = io.StringIO()
+    status = main(
+        [
+            str(path),
+            f"--app-id={server.app_id}",
+            f"--api-key={server.api_key}",
+            f"--base-url={server.url}",
+            "--concurrency=2",
+            "--rate-limit=100",
+            "--order=input",
+        ],
+        stdout=stdout,
+    )
+    records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert status == 1
+    assert [record["line"] for record in records] == [1, 2, 3, 4, 5, 7]
+    assert records[0]["id"] == "a"
+    assert records[0]["result"]["invoYm"] == "11202"
+    assert records[1]["result"]["invNum"] == "AB12345678"
+    assert records[2]["result"]["details"]
+    # Donations are only made with --allow-donate
+    assert records[3]["error"] == {
+        "type": "ValueError",
+        "message": "carrier_donate_invoice requires --allow-donate",
+    }
+    assert records[4]["error"] == {
+        "type": "APIError",
+        "code": 903,
+        "message": "參數錯誤",
+    }
+    assert records[5]["error"]["type"] == "JSONDecodeError"
+
+
+def test_cli_stdin(server, monkeypatch):
+    monkeypatch.setenv("TW_INVOICE_APP_ID", server.app_id)
+    monkeypatch.setenv("TW_INVOICE_API_KEY", server.api_key)
+    stdout = io.StringIO()
+    stdin = io.StringIO("".join(lines(QUERIES[:3])))
+    assert main([f"--base-url={server.url}"], stdin=stdin, stdout=stdout) == 0
+    records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert sorted(record["line"] for record in records) == [1, 2, 3]
+
+    with pytest.raises(SystemExit):
+        main(["--concurrency=0"], stdin=stdin, stdout=stdout)
+
+
+def test_cli_allow_donate(server):
+    stdout = io.StringIO()
+    stdin = io.StringIO("".join(lines(QUERIES[3:4])))
+    status = main(
+        [
+            f"--app-id={server.app_id}",
+            f"--api-key={server.api_key}",
+            f"--base-url={server.url}",
+            "--allow-donate",
+        ],
+        stdin=stdin,
+        stdout=stdout,
+    )
+    assert status == 0
+    assert json.loads(stdout.getvalue())["result"]["invStatus"] == "已捐贈"
+    assert server.counts["carrierInvDnt"] == 1
+
+
+def test_run_streams_input(server):
+    client = AppAPIClient(server.app_id, server.api_key, base_url=server.url)
+    read = []
+
+    def source():
+        for line_number, line in enumerate(lines(QUERIES[:3] * 4), 1):
+            read.append(line_number)
+            yield line
+
+    results = run(client, source(), concurrency=1, ordered=True)
+    assert next(results)["line"] == 1
+    # Only a bounded number of lines are read ahead of the output
+    assert len(read) == 2
+    assert [record["line"] for record in results] == list(range(2, 13))
@@ -0,0 +1,74 @@
+import json
+import multiprocessing
+from datetime import date
+
+import pytest
+
+from tw_invoice import crawler
+from tw_invoice.crawler import (
+    MAX_PROCESSES,
+    SERIAL_RANGE,
+    CarrierCrawler,
+    CarrierJob,
+    JSONLinesSink,
+    _init_worker,
+    balanced_batches,
+)
+from tw_invoice.stub import StubServer
+
+TEST_CARD_ENCRYPT = "3f56c1f14f83b6eb"
+
+
+def test_balanced_batches():
+    jobs = list(range(100))
+    batches = balanced_batches(jobs, 4)
+    assert [len(batch) for batch in batches] == [6] * 16 + [4]
+    assert sum(batches, []) == jobs
+    assert balanced_batches(jobs[:3], 4) == [[0], [1], [2]]
+
+
+def test_init_worker():
+    counter = multiprocessing.Value("i", 0)
+    clients = []
+    for _ in range(2):
+        _init_worker(counter, {"app_id": "test_app_id", "api_key": "test_api_key"})
+        clients.append(crawler._client)
+    assert [client.serial for client in clients] == [1, SERIAL_RANGE + 1]
+    assert clients[0].uuid != clients[1].uuid
+
+
+def test_crawler_processes(mocker):
+    mocker.patch("tw_invoice.crawler.os.cpu_count", return_value=128)
+    # The default is clamped so serial ranges of workers do not overlap
+    assert CarrierCrawler("test_app_id", "test_api_key").processes == MAX_PROCESSES
+    for processes in (0, MAX_PROCESSES + 1):
+        with pytest.raises(ValueError):
+            CarrierCrawler("test_app_id", "test_api_key", processes=processes)
+
+
+def test_crawler(tmp_path):
+    jobs = [CarrierJob("3J0002", f"/AB12+{i:02d}", TEST_CARD_ENCRYPT) for i in range(6)]
+    reports = []
+    with StubServer(payload_size=3) as server:
+        carrier_crawler = CarrierCrawler(
+            server.app_id,
+            server.api_key,
+            processes=2,
+            mp_context=multiprocessing.get_context("spawn"),
+            base_url=server.url,
+        )
+        with JSONLinesSink(str(tmp_path / "invoices.jsonl")) as sink:
+            totals = carrier_crawler.run(
+                jobs,
+                sink,
+                start_date=date(2020, 1, 1),
+                end_date=date(2020, 1, 31),
+                progress=reports.append,
+            )
+    assert totals == (6, 6, 18, 0, 0)
+    assert [report.jobs for report in reports] == list(range(1, 7))
+    with open(tmp_path / "invoices.jsonl", encoding="utf-8") as file:
+        invoices = [json.loads(line) for line in file]
+    assert len(invoices) == 18
+    assert {invoice["cardNo"] for invoice in invoices} == {job[1] for job in jobs}
+    assert all(invoice["detail"]["details"] for invoice in invoices)
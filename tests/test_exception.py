@@ -1,6 +1,11 @@
 import pytest
 
-from tw_invoice.exception import APIError
+from tw_invoice.exception import (
+    APIError,
+    CircuitOpen,
+    CredentialsExhausted,
+    RateLimitExceeded,
+)
 
 TEST_CODE = 1
 TEST_MESSAGE = "Error Message"
@@ -16,3 +21,22 @@ def test_api_error():
     assert error.message == TEST_MESSAGE
     assert str(TEST_CODE) in str(error)
     assert TEST_MESSAGE in str(error)
+
+
+def test_rate_limit_exceeded():
+    """Test RateLimitExceeded"""
+    error = RateLimitExceeded("invapp")
+    assert error.endpoint == "invapp"
+    assert "invapp" in str(error)
+
+
+def test_circuit_open():
+    """Test CircuitOpen"""
+    error = CircuitOpen("invapp")
+    assert error.endpoint == "invapp"
+    assert "invapp" in str(error)
+
+
+def test_credentials_exhausted():
+    """Test CredentialsExhausted"""
+    assert "credential" in str(CredentialsExhausted())
@@ -0,0 +1,81 @@
+import subprocess
+import sys
+
+import pytest
+
+import tw_invoice
+from tw_invoice import app_client, schema
+
+# Installed packages importing the client may load, besides the standard library
+CLIENT_IMPORT_BUDGET = {"orjson", "typing_extensions"}
+
+
+def loaded_modules(statement):
+    code = f"import sys; {statement}; print(' '.join(sys.modules))"
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, stdout=subprocess.PIPE
+    ).stdout
+    return set(output.decode().split())
+
+
+def loaded_packages(statement):
+    """Top level packages loaded from site-packages, other than tw_invoice"""
+    code = (
+        f"import sys; {statement}; print(' '.join(name for name, module in "
+        "list(sys.modules.items()) if 'site-packages' in "
+        "(getattr(module, '__file__', None) or '')))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, stdout=subprocess.PIPE
+    ).stdout
+    return {name.split(".")[0] for name in output.decode().split()} - {"tw_invoice"}
+
+
+def test_lazy_exports():
+    assert tw_invoice.AppAPIClient is app_client.AppAPIClient
+    assert "AsyncAppAPIClient" in dir(tw_invoice)
+    assert set(tw_invoice.__all__) <= set(dir(tw_invoice))
+    with pytest.raises(AttributeError):
+        tw_invoice.missing
+
+    # Schema models are still reachable from the client module
+    assert app_client.LotteryNumberResponse is schema.LotteryNumberResponse
+    with pytest.raises(AttributeError):
+        app_client.missing
+
+
+def test_import_time_dependencies():
+    modules = loaded_modules("import tw_invoice")
+    assert not modules & {"requests", "pydantic", "tw_invoice.app_client"}
+
+    # Optional features are only loaded when used
+    modules = loaded_modules("from tw_invoice import AppAPIClient")
+    assert "tw_invoice.app_client" in modules
+    assert not modules & {
+        "asyncio",
+        "httpx",
+        "numpy",
+        "sqlite3",
+        "tw_invoice.cache",
+        "tw_invoice.ratelimit",
+        "tw_invoice.retry",
+        "tw_invoice.singleflight",
+        "tw_invoice.stream",
+    }
+
+
+def test_client_import_budget():
+    # Handlers importing the client (e.g. cold started serverless functions)
+    # do not load the HTTP stack and pydantic until they are used
+    statement = "from tw_invoice import AppAPIClient"
+    packages = loaded_packages(statement) - loaded_packages("pass")
+    assert packages <= CLIENT_IMPORT_BUDGET
+    assert "tw_invoice.schema" not in loaded_modules(statement)
+
+    # Without validation, responses are never parsed into models
+    modules = loaded_modules(
+        "from tw_invoice import AppAPIClient; "
+        "AppAPIClient('id', 'key', skip_validation=True)"
+    )
+    assert "requests" in modules
+    assert not modules & {"pydantic", "tw_invoice.schema"}
@@ -0,0 +1,65 @@
+import pytest
+
+from tw_invoice.lottery import Prize, PrizeTable
+from tw_invoice.schema import LotteryNumberResponse
+
+LOTTERY_NUMBERS = {
+    "v": "0.2",
+    "code": "200",
+    "msg": "查詢成功",
+    "invoYm": "11006",
+    "superPrizeNo": "12345678",
+    "spcPrizeNo": "23456789",
+    "firstPrizeNo1": "34567890",
+    "firstPrizeNo2": "45678901",
+    "firstPrizeNo3": "56789012",
+    "sixthPrizeNo1": "111",
+    "sixthPrizeNo2": "",
+    "superPrizeAmt": "10,000,000",
+    "spcPrizeAmt": "2000000",
+    "firstPrizeAmt": "200000",
+    "secondPrizeAmt": "40000",
+    "thirdPrizeAmt": "10000",
+    "fourthPrizeAmt": "4000",
+    "fifthPrizeAmt": "1000",
+    "sixthPrizeAmt": "200",
+}
+
+CASES = [
+    ("AB12345678", Prize("super", 10000000)),
+    ("AB23456789", Prize("special", 2000000)),
+    ("AB34567890", Prize("first", 200000)),
+    ("AB04567890", Prize("second", 40000)),
+    ("AB00567890", Prize("third", 10000)),
+    ("AB00067890", Prize("fourth", 4000)),
+    ("AB00007890", Prize("fifth", 1000)),
+    ("AB00000890", Prize("sixth", 200)),
+    ("AB00000111", Prize("sixth", 200)),
+    ("AB00000678", None),
+    ("AB99999999", None),
+]
+
+
+@pytest.fixture(params=["dict", "model"])
+def table(request):
+    if request.param == "dict":
+        return PrizeTable(LOTTERY_NUMBERS)
+    return PrizeTable(LotteryNumberResponse.parse_obj(LOTTERY_NUMBERS))
+
+
+def test_match(table):
+    assert table.term == "11006"
+    for invoice_number, prize in CASES:
+        assert table.match(invoice_number) == prize, invoice_number
+
+
+def test_match_many(table):
+    numbers = [invoice_number for invoice_number, _ in CASES]
+    assert table.match_many(numbers) == [prize for _, prize in CASES]
+
+
+def test_iter_winners(table):
+    numbers = [invoice_number for invoice_number, _ in CASES]
+    winners = list(table.iter_winners(numbers))
+    assert [index for index, _, _ in winners] == list(range(9))
+    assert winners[0] == (0, "AB12345678", Prize("super", 10000000))
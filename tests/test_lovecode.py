@@ -0,0 +1,112 @@
+import pytest
+
+from tw_invoice.exception import APIError
+from tw_invoice.lovecode import LoveCodeIndex
+from tw_invoice.schema import LoveCodeResponse
+
+RESPONSE = {
+    "v": "0.2",
+    "code": "200",
+    "msg": "執行成功",
+    "details": [
+        {
+            "rowNum": 1,
+            "SocialWelfareBAN": "78803234",
+            "LoveCode": "1299",
+            "SocialWelfareName": "財團法人伊甸社會福利基金會",
+            "SocialWelfareAbbrev": "伊甸基金會",
+        },
+        {
+            "rowNum": 2,
+            "SocialWelfareBAN": "12345678",
+            "LoveCode": "876",
+            "SocialWelfareName": "財團法人創世社會福利基金會",
+            "SocialWelfareAbbrev": "創世基金會",
+        },
+        {
+            "rowNum": 3,
+            "SocialWelfareBAN": "23456789",
+            "LoveCode": "12888",
+            "SocialWelfareName": "社團法人台灣世界展望會",
+        },
+    ],
+}
+
+
+@pytest.fixture
+def index():
+    return LoveCodeIndex(LoveCodeResponse.parse_obj(RESPONSE).details)
+
+
+def codes(records):
+    return [record.LoveCode for record in records]
+
+
+def test_search(index):
+    assert len(index) == 3
+    # Matches LoveCode and SocialWelfareBAN, ordered by the matched key
+    assert codes(index.search("12")) == ["876", "12888", "1299"]
+    assert codes(index.search("129")) == ["1299"]
+    assert codes(index.search("伊甸")) == ["1299"]
+    assert codes(index.search("基金會")) == ["1299", "876"]
+    assert codes(index.search("世")) == ["12888", "876"]
+    assert codes(index.search("世界展望")) == ["12888"]
+    assert codes(index.search("基金會", limit=1)) == ["1299"]
+    assert index.search("紅十字") == []
+    assert index.search(" ") == []
+
+
+def test_save_and_load(index, tmp_path):
+    path = str(tmp_path / "lovecode.json")
+    index.refreshed_at = 1000.0
+    index.save(path)
+    loaded = LoveCodeIndex.load(path)
+    assert loaded.refreshed_at == 1000.0
+    assert codes(loaded.search("伊甸")) == ["1299"]
+
+
+def test_refresh_and_fallback(mocker):
+    client = mocker.Mock()
+    client.get_love_code.return_value = RESPONSE
+    index = LoveCodeIndex(client=client)
+
+    # A stale index falls back to the API and keeps the results
+    assert index.stale
+    assert codes(index.search("伊甸")) == ["1299", "876", "12888"]
+    client.get_love_code.assert_called_once_with("伊甸")
+    assert len(index) == 3
+
+    index.refresh(["基金會", "展望會"])
+    assert client.get_love_code.call_count == 3
+    assert not index.stale
+    assert codes(index.search("創世")) == ["876"]
+    assert client.get_love_code.call_count == 3
+
+    with pytest.raises(ValueError):
+        LoveCodeIndex().refresh(["基金會"])
+
+
+def test_fallback_error(index, mocker):
+    index.client = mocker.Mock()
+    index.client.get_love_code.side_effect = APIError(999, "未知錯誤")
+    assert index.stale
+    # The stale index answers when the API is unavailable
+    assert codes(index.search("伊甸")) == ["1299"]
+    index.client.get_love_code.assert_called_once_with("伊甸")
+
+
+def test_update_keys(index):
+    keys = list(index._keys)
+    index.update(RESPONSE)
+    assert index._keys == keys
+
+    # Replaced records drop their previous keys
+    details = [dict(RESPONSE["details"][0], SocialWelfareBAN="99999999")]
+    index.update({"details": details})
+    assert index._keys == sorted(
+        (key, code)
+        for code, record in index.records.items()
+        for key in {code, record.SocialWelfareBAN}
+    )
+    assert codes(index.search("7880")) == []
+    assert codes(index.search("9999")) == ["1299"]
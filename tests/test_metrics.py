@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+from requests.models import PreparedRequest, Response
+
+from tw_invoice import AppAPIClient
+from tw_invoice.exception import APIError
+from tw_invoice.metrics import Metrics
+
+
+def test_timer_and_snapshot():
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.observe_latency("request", "invapp", "QryWinningList", 0.05)
+    metrics.observe_latency("request", "invapp", "QryWinningList", 0.5)
+    metrics.observe_latency("request", "invapp", "QryWinningList", 5)
+    with pytest.raises(APIError):
+        with metrics.timer("decode", "invapp", "QryWinningList"):
+            raise APIError(901, "無此期別資料")
+    metrics.observe_transfer("invapp", "QryWinningList", 10, 100, 2)
+    metrics.observe_transfer("invapp", "QryWinningList", 10, 100, 0)
+
+    snapshot = metrics.snapshot()
+    request, decode = snapshot["latency"]
+    assert request["stage"] == "request"
+    assert request["count"] == 3
+    assert request["buckets"] == {"0.1": 1, "1": 2, "+Inf": 3}
+    assert decode["stage"] == "decode"
+    assert decode["count"] == 1
+    assert snapshot["transfer"] == [
+        {
+            "endpoint": "invapp",
+            "action": "QryWinningList",
+            "requests": 2,
+            "bytes_out": 20,
+            "bytes_in": 200,
+            "retries": 2,
+        }
+    ]
+    assert snapshot["errors"] == [
+        {"endpoint": "invapp", "action": "QryWinningList", "code": "901", "count": 1}
+    ]
+
+
+def test_to_prometheus():
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.observe_latency("request", "lovecode", "qryLoveCode", 0.05)
+    metrics.observe_transfer("lovecode", "qryLoveCode", 10, 100, 1)
+    metrics.observe_error("lovecode", "qryLoveCode", 998)
+    text = metrics.to_prometheus()
+    labels = 'endpoint="lovecode",action="qryLoveCode"'
+    assert "# TYPE tw_invoice_latency_seconds histogram" in text
+    assert (
+        f'tw_invoice_latency_seconds_bucket{{stage="request",{labels},le="+Inf"}} 1'
+        in text
+    )
+    assert f'tw_invoice_latency_seconds_count{{stage="request",{labels}}} 1' in text
+    assert f"tw_invoice_requests_total{{{labels}}} 1" in text
+    assert f"tw_invoice_bytes_in_total{{{labels}}} 100" in text
+    assert f"tw_invoice_retries_total{{{labels}}} 1" in text
+    assert f'tw_invoice_api_errors_total{{{labels},code="998"}} 1' in text
+    assert text.endswith("\n")
+
+
+def test_client_metrics(mocker):
+    metrics = Metrics()
+    client = AppAPIClient("test_app_id", "test_api_key", metrics=metrics)
+    request = PreparedRequest()
+    request.body = "action=qryLoveCode"
+    response = Response()
+    response.status_code = 200
+    response.request = request
+    response.raw = SimpleNamespace(retries=SimpleNamespace(history=[None, None]))
+    response._content = b'{"v": "0.2", "code": "200", "msg": "OK", "details": []}'
+    mocker.patch("requests.Session.post", return_value=response)
+
+    client.get_love_code("test-query")
+    response._content = '{"code": 998, "msg": "appID 不符合規定"}'.encode()
+    with pytest.raises(APIError):
+        client.get_love_code("test-query")
+
+    snapshot = metrics.snapshot()
+    stages = {entry["stage"]: entry["count"] for entry in snapshot["latency"]}
+    assert stages == {"request": 2, "decode": 2, "validate": 1}
+    (transfer,) = snapshot["transfer"]
+    assert transfer["requests"] == 2
+    assert transfer["bytes_out"] == 2 * len(request.body)
+    assert transfer["retries"] == 4
+    assert snapshot["errors"] == [
+        {"endpoint": "lovecode", "action": "qryLoveCode", "code": "998", "count": 1}
+    ]
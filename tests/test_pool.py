@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import pytest
+
+from tw_invoice.exception import APIError, CredentialsExhausted
+from tw_invoice.pool import Credential, CredentialPool
+from tw_invoice.stub import StubServer
+
+TEST_RESULTS = {"code": "200", "msg": "查詢成功", "invoYm": "11006"}
+
+
+def test_pool_clients():
+    pool = CredentialPool(
+        [
+            ("app_1", "key_1"),
+            Credential("app_2", "key_2", uuid="uuid_2", rate_limits={"invapp": 1}),
+        ],
+        rate_limits={"invapp": 5},
+        skip_validation=True,
+    )
+    first, second = pool.clients
+    assert (first.app_id, first.api_key) == ("app_1", "key_1")
+    assert second.uuid == "uuid_2"
+    assert first.rate_limiter.buckets["invapp"].rate == 5
+    assert second.rate_limiter.buckets["invapp"].rate == 1
+    assert first.rate_limiter is not second.rate_limiter
+    assert first.skip_validation and second.skip_validation
+
+    with pytest.raises(ValueError):
+        CredentialPool([])
+    with pytest.raises(ValueError):
+        CredentialPool([("app_1", "key_1")], strategy="random")
+    with pytest.raises(AttributeError):
+        pool.app_id
+
+
+def test_pool_round_robin(mocker):
+    pool = CredentialPool(
+        [(f"app_{i}", f"key_{i}") for i in range(3)], strategy="round_robin"
+    )
+    app_ids = []
+    for client in pool.clients:
+        mocker.patch.object(
+            client,
+            "get_lottery_numbers",
+            side_effect=lambda term, app_id=client.app_id: app_ids.append(app_id),
+        )
+    for _ in range(4):
+        pool.get_lottery_numbers("11006")
+    assert app_ids == ["app_0", "app_1", "app_2", "app_0"]
+
+    pool.disable("app_1", APIError(998, "AppID 不符合規定"))
+    for _ in range(2):
+        pool.get_lottery_numbers("11006")
+    assert app_ids[4:] == ["app_2", "app_0"]
+
+
+def test_pool_least_loaded(mocker):
+    pool = CredentialPool([("app_0", "key_0"), ("app_1", "key_1")])
+    started, release = Event(), Event()
+
+    def slow(term):
+        started.set()
+        release.wait()
+
+    mocker.patch.object(pool.clients[0], "get_lottery_numbers", side_effect=slow)
+    mocked_fast = mocker.patch.object(
+        pool.clients[1], "get_lottery_numbers", return_value=TEST_RESULTS
+    )
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(pool.get_lottery_numbers, "11006")
+        started.wait()
+        assert pool.in_flight("app_0") == 1
+        for _ in range(3):
+            assert pool.get_lottery_numbers("11006") == TEST_RESULTS
+        release.set()
+        future.result()
+    assert mocked_fast.call_count == 3
+    assert pool.in_flight("app_0") == 0
+
+
+def test_pool_revokes_credentials():
+    with StubServer() as server:
+        pool = CredentialPool(
+            [("revoked_app_id", server.api_key), (server.app_id, "wrong_api_key")],
+            base_url=server.url,
+        )
+        # 998 takes the first credential out, the second one answers
+        assert pool.get_love_code("伊甸").details
+        assert list(pool.disabled) == ["revoked_app_id"]
+        assert [client.app_id for client in pool.active] == [server.app_id]
+
+        # Other API errors are raised without revoking the credential
+        server.error_codes["qryLoveCode"] = 903
+        with pytest.raises(APIError):
+            pool.get_love_code("伊甸")
+        assert len(pool.active) == 1
+
+        # 954 on a signed action takes out the last one
+        with pytest.raises(CredentialsExhausted) as error:
+            pool.get_aggregate_carrier("3J0002", "/AB12+-.", "3f56c1f14f83b6eb")
+        assert int(error.value.__cause__.code) == 954
+        assert not pool.active
+
+        pool.enable(server.app_id)
+        assert len(pool.active) == 1
+
+
+def test_pool_quota_cooldown(mocker):
+    now = [100.0]
+    mocker.patch("tw_invoice.pool.monotonic", side_effect=lambda: now[0])
+    pool = CredentialPool(
+        [("app_0", "key_0"), ("app_1", "key_1"), ("app_2", "key_2")],
+        strategy="round_robin",
+        quota_cooldown=60,
+    )
+    errors = {"app_0": APIError(950, "超過最大查詢次數"), "app_1": APIError(997, "停權")}
+    for client in pool.clients:
+        mocker.patch.object(
+            client,
+            "get_lottery_numbers",
+            side_effect=errors.get(client.app_id),
+            return_value=TEST_RESULTS,
+        )
+    assert pool.get_lottery_numbers("11006") == TEST_RESULTS
+    assert pool.disabled["app_0"].until == 160
+    assert pool.disabled["app_1"].until is None
+    assert [client.app_id for client in pool.active] == ["app_2"]
+
+    # Quotas are reset, the credential is back after the cooldown
+    now[0] = 160
+    assert [client.app_id for client in pool.active] == ["app_0", "app_2"]
+    assert "app_0" not in pool.disabled
@@ -0,0 +1,106 @@
+from base64 import b64encode
+from datetime import date
+
+import pytest
+
+from tw_invoice import AppAPIClient
+from tw_invoice.qrcode import (
+    InvoiceQRCode,
+    QRCodeItem,
+    decode_invoice_qrcode,
+    decode_invoice_qrcodes,
+    invoice_detail_args,
+)
+
+HEADER = (
+    "AB11223344"
+    "1020523"
+    "9999"
+    "00000144"
+    "00000154"
+    "00000000"
+    "01234567"
+    "ydXZt4LAN1UHN/j1juVcRA=="
+)
+LEFT = HEADER + ":**********:3:3:1:乾電池:1:105:口罩:1:210"
+RIGHT = "**牛奶:1:25"
+RIGHT_PREFIX = "**"
+ITEMS = (
+    QRCodeItem("乾電池", "1", "105"),
+    QRCodeItem("口罩", "1", "210"),
+    QRCodeItem("牛奶", "1", "25"),
+)
+
+
+def test_decode_invoice_qrcode():
+    invoice = decode_invoice_qrcode(LEFT, RIGHT)
+    assert invoice == InvoiceQRCode(
+        invoice_number="AB11223344",
+        invoice_date=date(2013, 5, 23),
+        invoice_random="9999",
+        sales_amount=0x144,
+        total_amount=0x154,
+        buyer_ban="00000000",
+        seller_ban="01234567",
+        invoice_encrypt="ydXZt4LAN1UHN/j1juVcRA==",
+        item_count=3,
+        total_item_count=3,
+        items=ITEMS,
+    )
+    assert decode_invoice_qrcode(LEFT, items=False).items == ()
+    assert decode_invoice_qrcode(LEFT, "**" + "*" * 10).items == ITEMS[:2]
+    assert decode_invoice_qrcode(HEADER).items == ()
+
+
+def test_decode_invoice_qrcode_encodings():
+    big5 = decode_invoice_qrcode(
+        LEFT.replace(":1:乾", ":0:乾").encode("cp950"), RIGHT.encode("cp950")
+    )
+    assert big5.items == ITEMS
+
+    text = b64encode("乾電池:1:105:口罩:1:210:牛奶:1:25".encode()).decode()
+    base64 = decode_invoice_qrcode(
+        f"{HEADER}:**********:3:3:2:{text[:20]}", RIGHT_PREFIX + text[20:]
+    )
+    assert base64.items == ITEMS
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        HEADER[:-1],
+        "ab" + HEADER[2:],
+        HEADER[:17] + "99a9" + HEADER[21:],
+        HEADER[:10] + "1021323" + HEADER[17:],
+        HEADER[:21] + "0000014G" + HEADER[29:],
+        HEADER[:45] + "0123456X" + HEADER[53:],
+        HEADER + ":**********:3:3:9:",
+    ],
+)
+def test_decode_invalid_qrcode(payload):
+    with pytest.raises(ValueError):
+        decode_invoice_qrcode(payload)
+    assert decode_invoice_qrcodes([payload]).failures == [0]
+
+
+def test_decode_invoice_qrcodes():
+    batch = decode_invoice_qrcodes([(LEFT, RIGHT), "invalid", HEADER.encode()])
+    assert batch.failures == [1]
+    assert batch.invoices[0].items == ITEMS
+    assert batch.invoices[1] is None
+    assert batch.invoices[2] == decode_invoice_qrcode(HEADER)
+
+
+def test_invoice_detail_args(mocker):
+    client = AppAPIClient("test_app_id", "test_api_key")
+    mocked_post = mocker.patch.object(client, "_post")
+    for args in invoice_detail_args([LEFT, "invalid", (LEFT, RIGHT)]):
+        client.get_invoice_detail(*args)
+    assert mocked_post.call_count == 2
+    data = mocked_post.call_args[0][1]
+    assert data["type"] == "QRCode"
+    assert data["invNum"] == "AB11223344"
+    assert data["invDate"] == "2013/05/23"
+    assert data["randomNumber"] == "9999"
+    assert data["encrypt"] == "ydXZt4LAN1UHN/j1juVcRA=="
+    assert data["sellerID"] == "01234567"
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from tw_invoice import AppAPIClient
+from tw_invoice.exception import RateLimitExceeded
+from tw_invoice.ratelimit import RateLimiter, TokenBucket
+from tw_invoice.stub import StubServer
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [100.0]
+    mocker.patch("tw_invoice.ratelimit.monotonic", side_effect=lambda: now[0])
+    return now
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # Over budget, reservations queue up behind each other
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    assert not bucket.try_acquire()
+
+    clock[0] += 10
+    assert bucket.try_acquire()
+
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_rate_limiter_blocking(clock, mocker):
+    mocked_sleep = mocker.patch("tw_invoice.ratelimit.sleep")
+    limiter = RateLimiter({"invapp": (1, 1)})
+
+    limiter.acquire("invapp")
+    mocked_sleep.assert_not_called()
+    limiter.acquire("invapp")
+    mocked_sleep.assert_called_once_with(1.0)
+    # Endpoints without budget are not limited
+    limiter.acquire("lovecode")
+    assert mocked_sleep.call_count == 1
+    assert limiter.queue_depth == 0
+
+
+def test_rate_limiter_fail_fast(clock):
+    limiter = RateLimiter({"donate": 1}, blocking=False)
+    limiter.acquire("donate")
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        limiter.acquire("donate")
+    assert exc_info.value.endpoint == "donate"
+
+
+def test_rate_limiter_queue_depth(clock):
+    limiter = RateLimiter({"carrier": (1, 1)})
+    limiter.acquire("carrier")
+
+    async def main():
+        task = asyncio.ensure_future(limiter.acquire_async("carrier"))
+        await asyncio.sleep(0)
+        depth = limiter.queue_depth
+        task.cancel()
+        return depth
+
+    assert asyncio.run(main()) == 1
+    assert limiter.queue_depth == 0
+    # The cancelled reservation is given back
+    assert limiter.buckets["carrier"].try_acquire() is False
+    clock[0] += 1
+    assert limiter.buckets["carrier"].try_acquire()
+
+
+def test_client_rate_limits(mocker):
+    client = AppAPIClient("test_app_id", "test_api_key", rate_limits={"invapp": 5})
+    assert isinstance(client.rate_limiter, RateLimiter)
+    assert client.queue_depth == 0
+
+    mocked_acquire = mocker.patch.object(client.rate_limiter, "acquire")
+    mocker.patch("requests.Session.post")
+    mocker.patch("tw_invoice.app_client.check_api_error")
+    mocker.patch("tw_invoice.schema.LotteryNumberResponse.parse_obj")
+    client.get_lottery_numbers("11006")
+    mocked_acquire.assert_called_once_with("invapp")
+
+    assert AppAPIClient("test_app_id", "test_api_key").queue_depth == 0
+
+
+def test_client_rate_limits_retries(mocker):
+    with StubServer() as server:
+        client = AppAPIClient(
+            server.app_id,
+            server.api_key,
+            base_url=server.url,
+            rate_limits={"lovecode": 100},
+        )
+        mocked_acquire = mocker.spy(client.rate_limiter, "acquire")
+        server.fail_next(2)
+        assert client.get_love_code("伊甸")
+    # Retries made by the adapter take a token each
+    assert mocked_acquire.call_args_list == [mocker.call("lovecode")] * 3
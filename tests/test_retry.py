@@ -0,0 +1,176 @@
+import asyncio
+
+import httpx
+import pytest
+from requests.exceptions import HTTPError
+
+from tw_invoice import AppAPIClient, AsyncAppAPIClient
+from tw_invoice.exception import APIError, CircuitOpen
+from tw_invoice.retry import CircuitBreaker, RetryBudget, RetryPolicy
+from tw_invoice.stub import StubServer
+from tw_invoice.utils import sign
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [100.0]
+    mocker.patch("tw_invoice.retry.monotonic", side_effect=lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def server():
+    with StubServer(payload_size=1) as server:
+        yield server
+
+
+def stub_client(server, policy):
+    return AppAPIClient(
+        server.app_id, server.api_key, base_url=server.url, retry_policy=policy
+    )
+
+
+def test_retry_budget(clock):
+    budget = RetryBudget(ratio=0.5, min_retries=1, window=10)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    for _ in range(4):
+        budget.deposit()
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    # Requests and retries older than the window are forgotten
+    clock[0] += 10
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_circuit_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    # A single trial call after reset_timeout
+    clock[0] += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_retry_policy():
+    policy = RetryPolicy(base=0.1, cap=1)
+    delay = None
+    for _ in range(20):
+        delay = policy.backoff(delay)
+        assert 0.1 <= delay <= 1
+    assert policy.retryable(APIError(951, "連線逾時"))
+    assert policy.retryable(APIError("999", "未知錯誤"))
+    assert not policy.retryable(APIError(954, "簽名有誤"))
+    assert policy.breaker("invapp") is policy.breaker("invapp")
+    assert policy.breaker("invapp") is not policy.breaker("invserv")
+
+
+def test_api_error_retries(server, mocker):
+    mocked_sleep = mocker.patch("tw_invoice.app_client.sleep")
+    client = stub_client(server, RetryPolicy(max_retries=2))
+
+    server.error_codes["qryLoveCode"] = 951
+    with pytest.raises(APIError):
+        client.get_love_code("伊甸")
+    assert server.counts["qryLoveCode"] == 3
+    assert mocked_sleep.call_count == 2
+
+    # Permanent errors are raised right away
+    server.error_codes["qryLoveCode"] = 903
+    with pytest.raises(APIError):
+        client.get_love_code("伊甸")
+    assert server.counts["qryLoveCode"] == 4
+
+
+def test_signed_retries(server, mocker):
+    mocker.patch("tw_invoice.app_client.sleep")
+    client = stub_client(server, RetryPolicy(max_retries=2))
+    send = mocker.spy(client, "_send")
+
+    server.error_codes["qryCarrierAgg"] = 951
+    with pytest.raises(APIError):
+        client.get_aggregate_carrier("3J0002", "/ABC+123", "encrypt")
+    # Every attempt is a new request with its own serial and signature
+    forms = [dict(call.args[1]) for call in send.call_args_list]
+    assert [form["serial"] for form in forms] == [
+        "0000000001",
+        "0000000002",
+        "0000000003",
+    ]
+    for form in forms:
+        assert form.pop("signature") == sign(form, server.api_key)
+    assert server.counts["qryCarrierAgg"] == 3
+
+
+def test_circuit_open(server, mocker):
+    mocker.patch("tw_invoice.app_client.sleep")
+    client = stub_client(server, RetryPolicy(max_retries=0, failure_threshold=2))
+
+    server.error_codes["qryLoveCode"] = 999
+    for _ in range(2):
+        with pytest.raises(APIError):
+            client.get_love_code("伊甸")
+    with pytest.raises(CircuitOpen) as error:
+        client.get_love_code("伊甸")
+    assert error.value.endpoint == "lovecode"
+    assert server.counts["qryLoveCode"] == 2
+    # Other endpoints are not affected
+    client.get_lottery_numbers("11202")
+
+
+def test_http_retry_budget(server):
+    budget = RetryBudget(ratio=0, min_retries=1)
+    client = stub_client(server, RetryPolicy(max_retries=5, base=0, budget=budget))
+
+    server.fail_next(1)
+    client.get_love_code("伊甸")
+    assert server.counts["qryLoveCode"] == 2
+
+    # Out of budget, the 5xx response is returned instead of retried
+    server.fail_next(5)
+    with pytest.raises(HTTPError):
+        client.get_love_code("伊甸")
+    assert server.counts["qryLoveCode"] == 3
+
+
+def test_async_retries():
+    statuses = [503, 200, 200]
+    codes = ["200", "951", "200"]
+
+    def handler(request):
+        return httpx.Response(
+            statuses.pop(0),
+            json={"v": "0.2", "code": codes.pop(0), "msg": "", "details": []},
+        )
+
+    async def main():
+        client = AsyncAppAPIClient(
+            "test_app_id",
+            "test_api_key",
+            retry_policy=RetryPolicy(max_retries=1, base=0, cap=0),
+        )
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            return await client.get_love_code("伊甸")
+
+    assert asyncio.run(main()).details == []
+    assert not statuses and not codes
@@ -0,0 +1,137 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from threading import Event
+
+import httpx
+import pytest
+
+from tw_invoice import AppAPIClient, AsyncAppAPIClient
+from tw_invoice.singleflight import AsyncSingleFlight, SingleFlight
+from tw_invoice.stub import StubServer
+
+
+def test_singleflight():
+    flight = SingleFlight()
+    started, release = Event(), Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait()
+        return [value]
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        leader = executor.submit(flight.do, "key", slow, 1)
+        started.wait()
+        followers = [executor.submit(flight.do, "key", slow, 2) for _ in range(3)]
+        other = executor.submit(flight.do, "other", lambda: "other")
+        assert other.result() == "other"
+        release.set()
+        results = [leader.result()] + [future.result() for future in followers]
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert len(flight) == 0
+
+    # Calls after the flight landed run again, errors are raised to every caller
+    with pytest.raises(ZeroDivisionError):
+        flight.do("key", lambda: 1 / 0)
+    assert flight.do("key", slow, 3) == [3]
+
+
+def test_async_singleflight():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def slow(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value is None:
+            raise ValueError
+        return [value]
+
+    async def main():
+        results = await asyncio.gather(*(flight.do("key", slow, 1) for _ in range(5)))
+        assert all(result is results[0] for result in results)
+        errors = await asyncio.gather(
+            *(flight.do("error", slow, None) for _ in range(3)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(error, ValueError) for error in errors)
+
+        # Cancelling one waiter does not cancel the shared call
+        waiter = asyncio.ensure_future(flight.do("cancel", slow, 2))
+        other = asyncio.ensure_future(flight.do("cancel", slow, 2))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        assert await other == [2]
+
+    asyncio.run(main())
+    assert calls == [1, None, 2]
+    assert len(flight) == 0
+
+
+def test_client_coalesce():
+    with StubServer(latency=0.2) as server:
+        client = AppAPIClient(
+            server.app_id, server.api_key, base_url=server.url, coalesce=True
+        )
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(
+                    client.get_invoice_header,
+                    "Barcode",
+                    "AB12345678",
+                    date(2023, 1, 1),
+                )
+                for _ in range(8)
+            ]
+            results = [future.result() for future in futures]
+        assert server.counts["qryInvHeader"] == 1
+        assert all(result is results[0] for result in results)
+
+        # Calls that differ, or are not coalesced, are sent separately
+        client.get_invoice_header("Barcode", "AB12345679", date(2023, 1, 1))
+        assert server.counts["qryInvHeader"] == 2
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(client.get_love_code, ["伊甸", "伊甸"]))
+        assert server.counts["qryLoveCode"] == 2
+
+
+def test_async_client_coalesce():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(
+            200,
+            json={
+                "v": "0.5",
+                "code": "200",
+                "msg": "執行成功",
+                "invNum": "AB12345678",
+                "invDate": "20230101",
+                "sellerName": "商家",
+                "invStatus": "已確認",
+                "invPeriod": "11202",
+                "sellerBan": "12345678",
+                "invoiceTime": "12:00:00",
+            },
+        )
+
+    async def main():
+        client = AsyncAppAPIClient("test_app_id", "test_api_key", coalesce=True)
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            return await asyncio.gather(
+                *(
+                    client.get_invoice_header("Barcode", "AB12345678", date(2023, 1, 1))
+                    for _ in range(5)
+                )
+            )
+
+    results = asyncio.run(main())
+    assert len(requests) == 1
+    assert all(result is results[0] for result in results)
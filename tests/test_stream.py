@@ -0,0 +1,189 @@
+import io
+import json
+from datetime import date
+
+import pytest
+from requests.exceptions import HTTPError
+from requests.models import Response
+
+from tw_invoice import AppAPIClient
+from tw_invoice.exception import APIError, CircuitOpen
+from tw_invoice.retry import RetryPolicy
+from tw_invoice.schema import Invoice
+from tw_invoice.stream import CarrierInvoicesHeaderStream, JSONArrayStreamParser
+
+
+def invoice(invoice_number):
+    return {
+        "rowNum": "1",
+        "invNum": invoice_number,
+        "cardType": "3J0002",
+        "cardNo": "/AB12+-.",
+        "sellerName": "統一超商股份有限公司",
+        "invStatus": "已確認",
+        "invDonatable": True,
+        "amount": "81",
+        "invPeriod": "10902",
+        "donateMark": 0,
+        "sellerBan": "22555003",
+        "invoiceTime": "12:00:00",
+        "invDate": {
+            "year": 120,
+            "month": 0,
+            "date": 1,
+            "day": 3,
+            "hours": 0,
+            "minutes": 0,
+            "seconds": 0,
+            "time": 1577808000000,
+            "timezoneOffset": -480,
+        },
+    }
+
+
+RESPONSE = {
+    "v": "0.5",
+    "code": 200,
+    "msg": "執行成功",
+    "onlyWinningInv": "N",
+    "details": [invoice(f"AB0000000{i}") for i in range(5)],
+}
+
+
+def chunks(content, size):
+    return [content[i : i + size] for i in range(0, len(content), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 1024])
+def test_stream(size):
+    content = json.dumps(RESPONSE, ensure_ascii=False, indent=1).encode()
+    stream = CarrierInvoicesHeaderStream(chunks(content, size))
+    invoices = list(stream)
+    assert all(isinstance(item, Invoice) for item in invoices)
+    assert [item.invNum for item in invoices] == [
+        item["invNum"] for item in RESPONSE["details"]
+    ]
+    assert (stream.v, stream.code, stream.msg, stream.onlyWinningInv) == (
+        "0.5",
+        200,
+        "執行成功",
+        "N",
+    )
+
+
+def test_stream_envelope_after_details():
+    response = {"details": [invoice("AB00000001")], "code": 200, "v": "0.5"}
+    stream = CarrierInvoicesHeaderStream(
+        chunks(json.dumps(response).encode(), 3), skip_validation=True
+    )
+    assert list(stream) == response["details"]
+    assert stream.code == 200
+    assert stream.v == "0.5"
+
+
+def test_stream_api_error():
+    content = json.dumps({"code": "903", "msg": "參數錯誤"}).encode()
+    with pytest.raises(APIError) as exc_info:
+        list(CarrierInvoicesHeaderStream(chunks(content, 4)))
+    assert exc_info.value.code == 903
+
+
+@pytest.mark.parametrize("details", [None, {}, "", 0])
+def test_stream_api_error_details(details):
+    response = {"code": 919, "msg": "查無資料", "details": details}
+    content = json.dumps(response, ensure_ascii=False).encode()
+    stream = CarrierInvoicesHeaderStream([content])
+    with pytest.raises(APIError) as exc_info:
+        list(stream)
+    assert exc_info.value.code == 919
+    assert stream.envelope["details"] == details
+
+
+def test_parser_invalid_json():
+    with pytest.raises(ValueError):
+        JSONArrayStreamParser("details").feed("[]", final=True)
+    with pytest.raises(ValueError):
+        JSONArrayStreamParser("details").feed('{"details": [1, 2', final=True)
+    parser = JSONArrayStreamParser("details")
+    # Numbers are only complete once followed by another character
+    assert parser.feed('{"details": [12') == []
+    assert parser.feed("34, 5") == [1234]
+    assert parser.feed("]}", final=True) == [5]
+    assert parser.done
+
+
+def test_client_stream_carrier_invoices_header(mocker):
+    client = AppAPIClient("test_app_id", "test_api_key")
+    response = Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(json.dumps(RESPONSE).encode())
+    mocked_session_post = mocker.patch("requests.Session.post", return_value=response)
+
+    stream = client.stream_carrier_invoices_header(
+        card_type="3J0002",
+        card_number="/AB12+-.",
+        start_date=date(2020, 1, 1),
+        end_date=date(2020, 1, 31),
+        card_encrypt="3f56c1f14f83b6eb",
+    )
+    assert len(list(stream)) == 5
+    assert stream.msg == "執行成功"
+    assert mocked_session_post.call_args[1]["stream"] is True
+    assert mocked_session_post.call_args[1]["data"]["action"] == "carrierInvChk"
+
+
+def stream_response(status_code=200):
+    response = Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(json.dumps(RESPONSE).encode())
+    return response
+
+
+def stream_header(client):
+    return client.stream_carrier_invoices_header(
+        card_type="3J0002",
+        card_number="/AB12+-.",
+        start_date=date(2020, 1, 1),
+        end_date=date(2020, 1, 31),
+        card_encrypt="3f56c1f14f83b6eb",
+    )
+
+
+def test_client_stream_close(mocker):
+    client = AppAPIClient("test_app_id", "test_api_key")
+    mocker.patch(
+        "requests.Session.post",
+        side_effect=lambda *args, **kwargs: stream_response(),
+    )
+
+    # Stopping early closes the response
+    stream = stream_header(client)
+    mocked_close = mocker.spy(stream.response, "close")
+    items = iter(stream)
+    assert isinstance(next(items), Invoice)
+    items.close()
+    assert mocked_close.call_count == 1
+
+    # So does leaving the with block without iterating
+    with stream_header(client) as stream:
+        mocked_close = mocker.spy(stream.response, "close")
+    assert mocked_close.call_count == 1
+
+
+def test_client_stream_circuit_breaker(mocker):
+    client = AppAPIClient(
+        "test_app_id",
+        "test_api_key",
+        retry_policy=RetryPolicy(max_retries=0, failure_threshold=2),
+    )
+    mocked_session_post = mocker.patch(
+        "requests.Session.post",
+        side_effect=lambda *args, **kwargs: stream_response(503),
+    )
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            stream_header(client)
+    with pytest.raises(CircuitOpen) as error:
+        stream_header(client)
+    assert error.value.endpoint == "invserv"
+    assert mocked_session_post.call_count == 2
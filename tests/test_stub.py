@@ -0,0 +1,130 @@
+from datetime import date
+
+import pytest
+
+from tw_invoice import AppAPIClient
+from tw_invoice.exception import APIError
+from tw_invoice.schema import (
+    AggregateCarrierResponse,
+    CarrierInvoiceDonateResponse,
+    CarrierInvoicesDetailResponse,
+    CarrierInvoicesHeaderResponse,
+    InvoiceDetailResponse,
+    InvoiceHeaderResponse,
+    LotteryNumberResponse,
+    LoveCodeResponse,
+)
+from tw_invoice.stub import StubServer
+
+
+@pytest.fixture
+def server():
+    with StubServer(payload_size=3) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    return AppAPIClient(
+        server.app_id, server.api_key, max_retries=3, base_url=server.url
+    )
+
+
+def test_actions(client):
+    lottery = client.get_lottery_numbers("11202")
+    assert isinstance(lottery, LotteryNumberResponse)
+    assert lottery == client.get_lottery_numbers("11202")
+
+    header = client.get_invoice_header("Barcode", "AB12345678", date(2023, 1, 1))
+    assert isinstance(header, InvoiceHeaderResponse)
+    assert header.invPeriod == "11202"
+
+    detail = client.get_invoice_detail(
+        "Barcode", "AB12345678", date(2023, 1, 1), "1234", invoice_term="11202"
+    )
+    assert isinstance(detail, InvoiceDetailResponse)
+    assert len(detail.details) == 3
+
+    love_codes = client.get_love_code("伊甸")
+    assert isinstance(love_codes, LoveCodeResponse)
+    assert len(love_codes.details) == 3
+
+    carrier_args = ("3J0002", "/ABC+123", "card_encrypt")
+    invoices = client.get_carrier_invoices_header(
+        carrier_args[0],
+        carrier_args[1],
+        date(2023, 1, 1),
+        date(2023, 1, 31),
+        carrier_args[2],
+    )
+    assert isinstance(invoices, CarrierInvoicesHeaderResponse)
+    assert [invoice.rowNum for invoice in invoices.details] == ["1", "2", "3"]
+    streamed = client.stream_carrier_invoices_header(
+        carrier_args[0],
+        carrier_args[1],
+        date(2023, 1, 1),
+        date(2023, 1, 31),
+        carrier_args[2],
+    )
+    assert list(streamed) == invoices.details
+
+    invoice = invoices.details[0]
+    carrier_detail = client.get_carrier_invoices_detail(
+        carrier_args[0],
+        carrier_args[1],
+        invoice.invNum,
+        date(2023, 1, 1),
+        carrier_args[2],
+        seller_name=invoice.sellerName,
+        amount=invoice.amount,
+    )
+    assert isinstance(carrier_detail, CarrierInvoicesDetailResponse)
+    assert carrier_detail.amount == invoice.amount
+
+    donate = client.carrier_donate_invoice(
+        *carrier_args[:2], date(2023, 1, 1), invoice.invNum, "1299", carrier_args[2]
+    )
+    assert isinstance(donate, CarrierInvoiceDonateResponse)
+    aggregate = client.get_aggregate_carrier(*carrier_args)
+    assert isinstance(aggregate, AggregateCarrierResponse)
+    assert len(aggregate.carriers) == 3
+
+
+def test_rejected_requests(server, client):
+    # Cross-month carrier queries are rejected like the platform does
+    with pytest.raises(APIError) as error:
+        client.get_carrier_invoices_header(
+            "3J0002", "/ABC+123", date(2023, 1, 1), date(2023, 2, 1), "card_encrypt"
+        )
+    assert error.value.code == 903
+
+    client.api_key = "wrong_api_key"
+    with pytest.raises(APIError) as error:
+        client.get_aggregate_carrier("3J0002", "/ABC+123", "card_encrypt")
+    assert error.value.code == 954
+
+    client.app_id = "wrong_app_id"
+    with pytest.raises(APIError) as error:
+        client.get_love_code("伊甸")
+    assert error.value.code == 998
+
+
+def test_error_codes_and_failures(server, client):
+    server.error_codes["QryWinningList"] = 901
+    with pytest.raises(APIError) as error:
+        client.get_lottery_numbers("11202")
+    assert error.value.code == 901
+
+    # A burst of 5xx within max_retries is retried transparently
+    server.fail_next(2)
+    client.get_love_code("伊甸")
+    assert server.counts["qryLoveCode"] == 3
+
+
+def test_handle(server):
+    form = {"action": "qryLoveCode", "appID": server.app_id, "qKey": "伊甸"}
+    assert server.handle("/unknown", form)[0] == 404
+    status, payload = server.handle("/PB2CAPIVAN/invapp/InvApp", form)
+    assert (status, payload["code"]) == (200, 904)
+    server.fail_next(1, status=500)
+    assert server.handle("/PB2CAPIVAN/CarInv/Donate", form)[0] == 500
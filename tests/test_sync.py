@@ -0,0 +1,181 @@
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+
+from tw_invoice import AppAPIClient
+from tw_invoice.exception import APIError
+from tw_invoice.sync import CarrierSync, Watermark, earliest_query_date
+
+TEST_CARD_ENCRYPT = "3f56c1f14f83b6eb"
+TEST_CARD_NUMBER = "/AB12+-."
+TEST_CARD_TYPE = "3J0002"
+TODAY = date(2020, 3, 15)
+
+
+def header(invoice_number, day, status="已確認"):
+    return {
+        "rowNum": "1",
+        "invNum": invoice_number,
+        "invStatus": status,
+        "sellerName": "統一超商股份有限公司",
+        "amount": "81",
+        "invDate": {"year": 120, "month": 2, "date": day},
+    }
+
+
+@pytest.fixture
+def client():
+    return AppAPIClient("test_app_id", "test_api_key", skip_validation=True)
+
+
+@pytest.fixture
+def engine(client, tmp_path):
+    return CarrierSync(client, str(tmp_path / "sync.sqlite3"))
+
+
+def run(engine, client, mocker, headers, failing=()):
+    mocked_header = mocker.patch.object(
+        client, "iter_carrier_invoices_header", return_value=iter(headers)
+    )
+
+    def get_carrier_invoices_detail(invoice_number, **kwargs):
+        if invoice_number in failing:
+            raise APIError(951, "連線逾時")
+        return {"invNum": invoice_number, "details": []}
+
+    mocked_detail = mocker.patch.object(
+        client, "get_carrier_invoices_detail", side_effect=get_carrier_invoices_detail
+    )
+    results = list(
+        engine.sync(TEST_CARD_TYPE, TEST_CARD_NUMBER, TEST_CARD_ENCRYPT, end_date=TODAY)
+    )
+    start_date = mocked_header.call_args[1]["start_date"]
+    fetched = sorted(
+        kwargs["invoice_number"] for _, kwargs in mocked_detail.call_args_list
+    )
+    return results, start_date, fetched
+
+
+def test_earliest_query_date():
+    assert earliest_query_date(date(2020, 9, 5)) == date(2020, 3, 1)
+    assert earliest_query_date(date(2020, 3, 15)) == date(2019, 9, 1)
+
+
+def test_incremental_sync(engine, client, mocker):
+    assert engine.watermark(TEST_CARD_TYPE, TEST_CARD_NUMBER) is None
+
+    headers = [header("AB00000001", 1), header("AB00000002", 3)]
+    results, start_date, fetched = run(engine, client, mocker, headers)
+    assert start_date == earliest_query_date(TODAY)
+    assert fetched == ["AB00000001", "AB00000002"]
+    assert all(result.error is None for result in results)
+    assert engine.watermark(TEST_CARD_TYPE, TEST_CARD_NUMBER) == Watermark(
+        date(2020, 3, 3), "AB00000002"
+    )
+
+    # Only new and changed invoices are fetched on the next run
+    headers = [
+        header("AB00000002", 3, status="作廢"),
+        header("AB00000003", 3),
+        header("AB00000004", 5),
+    ]
+    results, start_date, fetched = run(engine, client, mocker, headers)
+    assert start_date == date(2020, 3, 3)
+    assert fetched == ["AB00000002", "AB00000003", "AB00000004"]
+
+    headers[0]["rowNum"] = "2"
+    _, _, fetched = run(engine, client, mocker, headers)
+    assert fetched == []
+
+    invoices = list(engine.invoices(TEST_CARD_TYPE, TEST_CARD_NUMBER))
+    assert [invoice["invNum"] for invoice in invoices] == [
+        "AB00000001",
+        "AB00000002",
+        "AB00000003",
+        "AB00000004",
+    ]
+    assert invoices[1]["invStatus"] == "作廢"
+    assert invoices[1]["detail"] == {"invNum": "AB00000002", "details": []}
+
+
+def test_resume_after_failure(engine, client, mocker):
+    headers = [
+        header("AB00000001", 1),
+        header("AB00000002", 3),
+        header("AB00000003", 7),
+    ]
+    results, _, _ = run(engine, client, mocker, headers, failing={"AB00000002"})
+    errors = [result for result in results if result.error is not None]
+    assert [result.invoice["invNum"] for result in errors] == ["AB00000002"]
+    # The watermark stays at the failed invoice so it is retried
+    assert engine.watermark(TEST_CARD_TYPE, TEST_CARD_NUMBER) == Watermark(
+        date(2020, 3, 3), None
+    )
+
+    results, start_date, fetched = run(engine, client, mocker, headers[1:])
+    assert start_date == date(2020, 3, 3)
+    assert fetched == ["AB00000002"]
+    assert engine.watermark(TEST_CARD_TYPE, TEST_CARD_NUMBER) == Watermark(
+        date(2020, 3, 7), "AB00000003"
+    )
+
+
+def test_interrupted_sync_keeps_watermark(engine, client, mocker):
+    engine.set_watermark(
+        TEST_CARD_TYPE, TEST_CARD_NUMBER, Watermark(date(2020, 3, 1), None)
+    )
+    mocker.patch.object(
+        client,
+        "iter_carrier_invoices_header",
+        return_value=iter([header("AB00000001", 2), header("AB00000002", 4)]),
+    )
+    mocker.patch.object(client, "get_carrier_invoices_detail", return_value={})
+    results = engine.sync(
+        TEST_CARD_TYPE, TEST_CARD_NUMBER, TEST_CARD_ENCRYPT, end_date=TODAY
+    )
+    next(results)
+    results.close()
+    assert engine.watermark(TEST_CARD_TYPE, TEST_CARD_NUMBER) == Watermark(
+        date(2020, 3, 1), None
+    )
+    assert len(list(engine.invoices(TEST_CARD_TYPE, TEST_CARD_NUMBER))) == 1
+
+
+def test_stored_fingerprints_follow_window(engine, client, mocker):
+    run(engine, client, mocker, [header("AB00000001", 1), header("AB00000002", 5)])
+    stored = engine._stored_fingerprints(
+        TEST_CARD_TYPE, TEST_CARD_NUMBER, date(2020, 3, 5)
+    )
+    assert list(stored) == ["AB00000002"]
+
+
+def test_migrate_fingerprints(client, tmp_path, mocker):
+    path = str(tmp_path / "sync.sqlite3")
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE invoices (card_type TEXT NOT NULL, card_number TEXT "
+            "NOT NULL, inv_num TEXT NOT NULL, inv_date TEXT NOT NULL, header TEXT "
+            "NOT NULL, detail TEXT NOT NULL, PRIMARY KEY (card_type, card_number, "
+            "inv_num))"
+        )
+        connection.execute(
+            "INSERT INTO invoices VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                TEST_CARD_TYPE,
+                TEST_CARD_NUMBER,
+                "AB00000001",
+                "2020-03-01",
+                json.dumps(header("AB00000001", 1), ensure_ascii=False),
+                "{}",
+            ),
+        )
+    connection.close()
+
+    # Fingerprints of stored invoices are filled in, unchanged ones are skipped
+    engine = CarrierSync(client, path)
+    _, _, fetched = run(
+        engine, client, mocker, [header("AB00000001", 1), header("AB00000002", 2)]
+    )
+    assert fetched == ["AB00000002"]
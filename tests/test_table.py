@@ -0,0 +1,129 @@
+from datetime import date, datetime
+
+import pytest
+
+from tw_invoice.schema import CarrierInvoicesHeaderResponse
+from tw_invoice.table import TAIPEI, InvoiceRow, InvoiceTable
+
+
+def invoice(invoice_number, day, seller_ban, amount, donated=0):
+    return {
+        "rowNum": "1",
+        "invNum": invoice_number,
+        "cardType": "3J0002",
+        "cardNo": "/AB12+-.",
+        "sellerName": f"商家{seller_ban}",
+        "invStatus": "已確認",
+        "invDonatable": True,
+        "amount": str(amount),
+        "invPeriod": "10902",
+        "donateMark": donated,
+        "sellerBan": seller_ban,
+        "invoiceTime": "12:34:56",
+        "invDate": {
+            "year": 120,
+            "month": 0,
+            "date": day,
+            "day": 3,
+            "hours": 0,
+            "minutes": 0,
+            "seconds": 0,
+            "time": int(datetime(2020, 1, day, tzinfo=TAIPEI).timestamp()) * 1000,
+            "timezoneOffset": -480,
+        },
+    }
+
+
+def response(*invoices):
+    return {
+        "v": "0.5",
+        "code": 200,
+        "msg": "執行成功",
+        "onlyWinningInv": "N",
+        "details": list(invoices),
+    }
+
+
+RESPONSES = [
+    response(
+        invoice("AB00000001", 1, "22555003", 81),
+        invoice("AB00000002", 2, "12345678", 120, donated=1),
+    ),
+    response(
+        invoice("AB00000002", 2, "12345678", 120, donated=1),
+        invoice("AB00000003", 3, "22555003", 35),
+    ),
+]
+
+
+@pytest.mark.parametrize("model", [False, True])
+def test_invoice_table(model):
+    responses = RESPONSES
+    if model:
+        responses = [CarrierInvoicesHeaderResponse.parse_obj(r) for r in responses]
+    table = InvoiceTable.from_responses(responses)
+    assert len(table) == 3
+    assert table[1] == InvoiceRow(
+        invoice_number="AB00000002",
+        card_type="3J0002",
+        card_number="/AB12+-.",
+        seller_name="商家12345678",
+        seller_ban="12345678",
+        seller_address=None,
+        buyer_ban=None,
+        status="已確認",
+        period="10902",
+        currency=None,
+        amount=120,
+        donatable=True,
+        donated=True,
+        timestamp=int(datetime(2020, 1, 2, 12, 34, 56, tzinfo=TAIPEI).timestamp()),
+    )
+    assert table[-1].invoice_date == date(2020, 1, 3)
+    assert table[0].invoice_datetime.hour == 12
+    with pytest.raises(IndexError):
+        table[3]
+
+    assert table.column("invoice_number") == ["AB00000001", "AB00000002", "AB00000003"]
+    assert table.column("seller_ban") == ["22555003", "12345678", "22555003"]
+    assert list(table.column("amount")) == [81, 120, 35]
+    assert table.column("donated") == [False, True, False]
+    assert sum(table.amounts) == 236
+    # Interned values are stored once
+    assert table._categories["seller_ban"].values == ["22555003", "12345678"]
+
+    assert len(InvoiceTable.from_responses(responses, unique=False)) == 4
+
+
+def test_invoice_table_where():
+    table = InvoiceTable.from_responses(RESPONSES)
+    assert table.where(seller_ban="22555003").column("invoice_number") == [
+        "AB00000001",
+        "AB00000003",
+    ]
+    assert len(table.where(seller_ban="00000000")) == 0
+    assert [row.amount for row in table.where(min_amount=50, max_amount=100)] == [81]
+    selected = table.where(start=date(2020, 1, 2), end=date(2020, 1, 3))
+    assert [row.invoice_number for row in selected] == ["AB00000002"]
+    assert len(table.where(seller_ban="22555003", min_amount=50)) == 1
+    with pytest.raises(ValueError):
+        table.where(amount=81)
+
+
+def test_invoice_table_without_time():
+    day = {"year": 120, "month": 0, "date": 1}
+    table = InvoiceTable()
+    table.extend([dict(invoice("AB00000001", 1, "22555003", 81), invDate=day)])
+    assert table[0].invoice_datetime == datetime(2020, 1, 1, 12, 34, 56, tzinfo=TAIPEI)
+    with pytest.raises(ValueError):
+        table.extend([invoice("AB0000001", 1, "22555003", 81)])
+
+
+def test_invoice_table_memory():
+    invoices = [
+        invoice(f"AB{index:08d}", index % 28 + 1, f"{index % 50:08d}", index)
+        for index in range(1000)
+    ]
+    table = InvoiceTable.from_responses([response(*invoices)])
+    assert len(table) == 1000
+    assert table.nbytes / len(table) < 64
@@ -1,16 +1,61 @@
+from datetime import date
+
 import pytest
 from requests.exceptions import HTTPError
 from requests.models import Response
 
 from tw_invoice.exception import APIError
+from tw_invoice.schema import InvoiceDate, LoveCodeResponse
 from tw_invoice.utils import (
+    Signer,
+    as_dict,
+    check_api_code,
     check_api_error,
+    decode_content,
+    decode_response,
+    parse_invoice_date,
+    sign,
+    split_date_range,
+    validate_ban,
+    validate_bans,
     validate_invoice_number,
+    validate_invoice_numbers,
     validate_invoice_random,
+    validate_invoice_randoms,
     validate_invoice_term,
+    validate_invoice_terms,
     validate_phone_barcode,
+    validate_phone_barcodes,
 )
 
+BATCH_VALIDATORS = [
+    (
+        validate_invoice_number,
+        validate_invoice_numbers,
+        ["AB12345678", "ab12345678", "AB1234567", "AB123456789", "AB1234567８"],
+    ),
+    (
+        validate_invoice_random,
+        validate_invoice_randoms,
+        ["0123", "012", "01234", "012a", "1234\n", "１２３４"],
+    ),
+    (
+        validate_invoice_term,
+        validate_invoice_terms,
+        ["10902", "11212", "10900", "10901", "10914", "11002", "1090２"],
+    ),
+    (
+        validate_phone_barcode,
+        validate_phone_barcodes,
+        ["/AB12+-.", "/ab12+-.", "AB12+-.", "/AB12+-", "/AB12+-.9", "/AB12+-_"],
+    ),
+    (
+        validate_ban,
+        validate_bans,
+        ["01234567", "0123456", "012345678", "0123456a", "0123456７"],
+    ),
+]
+
 
 @pytest.fixture
 def client_error():
@@ -63,6 +108,69 @@ def test_check_api_error(client_error, server_error, api_error, api_success):
     assert data["code"] == "200"
 
 
+def test_check_api_code():
+    with pytest.raises(APIError):
+        check_api_code({"code": 998, "msg": "appID 不符合規定 (停權或尚未申請)"})
+
+    data = check_api_code({"code": "200", "msg": "OK"})
+    assert data["code"] == "200"
+
+
+def test_decode_content():
+    content = (
+        '{"v": "0.2", "code": "200", "msg": "執行成功", "details": [{"rowNum": 1, '
+        '"SocialWelfareBAN": "12345678", "LoveCode": "123", '
+        '"SocialWelfareName": "財團法人伊甸社會福利基金會"}]}'
+    ).encode()
+    results = decode_content(content, LoveCodeResponse)
+    assert isinstance(results, LoveCodeResponse)
+    assert results.details[0].LoveCode == "123"
+    assert decode_content(content)["details"][0]["LoveCode"] == "123"
+
+    error = '{"code": 998, "msg": "appID 不符合規定"}'.encode()
+    with pytest.raises(APIError):
+        decode_content(error, LoveCodeResponse)
+    with pytest.raises(APIError):
+        decode_content(error)
+
+    with pytest.raises(ValueError):
+        decode_content(b'{"code": 200, "msg": "OK"}', LoveCodeResponse)
+
+
+def test_decode_response(client_error, api_success):
+    with pytest.raises(TypeError):
+        decode_response(None)
+    with pytest.raises(HTTPError):
+        decode_response(client_error)
+
+    api_success._content = b'{"code": "200", "msg": "OK"}'
+    assert decode_response(api_success) == {"code": "200", "msg": "OK"}
+
+
+def test_sign():
+    data = {
+        "version": 1.0,
+        "serial": "0000000001",
+        "action": "qryCarrierAgg",
+        "cardType": "3J0002",
+        "cardNo": "/AB12+-.",
+        "cardEncrypt": "3f56c1f14f83b6eb",
+        "appID": "test_app_id",
+        "timeStamp": 1655654420,
+        "uuid": "test_uuid",
+    }
+    signature = "2pWN1GfP6S7oncE56OJetvpxGlE1tFYHeqgNwHmIuw4="
+    assert sign(data, "test_api_key") == signature
+    signer = Signer("test_api_key")
+    # The keyed state and field order are reused across calls
+    assert signer.sign(data) == signature
+    assert signer.sign(data) == signature
+    assert signer.sign(dict(data, serial="0000000002")) != signature
+    # Empty fields are left out of the signature
+    assert signer.sign(dict(data, amount=None)) == signature
+    assert Signer("other_api_key").sign(data) != signature
+
+
 def test_validate_invoice_number():
     assert not validate_invoice_number(None)
     assert not validate_invoice_number("")
@@ -96,3 +204,70 @@ def test_validate_phone_barcode():
     assert not validate_phone_barcode("5ab562e60d9ba2ee")
     assert not validate_phone_barcode("AB12+-.")
     assert validate_phone_barcode("/AB12+-.")
+
+
+def test_validate_ban():
+    assert not validate_ban(None)
+    assert not validate_ban("")
+    assert not validate_ban("1234567")
+    assert validate_ban("01234567")
+
+
+@pytest.mark.parametrize("validate, validate_many, values", BATCH_VALIDATORS)
+def test_validate_batch(validate, validate_many, values):
+    values = values + [None, 12345678]
+    expected = [validate(value) for value in values]
+    mask, failures = validate_many(values)
+    assert mask == expected
+    assert failures == [index for index, valid in enumerate(expected) if not valid]
+    assert validate_many([]) == ([], [])
+    # One-shot iterators are read once, even when they hold non-str values
+    assert validate_many(iter(values)) == (expected, failures)
+
+
+@pytest.mark.parametrize("validate, validate_many, values", BATCH_VALIDATORS)
+def test_validate_batch_numpy(validate, validate_many, values):
+    numpy = pytest.importorskip("numpy")
+    expected = [validate(value) for value in values]
+    mask, failures = validate_many(numpy.array(values))
+    assert mask.tolist() == expected
+    assert failures == [index for index, valid in enumerate(expected) if not valid]
+    mask, failures = validate_many(numpy.array(values + [None], dtype=object))
+    assert mask.tolist() == expected + [False]
+    assert validate_many(numpy.array([], dtype=str)).failures == []
+
+
+def test_parse_invoice_date():
+    invoice_date = {
+        "year": 112,
+        "month": 6,
+        "date": 9,
+        "day": 1,
+        "hours": 0,
+        "minutes": 0,
+        "seconds": 0,
+        "time": 1341763200000,
+        "timezoneOffset": -480,
+    }
+    assert parse_invoice_date(invoice_date) == date(2012, 7, 9)
+    assert parse_invoice_date(InvoiceDate(**invoice_date)) == date(2012, 7, 9)
+
+
+def test_as_dict():
+    response = {"v": "0.2", "code": "200", "msg": "", "details": []}
+    assert as_dict(response) is response
+    assert as_dict(LoveCodeResponse.parse_obj(response)) == response
+
+
+def test_split_date_range():
+    assert split_date_range(date(2020, 1, 5), date(2020, 1, 20)) == [
+        (date(2020, 1, 5), date(2020, 1, 20))
+    ]
+    assert split_date_range(date(2019, 12, 15), date(2020, 3, 2)) == [
+        (date(2019, 12, 15), date(2019, 12, 31)),
+        (date(2020, 1, 1), date(2020, 1, 31)),
+        (date(2020, 2, 1), date(2020, 2, 29)),
+        (date(2020, 3, 1), date(2020, 3, 2)),
+    ]
+    with pytest.raises(ValueError):
+        split_date_range(date(2020, 2, 1), date(2020, 1, 1))
@@ -1,5 +1,31 @@
 """🇹🇼🧾 Python SDK for accessing Taiwan E-Inovice API"""
-from .app_client import AppAPIClient  # noqa
-from .carrier import CARD_TYPE  # noqa
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .app_client import AppAPIClient  # noqa
+    from .async_client import AsyncAppAPIClient  # noqa
+    from .carrier import CARD_TYPE  # noqa
 
 __version__ = "2023.9.6"
+
+# Exports imported on first access, so `import tw_invoice` does not load the
+# HTTP stack and pydantic models until a client is used
+_LAZY_EXPORTS = {
+    "AppAPIClient": ".app_client",
+    "AsyncAppAPIClient": ".async_client",
+    "CARD_TYPE": ".carrier",
+}
+__all__ = [*_LAZY_EXPORTS, "__version__"]
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *_LAZY_EXPORTS})
@@ -1,6 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import date
-from time import time
-from typing import Tuple, Union
+from importlib import import_module
+from threading import Lock
+from time import sleep, time
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Tuple,
+    Type,
+    Union,
+)
 from uuid import uuid4
 
 try:
@@ -8,30 +23,202 @@ try:
 except ImportError:
     from typing_extensions import Literal
 
-from requests import Session
-from requests.adapters import HTTPAdapter, Retry
-
-from .schema import (
-    AggregateCarrierResponse,
-    CarrierInvoiceDonateResponse,
-    CarrierInvoicesDetailResponse,
-    CarrierInvoicesHeaderResponse,
-    InvoiceDetailResponse,
-    InvoiceHeaderResponse,
-    LotteryNumberResponse,
-    LoveCodeResponse,
-)
+from .exception import APIError
 from .utils import (
+    BASE_URL,
+    Signer,
     build_api_url,
     check_api_error,
-    sign,
+    decode_response,
+    parse_invoice_date,
+    split_date_range,
     validate_invoice_number,
     validate_invoice_random,
     validate_invoice_term,
 )
 
+if TYPE_CHECKING:  # pragma: no cover
+    from pydantic import BaseModel
+    from requests import Session
+    from requests.models import Response
+
+    from .cache import BaseCache, CachePolicy
+    from .metrics import Metrics
+    from .ratelimit import Budget, RateLimiter
+    from .retry import RetryPolicy
+    from .schema import (
+        AggregateCarrierResponse,
+        CarrierInvoicesDetailResponse,
+        CarrierInvoicesHeaderResponse,
+        Invoice,
+        InvoiceHeaderResponse,
+        LotteryNumberResponse,
+    )
+    from .singleflight import SingleFlight
+    from .stream import CarrierInvoicesHeaderStream
+
+RETRY_BACKOFF_FACTOR = 0.1
+RETRY_STATUS_FORCELIST = [500, 502, 503, 504]
+TERM_NOT_FOUND = 901  # 無此期別資料
+STREAM_CHUNK_SIZE = 64 * 1024
+# Unsigned queries whose identical in-flight calls share one request
+COALESCED_ACTIONS = {"QryWinningList", "qryInvHeader", "qryInvDetail"}
+EXP_TIMESTAMP = "2147483647"
+# Seconds invoice lookups are kept in `response_cache`, only `invStatus` of an
+# invoice changes once it is issued (e.g. when voided)
+RESPONSE_CACHE_TTLS = {"qryInvHeader": 600, "qryInvDetail": 3600}
+
+# Static fields of each action, `appID` and `UUID` (`uuid`) are filled per client
+REQUEST_TEMPLATES = {
+    "QryWinningList": {"version": 0.2, "action": "QryWinningList", "UUID": None},
+    "qryInvHeader": {
+        "version": 0.5,
+        "action": "qryInvHeader",
+        "generation": "V2",
+        "UUID": None,
+    },
+    "qryInvDetail": {
+        "version": 0.6,
+        "action": "qryInvDetail",
+        "generation": "V2",
+        "UUID": None,
+    },
+    "qryLoveCode": {"version": 0.2, "action": "qryLoveCode", "UUID": None},
+    "carrierInvChk": {
+        "version": 0.5,
+        "action": "carrierInvChk",
+        "expTimeStamp": EXP_TIMESTAMP,
+        "uuid": None,
+    },
+    "carrierInvDetail": {
+        "version": 0.5,
+        "action": "carrierInvDetail",
+        "expTimeStamp": EXP_TIMESTAMP,
+        "uuid": None,
+    },
+    "carrierInvDnt": {
+        "version": 0.1,
+        "action": "carrierInvDnt",
+        "expTimeStamp": EXP_TIMESTAMP,
+        "uuid": None,
+    },
+    "qryCarrierAgg": {"version": 1.0, "action": "qryCarrierAgg", "uuid": None},
+}
+
+# Schema models are loaded on first validation, requests and pydantic are not
+# imported until a client is created or a response validated
+SCHEMA_EXPORTS = (
+    "AggregateCarrierResponse",
+    "CarrierInvoiceDonateResponse",
+    "CarrierInvoicesDetailResponse",
+    "CarrierInvoicesHeaderResponse",
+    "Invoice",
+    "InvoiceDetailResponse",
+    "InvoiceHeaderResponse",
+    "LotteryNumberResponse",
+    "LoveCodeResponse",
+)
+
+CarrierInvoices = Union[
+    "CarrierInvoicesHeaderResponse", dict, Iterable[Union["Invoice", dict]]
+]
+
+
+def response_model(name: str) -> Type["BaseModel"]:
+    """Schema model `name`, importing the schema and pydantic on first use"""
+    return getattr(import_module(".schema", __package__), name)
+
+
+def __getattr__(name: str):
+    if name in SCHEMA_EXPORTS:
+        return response_model(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class CarrierInvoiceDetailResult(NamedTuple):
+    invoice: Union["Invoice", dict]
+    detail: Union["CarrierInvoicesDetailResponse", dict, None]
+    error: Union[Exception, None]
+
+
+def compile_request_templates(app_id: str, uuid: str) -> Dict[str, dict]:
+    """Fill `appID` and `UUID` of REQUEST_TEMPLATES for a client"""
+    templates = {}
+    for action, template in REQUEST_TEMPLATES.items():
+        template = dict(template, appID=app_id)
+        template.update({key: uuid for key in ("UUID", "uuid") if key in template})
+        templates[action] = template
+    return templates
+
+
+def request_key(endpoint: str, data: dict) -> tuple:
+    """Normalized key of a request, equal for requests with the same fields"""
+    return (endpoint, tuple(sorted(data.items())))
+
+
+def carrier_invoice_rows(invoices: CarrierInvoices) -> List[Union["Invoice", dict]]:
+    """Extract invoice rows from a carrier invoices header response"""
+    if isinstance(invoices, dict):
+        return invoices["details"]
+    # CarrierInvoicesHeaderResponse, checked by attribute so the schema is
+    # not imported for dicts and lists
+    details = getattr(invoices, "details", None)
+    if details is not None:
+        return details
+    return list(invoices)
+
+
+def unique_carrier_invoices(
+    responses: Iterable[Union["CarrierInvoicesHeaderResponse", dict]],
+    seen: Union[set, None] = None,
+) -> Iterator[Union["Invoice", dict]]:
+    """Merge invoice rows of carrier invoices header responses, dropping duplicates"""
+    seen = set() if seen is None else seen
+    for response in responses:
+        for invoice in carrier_invoice_rows(response):
+            invoice_number = (
+                invoice["invNum"] if isinstance(invoice, dict) else invoice.invNum
+            )
+            if invoice_number not in seen:
+                seen.add(invoice_number)
+                yield invoice
+
+
+def carrier_invoice_detail_params(invoice: Union["Invoice", dict]) -> dict:
+    """Map an invoice row of carrier invoices header to detail query parameters"""
+    fields = ("invNum", "invDate", "sellerName", "amount")
+    if isinstance(invoice, dict):
+        values = [invoice[field] for field in fields]
+    else:
+        values = [getattr(invoice, field) for field in fields]
+    invoice_number, invoice_date, seller_name, amount = values
+    return {
+        "invoice_number": invoice_number,
+        "invoice_date": parse_invoice_date(invoice_date),
+        "seller_name": seller_name,
+        "amount": amount,
+    }
+
 
 class AppAPIClient(object):
+    """
+    Client of the E-invoice platform application API
+
+    A client is thread-safe and meant to be shared by worker threads: serials
+    of signed requests are allocated atomically, and the HTTP session keeps a
+    pool of up to `pool_maxsize` connections per host. With `pool_block`,
+    threads wait for a free connection instead of opening extra ones that are
+    discarded after use.
+
+    With a `retry_policy`, retries use its jitter, budget and `max_retries`
+    instead of the fixed exponential backoff of `max_retries`, retryable
+    `APIError` are retried too, and each endpoint is guarded by a circuit
+    breaker.
+
+    With `coalesce`, concurrent identical lottery numbers, invoice header and
+    invoice detail queries share one request and one parsed result object.
+    """
+
     def __init__(
         self,
         app_id: str,
@@ -41,86 +228,415 @@ class AppAPIClient(object):
         max_retries: int = 20,
         skip_validation: bool = False,
         timeout: Union[float, Tuple[float, float], Tuple[float, None]] = (3, 1),
+        rate_limits: Union[Dict[str, "Budget"], "RateLimiter", None] = None,
+        rate_limit_blocking: bool = True,
+        lottery_cache: Union["BaseCache", None] = None,
+        lottery_error_ttl: float = 300,
+        fast_decode: bool = False,
+        metrics: Union["Metrics", None] = None,
+        base_url: str = BASE_URL,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        pool_block: bool = False,
+        retry_policy: Union["RetryPolicy", None] = None,
+        coalesce: bool = False,
+        response_cache: Union["BaseCache", None] = None,
+        response_cache_ttls: Union[Dict[str, float], None] = None,
     ):
-        self.app_id = app_id
+        self._app_id = app_id
+        self._uuid = str(uuid) if uuid else str(uuid4())
+        self._templates = None
         self.api_key = api_key
-        self.uuid = str(uuid) if uuid else str(uuid4())
         if ts_tolerance < 10 or ts_tolerance > 180:
             raise ValueError("ts_tolerance must be between 10 and 180")
         self.ts_tolerance = ts_tolerance
         if not isinstance(skip_validation, bool):
             raise ValueError("skip_validation must be a boolean")
         self.skip_validation = skip_validation
-        self.serial = 1
-        self.session = Session()
-        self.session.headers.update(
-            {"Content-Type": "application/x-www-form-urlencoded"}
+        self.fast_decode = fast_decode
+        self.metrics = metrics
+        self.base_url = base_url
+        if isinstance(rate_limits, dict):
+            from .ratelimit import RateLimiter
+
+            rate_limits = RateLimiter(rate_limits, blocking=rate_limit_blocking)
+        self.rate_limiter = rate_limits
+        self.lottery_cache = lottery_cache
+        self.lottery_error_ttl = lottery_error_ttl
+        self.response_cache = response_cache
+        self.response_cache_ttls = {
+            **RESPONSE_CACHE_TTLS,
+            **(response_cache_ttls or {}),
+        }
+        self._serial = 1
+        self._serial_lock = Lock()
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.retry_policy = retry_policy
+        self.singleflight = self._create_singleflight() if coalesce else None
+        self.session = self._create_session()
+
+    @property
+    def app_id(self) -> str:
+        return self._app_id
+
+    @app_id.setter
+    def app_id(self, app_id: str) -> None:
+        self._app_id = app_id
+        self._templates = None
+
+    @property
+    def uuid(self) -> str:
+        return self._uuid
+
+    @uuid.setter
+    def uuid(self, uuid: str) -> None:
+        self._uuid = str(uuid)
+        self._templates = None
+
+    @property
+    def api_key(self) -> str:
+        return self._api_key
+
+    @api_key.setter
+    def api_key(self, api_key: str) -> None:
+        self._api_key = api_key
+        self.signer = Signer(api_key)
+
+    @property
+    def serial(self) -> int:
+        """Serial of the next signed request"""
+        return self._serial
+
+    @serial.setter
+    def serial(self, serial: int) -> None:
+        with self._serial_lock:
+            self._serial = serial
+
+    def _next_serial(self) -> str:
+        with self._serial_lock:
+            serial = self._serial
+            self._serial += 1
+        return f"{serial:0>10}"
+
+    def _template(self, action: str) -> dict:
+        """Copy of the static fields of `action`"""
+        if self._templates is None:
+            self._templates = compile_request_templates(self._app_id, self._uuid)
+        return dict(self._templates[action])
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of calls currently waiting for rate limit budget"""
+        return self.rate_limiter.queue_depth if self.rate_limiter else 0
+
+    def _create_singleflight(self) -> "SingleFlight":
+        from .singleflight import SingleFlight
+
+        return SingleFlight()
+
+    def _create_session(self) -> "Session":
+        from requests import Session
+        from requests.adapters import HTTPAdapter, Retry
+
+        session = Session()
+        session.headers.update({"Content-Type": "application/x-www-form-urlencoded"})
+        retry_options = {
+            "allowed_methods": ["POST"],
+            "status_forcelist": RETRY_STATUS_FORCELIST,
+            "raise_on_status": False,
+        }
+        policy = self.retry_policy
+        if policy is None and self.rate_limiter is None:
+            retry = Retry(
+                total=self.max_retries,
+                backoff_factor=RETRY_BACKOFF_FACTOR,
+                **retry_options,
+            )
+        else:
+            from .retry import PolicyRetry
+
+            # Retries made by the adapter are charged to the rate limiter too
+            retry = PolicyRetry(
+                total=self.max_retries if policy is None else policy.max_retries,
+                backoff_factor=RETRY_BACKOFF_FACTOR,
+                policy=policy,
+                rate_limiter=self.rate_limiter,
+                **retry_options,
+            )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=retry,
         )
-        self.session.mount(
-            "https://",
-            HTTPAdapter(
-                max_retries=Retry(
-                    total=max_retries,
-                    backoff_factor=0.1,
-                    allowed_methods=["POST"],
-                    status_forcelist=[500, 502, 503, 504],
-                    raise_on_status=False,
-                )
-            ),
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _timer(self, stage: str, endpoint: str, data: dict):
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.timer(stage, endpoint, data["action"])
+
+    def _request(self, endpoint: str, data: dict, **kwargs) -> "Response":
+        if self.rate_limiter:
+            self.rate_limiter.acquire(endpoint)
+        with self._timer("request", endpoint, data):
+            response = self.session.post(
+                build_api_url(endpoint, self.base_url),
+                data=data,
+                timeout=self.timeout,
+                **kwargs,
+            )
+        if self.metrics is not None:
+            retries = getattr(response.raw, "retries", None)
+            self.metrics.observe_transfer(
+                endpoint,
+                data["action"],
+                len(response.request.body or ""),
+                int(response.headers.get("Content-Length", 0))
+                if kwargs.get("stream")
+                else len(response.content),
+                len(retries.history) if retries else 0,
+            )
+        return response
+
+    def _send(self, endpoint: str, data: dict) -> dict:
+        response = self._request(endpoint, data)
+        with self._timer("decode", endpoint, data):
+            return check_api_error(response)
+
+    def _fetch(self, endpoint: str, data: dict, model: str):
+        response = self._request(endpoint, data)
+        with self._timer("decode", endpoint, data):
+            return decode_response(
+                response, None if self.skip_validation else response_model(model)
+            )
+
+    def _sleep(self, seconds: float) -> None:
+        sleep(seconds)
+
+    def _is_transport_error(self, error: Exception) -> bool:
+        from requests import RequestException
+
+        return isinstance(error, RequestException)
+
+    def _run(self, steps: Generator):
+        """
+        Run the steps of a call: call each (function, args) yielded by `steps`
+        and resume it with the result, or throw the exception into it
+        """
+        value, resume = None, steps.send
+        while True:
+            try:
+                function, args = resume(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, resume = function(*args), steps.send
+            except Exception as error:
+                value, resume = error, steps.throw
+
+    def _resign(self, data: dict) -> dict:
+        """Copy of signed `data` with the next serial, timestamp and signature"""
+        data = dict(
+            data,
+            serial=self._next_serial(),
+            timeStamp=int(time() + self.ts_tolerance),
         )
-        self.timeout = timeout
+        del data["signature"]
+        data["signature"] = self.signer.sign(data)
+        return data
+
+    def _attempt_steps(self, call, endpoint: str, data: dict, *args) -> Generator:
+        """
+        Steps of `call(endpoint, data, *args)` under the retry policy, if any
+
+        Steps are run by `_run`, which the async client overrides to await
+        them, so both clients share this policy. Signed requests are retried
+        with a new serial, serials are unique per request.
+        """
+        policy = self.retry_policy
+        if policy is None:
+            return (yield call, (endpoint, data, *args))
+        breaker = policy.check(endpoint)
+        policy.budget.deposit()
+        delay = None
+        for retry in range(policy.max_retries + 1):
+            try:
+                results = yield call, (endpoint, data, *args)
+            except APIError as error:
+                if not policy.retryable(error):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if (
+                    retry == policy.max_retries
+                    or not breaker.allow()
+                    or not policy.budget.withdraw()
+                ):
+                    raise
+            except Exception as error:
+                if self._is_transport_error(error):
+                    # Already retried by the transport, only 5xx and network
+                    # errors count against the endpoint
+                    response = getattr(error, "response", None)
+                    if response is not None and response.status_code < 500:
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure()
+                raise
+            else:
+                breaker.record_success()
+                return results
+            delay = policy.backoff(delay)
+            yield self._sleep, (delay,)
+            if "signature" in data:
+                data = self._resign(data)
+
+    def _attempt(self, call, endpoint: str, data: dict, *args):
+        """Make `call(endpoint, data, *args)` under the retry policy, if any"""
+        return self._run(self._attempt_steps(call, endpoint, data, *args))
+
+    def _perform_steps(
+        self,
+        endpoint: str,
+        data: dict,
+        model: str,
+        cache: Union["CachePolicy", None] = None,
+    ) -> Generator:
+        if self.fast_decode and not cache:
+            return (yield from self._attempt_steps(self._fetch, endpoint, data, model))
+        results = cache.lookup() if cache else None
+        if results is None:
+            try:
+                results = yield from self._attempt_steps(self._send, endpoint, data)
+            except APIError as error:
+                if cache:
+                    cache.store_error(error)
+                raise
+            if cache:
+                cache.store(results)
+        if not self.skip_validation:
+            with self._timer("validate", endpoint, data):
+                results = response_model(model).parse_obj(results)
+        return results
+
+    def _perform(
+        self,
+        endpoint: str,
+        data: dict,
+        model: str,
+        cache: Union["CachePolicy", None] = None,
+    ):
+        return self._run(self._perform_steps(endpoint, data, model, cache))
+
+    def _post(
+        self,
+        endpoint: str,
+        data: dict,
+        model: str,
+        cache: Union["CachePolicy", None] = None,
+    ):
+        if self.singleflight is not None and data["action"] in COALESCED_ACTIONS:
+            return self.singleflight.do(
+                request_key(endpoint, data),
+                self._perform,
+                endpoint,
+                data,
+                model,
+                cache,
+            )
+        return self._perform(endpoint, data, model, cache)
 
     def get_lottery_numbers(
         self, invoice_term: str
-    ) -> Union[LotteryNumberResponse, dict]:
+    ) -> Union["LotteryNumberResponse", dict]:
         """查詢中獎發票號碼清單 v0.2"""
-        URL = build_api_url("invapp")
-        VERSION = 0.2
         if not validate_invoice_term(invoice_term):
             raise ValueError(f"Invalid invoice_term: {invoice_term}")
-        data = {
-            "version": VERSION,
-            "action": "QryWinningList",
-            "invTerm": invoice_term,
-            "UUID": self.uuid,
-            "appID": self.app_id,
-        }
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
+        data = self._template("QryWinningList")
+        data["invTerm"] = invoice_term
+        cache = None
+        if self.lottery_cache is not None:
+            from .cache import CachePolicy
+
+            # Published winning numbers never change, unpublished terms are
+            # retried after lottery_error_ttl
+            cache = CachePolicy(
+                self.lottery_cache,
+                f"lottery:{invoice_term}",
+                error_ttl=self.lottery_error_ttl,
+                error_codes=(TERM_NOT_FOUND,),
+            )
+        return self._post("invapp", data, "LotteryNumberResponse", cache)
+
+    def _invoice_cache_key(
+        self,
+        action: str,
+        invoice_number: str,
+        invoice_date: date,
+        invoice_random: Union[str, None] = None,
+    ) -> str:
+        key = f"{action}:{invoice_number}:{invoice_date:%Y/%m/%d}"
+        return key if invoice_random is None else f"{key}:{invoice_random}"
+
+    def _invoice_cache(self, action: str, *args) -> Union["CachePolicy", None]:
+        if self.response_cache is None:
+            return None
+        from .cache import CachePolicy
+
+        return CachePolicy(
+            self.response_cache,
+            self._invoice_cache_key(action, *args),
+            ttl=self.response_cache_ttls.get(action),
         )
-        if not self.skip_validation:
-            results = LotteryNumberResponse.parse_obj(results)
-        return results
+
+    def invalidate_invoice(
+        self,
+        invoice_number: str,
+        invoice_date: date,
+        invoice_random: Union[str, None] = None,
+    ) -> None:
+        """
+        Drop the cached header, and detail if `invoice_random` is given, of an
+        invoice from `response_cache`
+        """
+        if self.response_cache is None:
+            return
+        keys = [self._invoice_cache_key("qryInvHeader", invoice_number, invoice_date)]
+        if invoice_random is not None:
+            keys.append(
+                self._invoice_cache_key(
+                    "qryInvDetail", invoice_number, invoice_date, invoice_random
+                )
+            )
+        for key in keys:
+            self.response_cache.delete(key)
 
     def get_invoice_header(
         self,
         barcode_type: Literal["QRCode", "Barcode"],
         invoice_number: str,
         invoice_date: date,
-    ) -> Union[InvoiceHeaderResponse, dict]:
+    ) -> Union["InvoiceHeaderResponse", dict]:
         """查詢發票表頭 v0.5"""
-        URL = build_api_url("invapp")
-        VERSION = 0.5
         if barcode_type not in ("QRCode", "Barcode"):
             raise ValueError("Type must be 'QRCode' or 'Barcode'")
         if not validate_invoice_number(invoice_number):
             raise ValueError(f"Invalid invoice number: {invoice_number}")
-        data = {
-            "version": VERSION,
-            "type": barcode_type,
-            "invNum": invoice_number,
-            "action": "qryInvHeader",
-            "generation": "V2",
-            "invDate": invoice_date.strftime("%Y/%m/%d"),
-            "UUID": self.uuid,
-            "appID": self.app_id,
-        }
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
+        data = self._template("qryInvHeader")
+        data.update(
+            type=barcode_type,
+            invNum=invoice_number,
+            invDate=invoice_date.strftime("%Y/%m/%d"),
         )
-        if not self.skip_validation:
-            results = InvoiceHeaderResponse.parse_obj(results)
-        return results
+        cache = self._invoice_cache("qryInvHeader", invoice_number, invoice_date)
+        return self._post("invapp", data, "InvoiceHeaderResponse", cache)
 
     def get_invoice_detail(
         self,
@@ -151,8 +667,6 @@ class AppAPIClient(object):
         `invoice_encrypt`: 發票檢驗碼 (左側QRCode中，24位)
         `seller_id`: 商家統編
         """
-        URL = build_api_url("invapp")
-        VERSION = 0.6
         if barcode_type == "QRCode":
             if not invoice_encrypt:
                 raise ValueError(
@@ -175,44 +689,26 @@ class AppAPIClient(object):
             raise ValueError(f"Invalid invoice number: {invoice_number}")
         if not validate_invoice_random(invoice_random):
             raise ValueError(f"Invalid invoice random: {invoice_random}")
-        data = {
-            "version": VERSION,
-            "type": barcode_type,
-            "invNum": invoice_number,
-            "action": "qryInvDetail",
-            "generation": "V2",
-            "invTerm": invoice_term,
-            "invDate": invoice_date.strftime("%Y/%m/%d"),
-            "encrypt": invoice_encrypt,
-            "sellerID": seller_id,
-            "UUID": self.uuid,
-            "randomNumber": invoice_random,
-            "appID": self.app_id,
-        }
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
+        data = self._template("qryInvDetail")
+        data.update(
+            type=barcode_type,
+            invNum=invoice_number,
+            invTerm=invoice_term,
+            invDate=invoice_date.strftime("%Y/%m/%d"),
+            encrypt=invoice_encrypt,
+            sellerID=seller_id,
+            randomNumber=invoice_random,
         )
-        if not self.skip_validation:
-            results = InvoiceDetailResponse.parse_obj(results)
-        return results
+        cache = self._invoice_cache(
+            "qryInvDetail", invoice_number, invoice_date, invoice_random
+        )
+        return self._post("invapp", data, "InvoiceDetailResponse", cache)
 
     def get_love_code(self, query: str) -> dict:
         """捐贈碼查詢 v0.2"""
-        URL = build_api_url("lovecode")
-        VERSION = 0.2
-        data = {
-            "version": VERSION,
-            "qKey": query,
-            "action": "qryLoveCode",
-            "UUID": self.uuid,
-            "appID": self.app_id,
-        }
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
-        )
-        if not self.skip_validation:
-            results = LoveCodeResponse.parse_obj(results)
-        return results
+        data = self._template("qryLoveCode")
+        data["qKey"] = query
+        return self._post("lovecode", data, "LoveCodeResponse")
 
     def get_carrier_invoices_header(
         self,
@@ -222,30 +718,110 @@ class AppAPIClient(object):
         end_date: date,
         card_encrypt: str,
         only_winning: bool = False,
-    ) -> Union[dict, CarrierInvoicesHeaderResponse]:
+    ) -> Union[dict, "CarrierInvoicesHeaderResponse"]:
         """載具發票表頭查詢 v0.5"""
-        URL = build_api_url("invserv")
-        VERSION = 0.5
-        data = {
-            "version": VERSION,
-            "cardType": card_type,
-            "cardNo": card_number,
-            "expTimeStamp": "2147483647",
-            "action": "carrierInvChk",
-            "timeStamp": int(time() + self.ts_tolerance),
-            "startDate": start_date.strftime("%Y/%m/%d"),
-            "endDate": end_date.strftime("%Y/%m/%d"),
-            "onlyWinningInv": "Y" if only_winning else "N",
-            "uuid": self.uuid,
-            "appID": self.app_id,
-            "cardEncrypt": card_encrypt,
-        }
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
+        data = self._carrier_invoices_header_data(
+            card_type, card_number, start_date, end_date, card_encrypt, only_winning
         )
-        if not self.skip_validation:
-            results = CarrierInvoicesHeaderResponse.parse_obj(results)
-        return results
+        return self._post("invserv", data, "CarrierInvoicesHeaderResponse")
+
+    def stream_carrier_invoices_header(
+        self,
+        card_type: str,
+        card_number: str,
+        start_date: date,
+        end_date: date,
+        card_encrypt: str,
+        only_winning: bool = False,
+    ) -> "CarrierInvoicesHeaderStream":
+        """
+        載具發票表頭查詢 v0.5，以串流方式逐筆解析發票
+
+        適用於發票數量龐大的載具，記憶體用量不隨發票數量增加
+        未迭代完畢時，請以 `with` 使用或呼叫 `close()` 關閉連線
+        """
+        data = self._carrier_invoices_header_data(
+            card_type, card_number, start_date, end_date, card_encrypt, only_winning
+        )
+        from .stream import CarrierInvoicesHeaderStream
+
+        response = self._attempt(self._open_stream, "invserv", data)
+        return CarrierInvoicesHeaderStream(
+            response.iter_content(STREAM_CHUNK_SIZE), self.skip_validation, response
+        )
+
+    def _open_stream(self, endpoint: str, data: dict) -> "Response":
+        from requests import RequestException
+
+        response = self._request(endpoint, data, stream=True)
+        try:
+            response.raise_for_status()
+        except RequestException:
+            response.close()
+            raise
+        return response
+
+    def _carrier_invoices_header_data(
+        self,
+        card_type: str,
+        card_number: str,
+        start_date: date,
+        end_date: date,
+        card_encrypt: str,
+        only_winning: bool,
+    ) -> dict:
+        data = self._template("carrierInvChk")
+        data.update(
+            cardType=card_type,
+            cardNo=card_number,
+            timeStamp=int(time() + self.ts_tolerance),
+            startDate=start_date.strftime("%Y/%m/%d"),
+            endDate=end_date.strftime("%Y/%m/%d"),
+            onlyWinningInv="Y" if only_winning else "N",
+            cardEncrypt=card_encrypt,
+        )
+        return data
+
+    def iter_carrier_invoices_header(
+        self,
+        card_type: str,
+        card_number: str,
+        start_date: date,
+        end_date: date,
+        card_encrypt: str,
+        only_winning: bool = False,
+        max_workers: int = 4,
+    ) -> Iterator[Union["Invoice", dict]]:
+        """
+        載具發票表頭區間查詢，逐筆回傳發票
+
+        查詢區間依月份切分 (平台限制起訖日期須為相同月份) 並同時查詢，
+        結果依 `invNum` 去除重複。任一區間查詢失敗時拋出例外。
+        """
+
+        def fetch(window):
+            window_start, window_end = window
+            return self.get_carrier_invoices_header(
+                card_type=card_type,
+                card_number=card_number,
+                start_date=window_start,
+                end_date=window_end,
+                card_encrypt=card_encrypt,
+                only_winning=only_winning,
+            )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(fetch, window)
+                for window in split_date_range(start_date, end_date)
+            ]
+            try:
+                yield from unique_carrier_invoices(
+                    future.result() for future in as_completed(futures)
+                )
+            finally:
+                for future in futures:
+                    future.cancel()
 
     def get_carrier_invoices_detail(
         self,
@@ -256,33 +832,63 @@ class AppAPIClient(object):
         card_encrypt: str,
         seller_name: Union[str, None] = None,
         amount: Union[int, None] = None,
-    ) -> Union[dict, CarrierInvoicesDetailResponse]:
+    ) -> Union[dict, "CarrierInvoicesDetailResponse"]:
         """載具發票明細查詢 v0.5"""
-        URL = build_api_url("invserv")
-        VERSION = 0.5
         if not validate_invoice_number(invoice_number):
             raise ValueError(f"Invalid invoice number: {invoice_number}")
-        data = {
-            "version": VERSION,
-            "cardType": card_type,
-            "cardNo": card_number,
-            "expTimeStamp": "2147483647",
-            "action": "carrierInvDetail",
-            "timeStamp": int(time() + self.ts_tolerance),
-            "invNum": invoice_number,
-            "invDate": invoice_date.strftime("%Y/%m/%d"),
-            "uuid": self.uuid,
-            "sellerName": seller_name,
-            "amount": amount,
-            "appID": self.app_id,
-            "cardEncrypt": card_encrypt,
-        }
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
+        data = self._template("carrierInvDetail")
+        data.update(
+            cardType=card_type,
+            cardNo=card_number,
+            timeStamp=int(time() + self.ts_tolerance),
+            invNum=invoice_number,
+            invDate=invoice_date.strftime("%Y/%m/%d"),
+            sellerName=seller_name,
+            amount=amount,
+            cardEncrypt=card_encrypt,
         )
-        if not self.skip_validation:
-            results = CarrierInvoicesDetailResponse.parse_obj(results)
-        return results
+        return self._post("invserv", data, "CarrierInvoicesDetailResponse")
+
+    def iter_carrier_invoices_detail(
+        self,
+        card_type: str,
+        card_number: str,
+        invoices: CarrierInvoices,
+        card_encrypt: str,
+        max_workers: int = 8,
+    ) -> Iterator[CarrierInvoiceDetailResult]:
+        """
+        批次載具發票明細查詢，依完成順序逐筆回傳
+
+        `invoices`: 載具發票表頭查詢結果，或其中的發票清單
+        `max_workers`: 同時查詢的最大數量
+
+        查詢失敗的發票不會中斷批次，而是於結果的 `error` 欄位回報
+        """
+
+        def fetch(invoice):
+            try:
+                detail = self.get_carrier_invoices_detail(
+                    card_type=card_type,
+                    card_number=card_number,
+                    card_encrypt=card_encrypt,
+                    **carrier_invoice_detail_params(invoice),
+                )
+            except Exception as error:
+                return CarrierInvoiceDetailResult(invoice, None, error)
+            return CarrierInvoiceDetailResult(invoice, detail, None)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(fetch, invoice)
+                for invoice in carrier_invoice_rows(invoices)
+            ]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
 
     def carrier_donate_invoice(
         self,
@@ -294,61 +900,36 @@ class AppAPIClient(object):
         card_encrypt: str,
     ):
         """載具發票捐贈 v0.1"""
-        URL = build_api_url("donate")
-        VERSION = 0.1
         if not validate_invoice_number(invoice_number):
             raise ValueError(f"Invalid invoice number: {invoice_number}")
-        data = {
-            "version": VERSION,
-            "serial": f"{self.serial:0>10}",
-            "cardType": card_type,
-            "cardNo": card_number,
-            "expTimeStamp": "2147483647",
-            "action": "carrierInvDnt",
-            "timeStamp": int(time() + self.ts_tolerance),
-            "invDate": invoice_date.strftime("%Y/%m/%d"),
-            "invNum": invoice_number,
-            "npoBan": love_code,
-            "uuid": self.uuid,
-            "appID": self.app_id,
-            "cardEncrypt": card_encrypt,
-        }
-        signature = sign(data, self.api_key)
-        data["signature"] = signature
-        self.serial += 1
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
+        data = self._template("carrierInvDnt")
+        data.update(
+            serial=self._next_serial(),
+            cardType=card_type,
+            cardNo=card_number,
+            timeStamp=int(time() + self.ts_tolerance),
+            invDate=invoice_date.strftime("%Y/%m/%d"),
+            invNum=invoice_number,
+            npoBan=love_code,
+            cardEncrypt=card_encrypt,
         )
-        if not self.skip_validation:
-            results = CarrierInvoiceDonateResponse.parse_obj(results)
-        return results
+        data["signature"] = self.signer.sign(data)
+        return self._post("donate", data, "CarrierInvoiceDonateResponse")
 
     def get_aggregate_carrier(
         self,
         card_type: str,
         card_number: str,
         card_encrypt: str,
-    ) -> Union[dict, AggregateCarrierResponse]:
+    ) -> Union[dict, "AggregateCarrierResponse"]:
         """手機條碼歸戶載具查詢 v1.0"""
-        URL = build_api_url("carrier")
-        VERSION = 1.0
-        data = {
-            "version": VERSION,
-            "serial": f"{self.serial:0>10}",
-            "action": "qryCarrierAgg",
-            "cardType": card_type,
-            "cardNo": card_number,
-            "cardEncrypt": card_encrypt,
-            "appID": self.app_id,
-            "timeStamp": int(time() + self.ts_tolerance),
-            "uuid": self.uuid,
-        }
-        signature = sign(data, self.api_key)
-        data["signature"] = signature
-        self.serial += 1
-        results = check_api_error(
-            self.session.post(URL, data=data, timeout=self.timeout)
+        data = self._template("qryCarrierAgg")
+        data.update(
+            serial=self._next_serial(),
+            cardType=card_type,
+            cardNo=card_number,
+            cardEncrypt=card_encrypt,
+            timeStamp=int(time() + self.ts_tolerance),
         )
-        if not self.skip_validation:
-            results = AggregateCarrierResponse.parse_obj(results)
-        return results
+        data["signature"] = self.signer.sign(data)
+        return self._post("carrier", data, "AggregateCarrierResponse")
@@ -0,0 +1,268 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import TYPE_CHECKING, AsyncIterator, Generator, Union
+
+try:
+    from httpx import AsyncClient, HTTPError, Limits, Response, Timeout, TransportError
+except ImportError:  # pragma: no cover
+    AsyncClient = Response = None
+
+from .app_client import (
+    RETRY_BACKOFF_FACTOR,
+    RETRY_STATUS_FORCELIST,
+    STREAM_CHUNK_SIZE,
+    AppAPIClient,
+    CarrierInvoiceDetailResult,
+    CarrierInvoices,
+    carrier_invoice_detail_params,
+    carrier_invoice_rows,
+    response_model,
+    unique_carrier_invoices,
+)
+from .singleflight import AsyncSingleFlight
+from .stream import AsyncCarrierInvoicesHeaderStream
+from .utils import build_api_url, check_api_code, decode_content, split_date_range
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .schema import Invoice
+
+
+def backoff_time(retries: int) -> float:
+    """Wait before the next retry after `retries` failures, as urllib3 Retry does"""
+    from urllib3 import Retry
+
+    if retries <= 1:
+        return 0
+    return min(RETRY_BACKOFF_FACTOR * 2 ** (retries - 1), Retry.DEFAULT_BACKOFF_MAX)
+
+
+class AsyncAppAPIClient(AppAPIClient):
+    """
+    asyncio 版本的 AppAPIClient，需安裝 httpx (`pip install tw_invoice[async]`)
+
+    所有 API 方法與 AppAPIClient 相同，回傳值需以 `await` 取得，
+    參數檢查錯誤 (ValueError) 於呼叫當下即拋出。
+    所有請求共用同一個 httpx.AsyncClient 連線池。
+    """
+
+    def __init__(self, *args, max_connections: int = 100, **kwargs):
+        if AsyncClient is None:
+            raise ImportError(
+                "httpx is required for AsyncAppAPIClient, "
+                "install it with `pip install tw_invoice[async]`"
+            )
+        self.max_connections = max_connections
+        super().__init__(*args, **kwargs)
+
+    def _create_singleflight(self) -> AsyncSingleFlight:
+        return AsyncSingleFlight()
+
+    def _create_session(self) -> AsyncClient:
+        if isinstance(self.timeout, tuple):
+            connect, read = self.timeout
+            timeout = Timeout(read, connect=connect)
+        else:
+            timeout = Timeout(self.timeout)
+        return AsyncClient(
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            limits=Limits(max_connections=self.max_connections),
+            timeout=timeout,
+        )
+
+    async def _request(
+        self, endpoint: str, data: dict, stream: bool = False
+    ) -> Response:
+        url = build_api_url(endpoint, self.base_url)
+        # requests drops None fields from form data, do the same here
+        data = {name: value for name, value in data.items() if value is not None}
+        request = self.session.build_request("POST", url, data=data)
+        policy = self.retry_policy
+        max_retries = self.max_retries if policy is None else policy.max_retries
+        delay = None
+        with self._timer("request", endpoint, data):
+            for retry in range(max_retries + 1):
+                # Every attempt, retries included, takes a token
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire_async(endpoint)
+                error = None
+                try:
+                    response = await self.session.send(request, stream=stream)
+                except TransportError as exception:
+                    error = exception
+                else:
+                    if response.status_code not in RETRY_STATUS_FORCELIST:
+                        break
+                if retry == max_retries or (
+                    policy is not None and not policy.budget.withdraw()
+                ):
+                    if error is not None:
+                        raise error
+                    break
+                if error is None:
+                    await response.aclose()
+                if policy is None:
+                    delay = backoff_time(retry + 1)
+                else:
+                    delay = policy.backoff(delay)
+                if delay:
+                    await asyncio.sleep(delay)
+        if self.metrics is not None:
+            self.metrics.observe_transfer(
+                endpoint,
+                data["action"],
+                len(response.request.content),
+                int(response.headers.get("Content-Length", 0))
+                if stream
+                else len(response.content),
+                retry,
+            )
+        try:
+            response.raise_for_status()
+        except HTTPError:
+            await response.aclose()
+            raise
+        return response
+
+    async def _send(self, endpoint: str, data: dict) -> dict:
+        response = await self._request(endpoint, data)
+        with self._timer("decode", endpoint, data):
+            return check_api_code(response.json())
+
+    async def _fetch(self, endpoint: str, data: dict, model: str):
+        response = await self._request(endpoint, data)
+        with self._timer("decode", endpoint, data):
+            return decode_content(
+                response.content,
+                None if self.skip_validation else response_model(model),
+            )
+
+    async def _sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    def _is_transport_error(self, error: Exception) -> bool:
+        return isinstance(error, HTTPError)
+
+    async def _run(self, steps: Generator):
+        """Run the steps of a call as AppAPIClient does, awaiting each one"""
+        value, resume = None, steps.send
+        while True:
+            try:
+                function, args = resume(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, resume = await function(*args), steps.send
+            except Exception as error:
+                value, resume = error, steps.throw
+
+    @asynccontextmanager
+    async def stream_carrier_invoices_header(
+        self,
+        card_type: str,
+        card_number: str,
+        start_date: date,
+        end_date: date,
+        card_encrypt: str,
+        only_winning: bool = False,
+    ) -> AsyncIterator[AsyncCarrierInvoicesHeaderStream]:
+        """
+        載具發票表頭查詢 v0.5，以串流方式逐筆解析發票
+
+        需以 `async with` 使用，離開時關閉連線
+        """
+        data = self._carrier_invoices_header_data(
+            card_type, card_number, start_date, end_date, card_encrypt, only_winning
+        )
+        response = await self._attempt(self._open_stream, "invserv", data)
+        try:
+            yield AsyncCarrierInvoicesHeaderStream(
+                response.aiter_bytes(STREAM_CHUNK_SIZE), self.skip_validation
+            )
+        finally:
+            await response.aclose()
+
+    async def _open_stream(self, endpoint: str, data: dict) -> Response:
+        return await self._request(endpoint, data, stream=True)
+
+    async def iter_carrier_invoices_header(
+        self,
+        card_type: str,
+        card_number: str,
+        start_date: date,
+        end_date: date,
+        card_encrypt: str,
+        only_winning: bool = False,
+        max_workers: int = 4,
+    ) -> AsyncIterator[Union["Invoice", dict]]:
+        """載具發票表頭區間查詢，以 `async for` 逐筆回傳發票"""
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(window):
+            window_start, window_end = window
+            async with semaphore:
+                return await self.get_carrier_invoices_header(
+                    card_type=card_type,
+                    card_number=card_number,
+                    start_date=window_start,
+                    end_date=window_end,
+                    card_encrypt=card_encrypt,
+                    only_winning=only_winning,
+                )
+
+        tasks = [
+            asyncio.ensure_future(fetch(window))
+            for window in split_date_range(start_date, end_date)
+        ]
+        seen = set()
+        try:
+            for task in asyncio.as_completed(tasks):
+                for invoice in unique_carrier_invoices([await task], seen):
+                    yield invoice
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def iter_carrier_invoices_detail(
+        self,
+        card_type: str,
+        card_number: str,
+        invoices: CarrierInvoices,
+        card_encrypt: str,
+        max_workers: int = 8,
+    ) -> AsyncIterator[CarrierInvoiceDetailResult]:
+        """批次載具發票明細查詢，以 `async for` 依完成順序逐筆回傳"""
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(invoice):
+            async with semaphore:
+                try:
+                    detail = await self.get_carrier_invoices_detail(
+                        card_type=card_type,
+                        card_number=card_number,
+                        card_encrypt=card_encrypt,
+                        **carrier_invoice_detail_params(invoice),
+                    )
+                except Exception as error:
+                    return CarrierInvoiceDetailResult(invoice, None, error)
+            return CarrierInvoiceDetailResult(invoice, detail, None)
+
+        tasks = [
+            asyncio.ensure_future(fetch(invoice))
+            for invoice in carrier_invoice_rows(invoices)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def aclose(self) -> None:
+        await self.session.aclose()
+
+    async def __aenter__(self) -> "AsyncAppAPIClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
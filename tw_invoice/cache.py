@@ -0,0 +1,261 @@
+import json
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Any, NamedTuple, Tuple, Union
+
+from .exception import APIError
+from .utils import check_api_code
+
+
+class BaseCache(object):
+    """
+    Interface of response caches
+
+    Values are JSON-serializable API results, `ttl` is in seconds and
+    `None` means the entry never expires.
+    """
+
+    def get(self, key: str) -> Any:
+        """Return the cached value, or None when missing or expired"""
+        entry = self.entry(key)
+        return None if entry is None else entry[0]
+
+    def entry(self, key: str) -> Union[Tuple[Any, Union[float, None]], None]:
+        """Return (value, expires timestamp), or None when missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Union[float, None] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryCache(BaseCache):
+    """In-memory LRU cache holding at most `maxsize` entries"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def entry(self, key: str) -> Union[Tuple[Any, Union[float, None]], None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value, expires
+
+    def set(self, key: str, value: Any, ttl: Union[float, None] = None) -> None:
+        self.set_until(key, value, None if ttl is None else time() + ttl)
+
+    def set_until(self, key: str, value: Any, expires: Union[float, None]) -> None:
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(BaseCache):
+    """
+    On-disk cache stored in a SQLite database at `path`
+
+    With `maxsize`, expired entries and then the least recently written ones
+    are evicted to keep at most `maxsize` entries.
+    """
+
+    def __init__(self, path: str, maxsize: Union[int, None] = None):
+        self.path = path
+        self.maxsize = maxsize
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM cache WHERE expires IS NULL OR expires > ?",
+                (time(),),
+            ).fetchone()
+        return count
+
+    def entry(self, key: str) -> Union[Tuple[Any, Union[float, None]], None]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= time():
+            self.delete(key)
+            return None
+        return json.loads(value), expires
+
+    def set(self, key: str, value: Any, ttl: Union[float, None] = None) -> None:
+        expires = None if ttl is None else time() + ttl
+        with self._lock, self._connection:
+            # REPLACE gives the row a new rowid, so rowid order is write order
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires),
+            )
+            if self.maxsize is not None:
+                self._evict()
+
+    def _count(self) -> int:
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return count
+
+    def _evict(self) -> None:
+        if self._count() <= self.maxsize:
+            return
+        self._connection.execute(
+            "DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (time(),)
+        )
+        excess = self._count() - self.maxsize
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM cache WHERE rowid IN "
+                "(SELECT rowid FROM cache ORDER BY rowid LIMIT ?)",
+                (excess,),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM cache")
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class CacheStats(NamedTuple):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TieredCache(BaseCache):
+    """
+    In-memory LRU cache in front of an optional disk tier
+
+    Writes go to both tiers, hits in `disk` are promoted to `memory` until
+    the same expiry. Hits of each tier and misses are counted in `stats`.
+    """
+
+    def __init__(
+        self,
+        memory: Union[MemoryCache, None] = None,
+        disk: Union[BaseCache, None] = None,
+    ):
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk
+        self._stats = [0, 0, 0]
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.disk if self.disk is not None else self.memory)
+
+    @property
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(*self._stats)
+
+    def _count(self, index: int) -> None:
+        with self._lock:
+            self._stats[index] += 1
+
+    def entry(self, key: str) -> Union[Tuple[Any, Union[float, None]], None]:
+        entry = self.memory.entry(key)
+        if entry is not None:
+            self._count(0)
+            return entry
+        entry = self.disk.entry(key) if self.disk is not None else None
+        if entry is None:
+            self._count(2)
+            return None
+        self._count(1)
+        self.memory.set_until(key, *entry)
+        return entry
+
+    def set(self, key: str, value: Any, ttl: Union[float, None] = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+class CachePolicy(NamedTuple):
+    """
+    How the results of a single request are cached
+
+    Successful results are kept for `ttl` seconds (forever if None), API errors
+    with a code in `error_codes` are kept for `error_ttl` seconds.
+    """
+
+    cache: BaseCache
+    key: str
+    ttl: Union[float, None] = None
+    error_ttl: Union[float, None] = None
+    error_codes: Tuple[int, ...] = ()
+
+    def lookup(self) -> Union[dict, None]:
+        """Return cached results, raise APIError for a cached error"""
+        results = self.cache.get(self.key)
+        return None if results is None else check_api_code(results)
+
+    def store(self, results: dict) -> None:
+        self.cache.set(self.key, results, self.ttl)
+
+    def store_error(self, error: APIError) -> None:
+        if self.error_ttl and int(error.code) in self.error_codes:
+            results = {"code": error.code, "msg": error.message}
+            self.cache.set(self.key, results, self.error_ttl)
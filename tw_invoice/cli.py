@@ -0,0 +1,176 @@
+"""
+Run JSONL queries through AppAPIClient
+
+Each input line is an object with the client `method` and its `params`,
+dates as ISO strings, plus an optional `id` echoed back:
+
+    {"id": 1, "method": "get_invoice_header", "params": {"barcode_type":
+    "Barcode", "invoice_number": "AB12345678", "invoice_date": "2023-01-01"}}
+
+Results are written to stdout as JSONL, one `result` or `error` per input.
+
+`carrier_donate_invoice` is only run with `--allow-donate`: a donation is not
+idempotent, and batch files are easily re-run.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+from typing import IO, Iterable, Iterator, Sequence
+
+from .app_client import AppAPIClient
+from .exception import APIError
+from .utils import API_PATHS, as_dict
+
+METHODS = (
+    "get_lottery_numbers",
+    "get_invoice_header",
+    "get_invoice_detail",
+    "get_love_code",
+    "get_carrier_invoices_header",
+    "get_carrier_invoices_detail",
+    "get_aggregate_carrier",
+)
+DONATE_METHODS = ("carrier_donate_invoice",)
+
+
+def execute(
+    client: AppAPIClient,
+    line_number: int,
+    line: str,
+    methods: Sequence[str] = METHODS,
+) -> dict:
+    """Run the query of an input line, return its output record"""
+    record = {"line": line_number}
+    try:
+        query = json.loads(line)
+        if "id" in query:
+            record["id"] = query["id"]
+        method = query["method"]
+        if method in DONATE_METHODS and method not in methods:
+            raise ValueError(f"{method} requires --allow-donate")
+        if method not in methods:
+            raise ValueError(f"Unsupported method: {method}")
+        params = {
+            name: date.fromisoformat(value)
+            if name.endswith("_date") and isinstance(value, str)
+            else value
+            for name, value in query.get("params", {}).items()
+        }
+        record["result"] = as_dict(getattr(client, method)(**params))
+    except Exception as error:
+        record["error"] = {"type": type(error).__name__, "message": str(error)}
+        if isinstance(error, APIError):
+            record["error"].update(code=error.code, message=error.message)
+    return record
+
+
+def run(
+    client: AppAPIClient,
+    lines: Iterable[str],
+    concurrency: int = 4,
+    ordered: bool = False,
+    methods: Sequence[str] = METHODS,
+) -> Iterator[dict]:
+    """
+    Run queries concurrently, yield output records in completion order, or
+    input order when `ordered`
+
+    At most twice `concurrency` lines are read ahead, so input of any size
+    is streamed.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque() if ordered else set()
+
+        def drain(limit: int) -> Iterator[dict]:
+            nonlocal pending
+            while len(pending) > limit:
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            future = executor.submit(execute, client, line_number, line, methods)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+            yield from drain(concurrency * 2 - 1)
+        yield from drain(0)
+
+
+def main(args=None, stdin: IO[str] = None, stdout: IO[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="tw-invoice", description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file, - for stdin")
+    parser.add_argument("--app-id", default=os.environ.get("TW_INVOICE_APP_ID"))
+    parser.add_argument("--api-key", default=os.environ.get("TW_INVOICE_API_KEY"))
+    parser.add_argument("--base-url", help="API base URL, e.g. of a stub server")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--rate-limit", type=float, help="requests per second of each endpoint"
+    )
+    parser.add_argument(
+        "--order", choices=["completion", "input"], default="completion"
+    )
+    parser.add_argument("--skip-validation", action="store_true")
+    parser.add_argument(
+        "--allow-donate",
+        action="store_true",
+        help="run carrier_donate_invoice queries, which are not idempotent",
+    )
+    options = parser.parse_args(args)
+    if not options.app_id or not options.api_key:
+        parser.error(
+            "--app-id and --api-key, or TW_INVOICE_APP_ID and "
+            "TW_INVOICE_API_KEY, are required"
+        )
+    if options.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    client_options = {}
+    if options.base_url:
+        client_options["base_url"] = options.base_url
+    if options.rate_limit:
+        client_options["rate_limits"] = dict.fromkeys(API_PATHS, options.rate_limit)
+    client = AppAPIClient(
+        options.app_id,
+        options.api_key,
+        skip_validation=options.skip_validation,
+        pool_maxsize=options.concurrency,
+        pool_block=True,
+        **client_options,
+    )
+
+    stdout = stdout or sys.stdout
+    if options.input == "-":
+        source = stdin or sys.stdin
+    else:
+        source = open(options.input, encoding="utf-8")
+    methods = METHODS + DONATE_METHODS if options.allow_donate else METHODS
+    failed = False
+    try:
+        for record in run(
+            client, source, options.concurrency, options.order == "input", methods
+        ):
+            failed = failed or "error" in record
+            stdout.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            stdout.flush()
+    finally:
+        if options.input != "-":
+            source.close()
+        client.session.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from typing import Callable, Iterable, List, NamedTuple, Union
+from uuid import uuid4
+
+from .app_client import AppAPIClient
+from .sync import earliest_query_date
+from .utils import as_dict
+
+# Serials of each worker start at a multiple of SERIAL_RANGE, serials are 10
+# digits so up to 99 workers never overlap
+SERIAL_RANGE = 10**8
+MAX_PROCESSES = 10**10 // SERIAL_RANGE - 1
+MAX_BATCH_SIZE = 16
+
+
+class CarrierJob(NamedTuple):
+    card_type: str
+    card_number: str
+    card_encrypt: str
+
+
+class CrawlResult(NamedTuple):
+    """
+    Invoices of a carrier, headers with their detail under `detail`
+
+    `failed` lists the invoice numbers whose detail query failed, `error` is
+    set when the headers could not be queried at all.
+    """
+
+    job: CarrierJob
+    invoices: List[dict]
+    failed: List[str]
+    error: Union[str, None] = None
+
+
+class CrawlProgress(NamedTuple):
+    jobs: int
+    total: int
+    invoices: int = 0
+    failed: int = 0
+    errors: int = 0
+
+
+def crawl_carrier(
+    client: AppAPIClient,
+    job: CarrierJob,
+    start_date: date,
+    end_date: date,
+    max_workers: int = 8,
+) -> CrawlResult:
+    """Query headers and details of all invoices of a carrier"""
+    try:
+        headers = [
+            as_dict(invoice)
+            for invoice in client.iter_carrier_invoices_header(
+                card_type=job.card_type,
+                card_number=job.card_number,
+                start_date=start_date,
+                end_date=end_date,
+                card_encrypt=job.card_encrypt,
+            )
+        ]
+    except Exception as error:
+        # Exceptions are not all picklable, report them as text
+        return CrawlResult(job, [], [], f"{type(error).__name__}: {error}")
+    invoices, failed = [], []
+    for result in client.iter_carrier_invoices_detail(
+        card_type=job.card_type,
+        card_number=job.card_number,
+        invoices=headers,
+        card_encrypt=job.card_encrypt,
+        max_workers=max_workers,
+    ):
+        if result.error is None:
+            invoices.append(dict(result.invoice, detail=as_dict(result.detail)))
+        else:
+            failed.append(result.invoice["invNum"])
+    return CrawlResult(job, invoices, failed)
+
+
+_client = None
+
+
+def _init_worker(counter, client_options: dict) -> None:
+    global _client
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    _client = AppAPIClient(uuid=str(uuid4()), **client_options)
+    _client.serial = index * SERIAL_RANGE + 1
+
+
+def _crawl_batch(
+    jobs: List[CarrierJob], start_date: date, end_date: date, max_workers: int
+) -> List[CrawlResult]:
+    return [
+        crawl_carrier(_client, job, start_date, end_date, max_workers) for job in jobs
+    ]
+
+
+def balanced_batches(jobs: List[CarrierJob], processes: int) -> List[List[CarrierJob]]:
+    """
+    Split jobs into small batches, at least 4 per process, so processes that
+    finish early pick up more work instead of idling behind a large shard
+    """
+    size = max(1, min(MAX_BATCH_SIZE, len(jobs) // (processes * 4)))
+    return [jobs[i : i + size] for i in range(0, len(jobs), size)]
+
+
+class CarrierCrawler(object):
+    """
+    Crawl the invoices of many carriers with a pool of processes
+
+    `processes` defaults to the number of CPUs, up to MAX_PROCESSES. Every
+    process owns an `AppAPIClient` built from `app_id`, `api_key` and
+    `client_options`, with its own `uuid` and a serial range starting at a
+    multiple of SERIAL_RANGE. Results are handed to `sink` in the parent
+    process as batches complete.
+    """
+
+    def __init__(
+        self,
+        app_id: str,
+        api_key: str,
+        processes: Union[int, None] = None,
+        mp_context=None,
+        **client_options,
+    ):
+        if processes is None:
+            processes = min(os.cpu_count() or 1, MAX_PROCESSES)
+        elif not 1 <= processes <= MAX_PROCESSES:
+            raise ValueError(f"processes must be between 1 and {MAX_PROCESSES}")
+        self.processes = processes
+        self.mp_context = mp_context or multiprocessing.get_context()
+        self.client_options = dict(client_options, app_id=app_id, api_key=api_key)
+
+    def run(
+        self,
+        jobs: Iterable[CarrierJob],
+        sink: Callable[[CrawlResult], None],
+        start_date: Union[date, None] = None,
+        end_date: Union[date, None] = None,
+        max_workers: int = 8,
+        progress: Union[Callable[[CrawlProgress], None], None] = None,
+    ) -> CrawlProgress:
+        """
+        Crawl `jobs`, return the final progress
+
+        Dates default to the whole range the platform accepts, `max_workers`
+        is the number of concurrent detail queries in each process.
+        `progress` is called after each carrier with the totals so far.
+        """
+        jobs = [CarrierJob(*job) for job in jobs]
+        end_date = end_date or date.today()
+        start_date = max(start_date or date.min, earliest_query_date(end_date))
+        totals = CrawlProgress(0, len(jobs))
+        counter = self.mp_context.Value("i", 0)
+        with ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=self.mp_context,
+            initializer=_init_worker,
+            initargs=(counter, self.client_options),
+        ) as executor:
+            futures = [
+                executor.submit(_crawl_batch, batch, start_date, end_date, max_workers)
+                for batch in balanced_batches(jobs, self.processes)
+            ]
+            for future in as_completed(futures):
+                for result in future.result():
+                    sink(result)
+                    totals = CrawlProgress(
+                        totals.jobs + 1,
+                        totals.total,
+                        totals.invoices + len(result.invoices),
+                        totals.failed + len(result.failed),
+                        totals.errors + (result.error is not None),
+                    )
+                    if progress is not None:
+                        progress(totals)
+        return totals
+
+
+class JSONLinesSink(object):
+    """Write crawled invoices to `path`, one JSON object per line"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, result: CrawlResult) -> None:
+        for invoice in result.invoices:
+            self._file.write(json.dumps(invoice, ensure_ascii=False) + "\n")
+
+    def __enter__(self) -> "JSONLinesSink":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
@@ -8,3 +8,32 @@ class APIError(Exception):
 
     def __str__(self) -> str:
         return f"<{self.code}> {self.message}"
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a non-blocking rate limiter has no budget left."""
+
+    def __init__(self, endpoint: str, *args: object) -> None:
+        super().__init__(*args)
+        self.endpoint = endpoint
+
+    def __str__(self) -> str:
+        return f"Rate limit exceeded for endpoint: {self.endpoint}"
+
+
+class CircuitOpen(Exception):
+    """Raised when calls to an endpoint are rejected by its circuit breaker."""
+
+    def __init__(self, endpoint: str, *args: object) -> None:
+        super().__init__(*args)
+        self.endpoint = endpoint
+
+    def __str__(self) -> str:
+        return f"Circuit open for endpoint: {self.endpoint}"
+
+
+class CredentialsExhausted(Exception):
+    """Raised when every credential of a pool has been taken out of rotation."""
+
+    def __str__(self) -> str:
+        return "No credential left in rotation"
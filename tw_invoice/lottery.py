@@ -0,0 +1,82 @@
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from .schema import LotteryNumberResponse
+
+
+class Prize(NamedTuple):
+    tier: str
+    amount: int
+
+
+# (tier, digits to match, prize number fields, prize amount field)
+PRIZE_RULES = [
+    ("super", 8, ["superPrizeNo"], "superPrizeAmt"),
+    ("special", 8, ["spcPrizeNo", "spcPrizeNo2", "spcPrizeNo3"], "spcPrizeAmt"),
+    ("first", 8, [f"firstPrizeNo{i}" for i in range(1, 11)], "firstPrizeAmt"),
+    ("second", 7, [f"firstPrizeNo{i}" for i in range(1, 11)], "secondPrizeAmt"),
+    ("third", 6, [f"firstPrizeNo{i}" for i in range(1, 11)], "thirdPrizeAmt"),
+    ("fourth", 5, [f"firstPrizeNo{i}" for i in range(1, 11)], "fourthPrizeAmt"),
+    ("fifth", 4, [f"firstPrizeNo{i}" for i in range(1, 11)], "fifthPrizeAmt"),
+    ("sixth", 3, [f"firstPrizeNo{i}" for i in range(1, 11)], "sixthPrizeAmt"),
+    ("sixth", 3, [f"sixthPrizeNo{i}" for i in range(1, 7)], "sixthPrizeAmt"),
+]
+
+
+class PrizeTable(object):
+    """
+    Winning numbers of an invoice term compiled for fast matching
+
+    Prize numbers are indexed by suffix length, so matching an invoice number
+    costs at most one lookup per prize tier. Invoice numbers whose last 3
+    digits match no prize at all, which is nearly all of them, are rejected
+    with a single set lookup.
+    """
+
+    def __init__(self, lottery_numbers: Union[LotteryNumberResponse, dict]):
+        if not isinstance(lottery_numbers, dict):
+            lottery_numbers = lottery_numbers.dict()
+        self.term = lottery_numbers["invoYm"]
+        tables: Dict[int, Dict[str, Prize]] = {}
+        for tier, digits, number_fields, amount_field in PRIZE_RULES:
+            prize = Prize(tier, int(lottery_numbers[amount_field].replace(",", "")))
+            table = tables.setdefault(digits, {})
+            for field in number_fields:
+                number = (lottery_numbers.get(field) or "").strip()
+                if number:
+                    # Rules are ordered by prize, keep the highest one
+                    table.setdefault(number[-digits:], prize)
+        self.tables: List[Tuple[int, Dict[str, Prize]]] = sorted(
+            tables.items(), reverse=True
+        )
+        self.candidates = {suffix[-3:] for _, table in self.tables for suffix in table}
+
+    def match(self, invoice_number: str) -> Union[Prize, None]:
+        """Return the prize of an invoice number, None if it wins nothing"""
+        number = invoice_number[-8:]
+        if number[-3:] not in self.candidates:
+            return None
+        for digits, table in self.tables:
+            prize = table.get(number[-digits:])
+            if prize is not None:
+                return prize
+        return None
+
+    def match_many(self, invoice_numbers: Iterable[str]) -> List[Union[Prize, None]]:
+        """Return the prize of every invoice number, None for those winning nothing"""
+        candidates = self.candidates
+        match = self.match
+        return [
+            match(number) if number[-3:] in candidates else None
+            for number in invoice_numbers
+        ]
+
+    def iter_winners(
+        self, invoice_numbers: Iterable[str]
+    ) -> Iterator[Tuple[int, str, Prize]]:
+        """Yield (index, invoice number, prize) of winning invoice numbers only"""
+        candidates = self.candidates
+        for index, number in enumerate(invoice_numbers):
+            if number[-3:] in candidates:
+                prize = self.match(number)
+                if prize is not None:
+                    yield index, number, prize
@@ -0,0 +1,160 @@
+import json
+from bisect import bisect_left, insort
+from time import time
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+from .schema import LoveCode, LoveCodeResponse
+
+NAME_FIELDS = ("SocialWelfareName", "SocialWelfareAbbrev")
+
+
+def _ngrams(text: str) -> Set[str]:
+    return set(text) | {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+class LoveCodeIndex(object):
+    """
+    Local search index of love codes (捐贈碼)
+
+    Numeric queries match `LoveCode` and `SocialWelfareBAN` by prefix, other
+    queries match `SocialWelfareName` and `SocialWelfareAbbrev` by substring
+    through an index of 1 and 2 character grams. When the index is older than
+    `max_age` seconds and a `client` is given, searches fall back to
+    `client.get_love_code` and merge the results into the index, or answer
+    from the index when the API call fails.
+    """
+
+    def __init__(
+        self,
+        records: Iterable[Union[LoveCode, dict]] = (),
+        client=None,
+        max_age: float = 7 * 86400,
+        refreshed_at: Union[float, None] = None,
+    ):
+        self.client = client
+        self.max_age = max_age
+        self.refreshed_at = refreshed_at
+        self.records: Dict[str, LoveCode] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._keys: List[Tuple[str, str]] = []
+        self.update(records)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def stale(self) -> bool:
+        return self.refreshed_at is None or time() - self.refreshed_at > self.max_age
+
+    def update(
+        self, records: Union[LoveCodeResponse, dict, Iterable[Union[LoveCode, dict]]]
+    ) -> None:
+        """Add or replace records, from a LoveCodeResponse or LoveCode list"""
+        if isinstance(records, LoveCodeResponse):
+            records = records.details
+        elif isinstance(records, dict):
+            records = records["details"]
+        batch = {}
+        for record in records:
+            if isinstance(record, dict):
+                record = LoveCode.parse_obj(record)
+            batch[record.LoveCode] = record
+        added = []
+        for code, record in batch.items():
+            previous = self.records.get(code)
+            if previous == record:
+                continue
+            if previous is not None:
+                for key in self._record_keys(previous):
+                    index = bisect_left(self._keys, key)
+                    if index < len(self._keys) and self._keys[index] == key:
+                        del self._keys[index]
+            self.records[code] = record
+            for field in NAME_FIELDS:
+                for gram in _ngrams(getattr(record, field) or ""):
+                    self._grams.setdefault(gram, set()).add(code)
+            added.extend(self._record_keys(record))
+        # A few keys, as merged from a search fallback, are inserted in place;
+        # larger batches are appended and sorted, merging the two sorted runs
+        if len(added) * 8 < len(self._keys):
+            for key in added:
+                insort(self._keys, key)
+        else:
+            self._keys.extend(added)
+            self._keys.sort()
+
+    @staticmethod
+    def _record_keys(record: LoveCode) -> Set[Tuple[str, str]]:
+        return {
+            (record.LoveCode, record.LoveCode),
+            (record.SocialWelfareBAN, record.LoveCode),
+        }
+
+    def refresh(self, queries: Iterable[str]) -> None:
+        """Rebuild the index from the results of `client.get_love_code(query)`"""
+        if self.client is None:
+            raise ValueError("client is required to refresh the index")
+        fresh = LoveCodeIndex()
+        for query in queries:
+            fresh.update(self.client.get_love_code(query))
+        self.records, self._grams, self._keys = fresh.records, fresh._grams, fresh._keys
+        self.refreshed_at = time()
+
+    def _search_prefix(self, query: str) -> List[LoveCode]:
+        codes = []
+        index = bisect_left(self._keys, (query, ""))
+        while index < len(self._keys) and self._keys[index][0].startswith(query):
+            codes.append(self._keys[index][1])
+            index += 1
+        return [self.records[code] for code in dict.fromkeys(codes)]
+
+    def _search_names(self, query: str) -> List[LoveCode]:
+        grams = (
+            [query]
+            if len(query) == 1
+            else [query[i : i + 2] for i in range(len(query) - 1)]
+        )
+        candidates = set.intersection(*(self._grams.get(gram, set()) for gram in grams))
+        records = (self.records[code] for code in sorted(candidates))
+        return [
+            record
+            for record in records
+            if any(query in (getattr(record, field) or "") for field in NAME_FIELDS)
+        ]
+
+    def search(self, query: str, limit: Union[int, None] = None) -> List[LoveCode]:
+        query = query.strip()
+        if not query:
+            return []
+        if self.stale and self.client is not None:
+            try:
+                response = self.client.get_love_code(query)
+            except Exception:
+                pass  # Answer from the stale index rather than not at all
+            else:
+                self.update(response)
+                if isinstance(response, dict):
+                    response = LoveCodeResponse.parse_obj(response)
+                return response.details[:limit]
+        if query.isdigit():
+            results = self._search_prefix(query)
+        else:
+            results = self._search_names(query)
+        return results[:limit]
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "refreshed_at": self.refreshed_at,
+                    "records": [record.dict() for record in self.records.values()],
+                },
+                file,
+                ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(cls, path: str, client=None, max_age: float = 7 * 86400):
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["records"], client, max_age, data["refreshed_at"])
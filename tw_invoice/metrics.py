@@ -0,0 +1,157 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+
+from .exception import APIError
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[str, str, str]
+
+
+class Histogram(object):
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        results = []
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            total += count
+            results.append((str(bound), total))
+        return results
+
+
+class Metrics(object):
+    """
+    Per-endpoint and action instrumentation of API calls
+
+    Latencies are split into stages: `request` (network, including retries),
+    `decode` (JSON decoding and API error check) and `validate` (pydantic).
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._latency: Dict[Labels, Histogram] = {}
+        self._transfer: Dict[Tuple[str, str], List[int]] = {}
+        self._errors: Dict[Labels, int] = {}
+        self._lock = Lock()
+
+    def observe_latency(
+        self, stage: str, endpoint: str, action: str, seconds: float
+    ) -> None:
+        with self._lock:
+            labels = (stage, endpoint, action)
+            if labels not in self._latency:
+                self._latency[labels] = Histogram(self.buckets)
+            self._latency[labels].observe(seconds)
+
+    def observe_transfer(
+        self, endpoint: str, action: str, bytes_out: int, bytes_in: int, retries: int
+    ) -> None:
+        with self._lock:
+            totals = self._transfer.setdefault((endpoint, action), [0, 0, 0, 0])
+            for index, value in enumerate((1, bytes_out, bytes_in, retries)):
+                totals[index] += value
+
+    def observe_error(self, endpoint: str, action: str, code: Union[int, str]) -> None:
+        with self._lock:
+            labels = (endpoint, action, str(code))
+            self._errors[labels] = self._errors.get(labels, 0) + 1
+
+    @contextmanager
+    def timer(self, stage: str, endpoint: str, action: str) -> Iterator[None]:
+        """Time the block as `stage`, counting APIError raised in it"""
+        started = perf_counter()
+        try:
+            yield
+        except APIError as error:
+            self.observe_error(endpoint, action, error.code)
+            raise
+        finally:
+            self.observe_latency(stage, endpoint, action, perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "latency": [
+                    {
+                        "stage": stage,
+                        "endpoint": endpoint,
+                        "action": action,
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": dict(histogram.cumulative()),
+                    }
+                    for (stage, endpoint, action), histogram in self._latency.items()
+                ],
+                "transfer": [
+                    {
+                        "endpoint": endpoint,
+                        "action": action,
+                        "requests": requests,
+                        "bytes_out": bytes_out,
+                        "bytes_in": bytes_in,
+                        "retries": retries,
+                    }
+                    for (endpoint, action), (
+                        requests,
+                        bytes_out,
+                        bytes_in,
+                        retries,
+                    ) in self._transfer.items()
+                ],
+                "errors": [
+                    {"endpoint": endpoint, "action": action, "code": code, "count": n}
+                    for (endpoint, action, code), n in self._errors.items()
+                ],
+            }
+
+    def to_prometheus(self, prefix: str = "tw_invoice") -> str:
+        """Export the metrics in Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_latency_seconds Latency of API calls by stage",
+            f"# TYPE {prefix}_latency_seconds histogram",
+        ]
+        for entry in snapshot["latency"]:
+            labels = (
+                f'stage="{entry["stage"]}",endpoint="{entry["endpoint"]}",'
+                f'action="{entry["action"]}"'
+            )
+            for bound, count in entry["buckets"].items():
+                lines.append(
+                    f'{prefix}_latency_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                )
+            lines.append(f"{prefix}_latency_seconds_sum{{{labels}}} {entry['sum']}")
+            lines.append(f"{prefix}_latency_seconds_count{{{labels}}} {entry['count']}")
+        for name, description in (
+            ("requests", "API requests sent"),
+            ("bytes_out", "Bytes sent in request bodies"),
+            ("bytes_in", "Bytes received in response bodies"),
+            ("retries", "Retries of API requests"),
+        ):
+            lines.append(f"# HELP {prefix}_{name}_total {description}")
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for entry in snapshot["transfer"]:
+                labels = f'endpoint="{entry["endpoint"]}",action="{entry["action"]}"'
+                lines.append(f"{prefix}_{name}_total{{{labels}}} {entry[name]}")
+        lines.append(f"# HELP {prefix}_api_errors_total APIError by code")
+        lines.append(f"# TYPE {prefix}_api_errors_total counter")
+        for entry in snapshot["errors"]:
+            labels = (
+                f'endpoint="{entry["endpoint"]}",action="{entry["action"]}",'
+                f'code="{entry["code"]}"'
+            )
+            lines.append(f"{prefix}_api_errors_total{{{labels}}} {entry['count']}")
+        return "\n".join(lines) + "\n"
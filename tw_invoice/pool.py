@@ -0,0 +1,168 @@
+from functools import partial
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, List, NamedTuple, Union
+
+from .app_client import AppAPIClient
+from .exception import APIError, CredentialsExhausted
+from .ratelimit import Budget
+
+# 954 簽名有誤, 997 / 998 AppID 停權或不符合規定
+REVOKING_CODES = (954, 997, 998)
+# 950 超過最大查詢次數, the quota is reset after a while
+QUOTA_CODES = (950,)
+QUOTA_COOLDOWN = 3600
+STRATEGIES = ("least_loaded", "round_robin")
+
+
+class Credential(NamedTuple):
+    app_id: str
+    api_key: str
+    uuid: Union[str, None] = None
+    rate_limits: Union[Dict[str, Budget], None] = None
+
+
+class Disabled(NamedTuple):
+    error: APIError
+    until: Union[float, None] = None  # monotonic() it is enabled again at
+
+
+class CredentialPool(object):
+    """
+    Spread API calls across several app_id / api_key pairs
+
+    Every credential gets its own `AppAPIClient`, hence its own rate limiter
+    and serial sequence; `client_options` are passed to each of them, with
+    `rate_limits` of a credential taking precedence. Public client methods
+    called on the pool go to the credential with the fewest calls in flight
+    (`least_loaded`) or to the next one in turn (`round_robin`).
+
+    A credential answering with an APIError in `revoking_codes` is taken out
+    of rotation until `enable()` puts it back, one answering with an APIError
+    in `quota_codes` for `quota_cooldown` seconds. The call is retried with
+    another credential, until none is left and CredentialsExhausted is
+    raised.
+
+    Methods returning iterators are bound to the credential picked when they
+    are called, and do not count as in flight while being iterated.
+    """
+
+    def __init__(
+        self,
+        credentials: Iterable[Union[Credential, tuple]],
+        strategy: str = "least_loaded",
+        revoking_codes: Iterable[int] = REVOKING_CODES,
+        quota_codes: Iterable[int] = QUOTA_CODES,
+        quota_cooldown: float = QUOTA_COOLDOWN,
+        **client_options,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of {STRATEGIES}")
+        self.strategy = strategy
+        self.revoking_codes = {int(code) for code in revoking_codes}
+        self.quota_codes = {int(code) for code in quota_codes}
+        self.quota_cooldown = quota_cooldown
+        self.clients: List[AppAPIClient] = []
+        for credential in credentials:
+            credential = Credential(*credential)
+            options = dict(client_options, uuid=credential.uuid)
+            if credential.rate_limits is not None:
+                options["rate_limits"] = credential.rate_limits
+            self.clients.append(
+                AppAPIClient(credential.app_id, credential.api_key, **options)
+            )
+        if not self.clients:
+            raise ValueError("credentials must not be empty")
+        self.disabled: Dict[str, Disabled] = {}
+        self._in_flight = [0] * len(self.clients)
+        self._next = 0
+        self._lock = Lock()
+
+    @property
+    def active(self) -> List[AppAPIClient]:
+        """Clients of the credentials in rotation"""
+        with self._lock:
+            self._readmit()
+            return [
+                client for client in self.clients if client.app_id not in self.disabled
+            ]
+
+    def in_flight(self, app_id: str) -> int:
+        with self._lock:
+            return self._in_flight[self._index(app_id)]
+
+    def _index(self, app_id: str) -> int:
+        for index, client in enumerate(self.clients):
+            if client.app_id == app_id:
+                return index
+        raise KeyError(app_id)
+
+    def disable(
+        self, app_id: str, error: APIError, cooldown: Union[float, None] = None
+    ) -> None:
+        """Take a credential out of rotation, for `cooldown` seconds if given"""
+        until = None if cooldown is None else monotonic() + cooldown
+        with self._lock:
+            self.disabled[app_id] = Disabled(error, until)
+
+    def enable(self, app_id: str) -> None:
+        with self._lock:
+            self.disabled.pop(app_id, None)
+
+    def _readmit(self) -> None:
+        now = monotonic()
+        for app_id, disabled in list(self.disabled.items()):
+            if disabled.until is not None and disabled.until <= now:
+                del self.disabled[app_id]
+
+    def _acquire(self) -> Union[int, None]:
+        with self._lock:
+            self._readmit()
+            candidates = [
+                index
+                for index, client in enumerate(self.clients)
+                if client.app_id not in self.disabled
+            ]
+            if not candidates:
+                return None
+            if self.strategy == "round_robin":
+                index = min(
+                    candidates,
+                    key=lambda index: (index - self._next) % len(self.clients),
+                )
+                self._next = index + 1
+            else:
+                index = min(candidates, key=self._in_flight.__getitem__)
+            self._in_flight[index] += 1
+            return index
+
+    def _release(self, index: int) -> None:
+        with self._lock:
+            self._in_flight[index] -= 1
+
+    def call(self, method: str, *args, **kwargs):
+        """Call the client method `method` with a credential of the pool"""
+        revoked = None
+        while True:
+            index = self._acquire()
+            if index is None:
+                raise CredentialsExhausted() from revoked
+            client = self.clients[index]
+            try:
+                return getattr(client, method)(*args, **kwargs)
+            except APIError as error:
+                code = int(error.code)
+                if code in self.quota_codes:
+                    self.disable(client.app_id, error, self.quota_cooldown)
+                elif code in self.revoking_codes:
+                    self.disable(client.app_id, error)
+                else:
+                    raise
+                revoked = error
+            finally:
+                self._release(index)
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or not callable(getattr(AppAPIClient, name, None)):
+            raise AttributeError(name)
+        return partial(self.call, name)
@@ -0,0 +1,180 @@
+from base64 import b64decode
+from datetime import date
+from typing import Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from .utils import (
+    validate_ban,
+    validate_bans,
+    validate_invoice_number,
+    validate_invoice_numbers,
+    validate_invoice_random,
+    validate_invoice_randoms,
+)
+
+Payload = Union[str, bytes]
+# Left QR code: invNum(10) ROC date(7) random(4) sales(8, hex) total(8, hex)
+# buyer BAN(8) seller BAN(8) encrypt(24), then ":" separated fields
+HEADER_LENGTH = 77
+RIGHT_PREFIX = "**"
+# 中文編碼參數
+ENCODINGS = {"0": "cp950", "1": "utf-8", "2": "base64"}
+
+
+class QRCodeItem(NamedTuple):
+    name: str
+    quantity: str
+    unit_price: str
+
+
+class InvoiceQRCode(NamedTuple):
+    invoice_number: str
+    invoice_date: date
+    invoice_random: str
+    sales_amount: int
+    total_amount: int
+    buyer_ban: str
+    seller_ban: str
+    invoice_encrypt: str
+    item_count: int = 0
+    total_item_count: int = 0
+    items: Tuple[QRCodeItem, ...] = ()
+
+    def detail_args(self) -> tuple:
+        """Positional arguments of `AppAPIClient.get_invoice_detail`"""
+        return (
+            "QRCode",
+            self.invoice_number,
+            self.invoice_date,
+            self.invoice_random,
+            None,
+            self.invoice_encrypt,
+            self.seller_ban,
+        )
+
+
+class QRCodeBatch(NamedTuple):
+    invoices: List[Union[InvoiceQRCode, None]]  # None for invalid payloads
+    failures: List[int]
+
+
+def _text(payload: Payload) -> str:
+    # Only the header and the Base64 text need decoding, which are ASCII;
+    # item names in bytes are decoded once the encoding is known
+    if isinstance(payload, bytes):
+        return payload.decode("latin-1")
+    return payload
+
+
+def _items(
+    left: str, right: Union[str, None], encoding: str, raw: bool
+) -> Tuple[QRCodeItem, ...]:
+    right = right[len(RIGHT_PREFIX) :] if right else ""
+    if right.strip("*") == "":
+        right = ""
+    if encoding == "base64":
+        text = b64decode(left + right).decode("utf-8")
+    else:
+        text = left + ":" + right if left and right else left or right
+        if raw:
+            text = text.encode("latin-1").decode(encoding)
+    fields = text.split(":") if text else []
+    # A truncated last item is dropped
+    return tuple(
+        QRCodeItem(*fields[index : index + 3]) for index in range(0, len(fields) - 2, 3)
+    )
+
+
+def _decode(left: Payload, right: Union[Payload, None], items: bool) -> InvoiceQRCode:
+    raw = isinstance(left, bytes)
+    left, right = _text(left), None if right is None else _text(right)
+    if len(left) < HEADER_LENGTH:
+        raise ValueError(f"QR code payload too short: {len(left)}")
+    roc_date = left[10:17]
+    if not roc_date.isdigit():
+        raise ValueError(f"Invalid invoice date: {roc_date}")
+    invoice = InvoiceQRCode(
+        left[0:10],
+        date(int(roc_date[:3]) + 1911, int(roc_date[3:5]), int(roc_date[5:7])),
+        left[17:21],
+        int(left[21:29], 16),
+        int(left[29:37], 16),
+        left[37:45],
+        left[45:53],
+        left[53:77],
+    )
+    if len(left) == HEADER_LENGTH or not items:
+        return invoice
+    fields = left[HEADER_LENGTH + 1 :].split(":", 4)
+    if left[HEADER_LENGTH] != ":" or len(fields) < 4:
+        raise ValueError("Invalid QR code payload fields")
+    _, item_count, total_item_count, encoding = fields[:4]
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Invalid QR code encoding: {encoding}")
+    return invoice._replace(
+        item_count=int(item_count),
+        total_item_count=int(total_item_count),
+        items=_items(
+            fields[4] if len(fields) > 4 else "", right, ENCODINGS[encoding], raw
+        ),
+    )
+
+
+def decode_invoice_qrcode(
+    left: Payload, right: Union[Payload, None] = None, items: bool = True
+) -> InvoiceQRCode:
+    """
+    Decode the left, and optionally right, QR code of an e-invoice
+
+    Payloads are text, or the raw bytes for Big5 item names. Set `items` to
+    False to skip decoding the item list. Raise ValueError when invalid.
+    """
+    invoice = _decode(left, right, items)
+    if not validate_invoice_number(invoice.invoice_number):
+        raise ValueError(f"Invalid invoice number: {invoice.invoice_number}")
+    if not validate_invoice_random(invoice.invoice_random):
+        raise ValueError(f"Invalid invoice random: {invoice.invoice_random}")
+    if not validate_ban(invoice.seller_ban):
+        raise ValueError(f"Invalid seller BAN: {invoice.seller_ban}")
+    return invoice
+
+
+def decode_invoice_qrcodes(
+    payloads: Iterable[Union[Payload, Tuple[Payload, Union[Payload, None]]]],
+    items: bool = True,
+) -> QRCodeBatch:
+    """
+    Decode QR codes in batch, from left payloads or (left, right) tuples
+
+    Invalid payloads are None in `invoices` and listed in `failures`.
+    """
+    pairs = [
+        (payload, None) if isinstance(payload, (str, bytes)) else payload
+        for payload in payloads
+    ]
+    headers = [_text(left[:HEADER_LENGTH]) for left, _ in pairs]
+    failures = set()
+    for validate, start, end in (
+        (validate_invoice_numbers, 0, 10),
+        (validate_invoice_randoms, 17, 21),
+        (validate_bans, 45, 53),
+    ):
+        failures.update(validate([header[start:end] for header in headers]).failures)
+    invoices = []
+    for index, (left, right) in enumerate(pairs):
+        invoice = None
+        if index not in failures:
+            try:
+                invoice = _decode(left, right, items)
+            except ValueError:
+                failures.add(index)
+        invoices.append(invoice)
+    return QRCodeBatch(invoices, sorted(failures))
+
+
+def invoice_detail_args(
+    payloads: Iterable[Union[Payload, Tuple[Payload, Union[Payload, None]]]]
+) -> Iterator[tuple]:
+    """Yield `get_invoice_detail` arguments of the valid payloads"""
+    for invoice in decode_invoice_qrcodes(payloads, items=False).invoices:
+        if invoice is not None:
+            yield invoice.detail_args()
@@ -0,0 +1,117 @@
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, Tuple, Union
+
+from .exception import RateLimitExceeded
+
+Budget = Union[float, Tuple[float, float]]
+
+
+class TokenBucket(object):
+    """Token bucket refilled at `rate` tokens per second, holding `capacity`"""
+
+    def __init__(self, rate: float, capacity: Union[float, None] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(capacity or rate, 1)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token, return the seconds to wait before using it"""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self) -> None:
+        """Give back a token reserved but not used"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available right now"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RateLimiter(object):
+    """
+    Per-endpoint rate limiter
+
+    `budgets` maps endpoint ids of `utils.build_api_url` to a rate in requests
+    per second, or a (rate, burst) tuple. Endpoints without a budget are not
+    limited. When `blocking` is False, calls over budget raise
+    `RateLimitExceeded` instead of waiting in queue.
+    """
+
+    def __init__(self, budgets: Dict[str, Budget], blocking: bool = True):
+        self.buckets = {
+            endpoint: TokenBucket(*budget)
+            if isinstance(budget, tuple)
+            else TokenBucket(budget)
+            for endpoint, budget in budgets.items()
+        }
+        self.blocking = blocking
+        self._queue_depth = 0
+        self._lock = Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of calls currently waiting for budget"""
+        return self._queue_depth
+
+    def _reserve(self, endpoint: str) -> float:
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            return 0.0
+        if not self.blocking:
+            if not bucket.try_acquire():
+                raise RateLimitExceeded(endpoint)
+            return 0.0
+        return bucket.reserve()
+
+    def _enqueue(self, delta: int) -> None:
+        with self._lock:
+            self._queue_depth += delta
+
+    def acquire(self, endpoint: str) -> None:
+        """Wait until a call to `endpoint` is within budget"""
+        delay = self._reserve(endpoint)
+        if delay:
+            self._enqueue(1)
+            try:
+                sleep(delay)
+            finally:
+                self._enqueue(-1)
+
+    async def acquire_async(self, endpoint: str) -> None:
+        """Wait until a call to `endpoint` is within budget, without blocking"""
+        # Imported here, sync clients should not pay for loading asyncio
+        import asyncio
+
+        delay = self._reserve(endpoint)
+        if delay:
+            self._enqueue(1)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # The call is not made, later ones need not wait for its token
+                self.buckets[endpoint].refund()
+                raise
+            finally:
+                self._enqueue(-1)
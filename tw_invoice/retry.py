@@ -0,0 +1,230 @@
+from collections import deque
+from random import uniform
+from threading import Lock
+from time import monotonic
+from typing import TYPE_CHECKING, Dict, Iterable, Union
+from urllib.parse import urlsplit
+
+from requests.adapters import Retry
+from urllib3.exceptions import MaxRetryError, ResponseError
+
+from .exception import APIError, CircuitOpen
+from .utils import API_PATHS
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .ratelimit import RateLimiter
+
+# 500 系統執行錯誤, 951 連線逾時, 999 未知錯誤
+RETRYABLE_CODES = (500, 951, 999)
+ENDPOINTS = {path: endpoint for endpoint, path in API_PATHS.items()}
+
+
+class RetryBudget(object):
+    """
+    Client-wide budget of retries as a share of requests
+
+    Over the last `window` seconds, retries are allowed while they stay below
+    `ratio` of the requests plus `min_retries`, so a client with little
+    traffic can still retry while a failing platform is not hit by a retry
+    storm from every worker at once.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, window: int = 10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._buckets = deque()  # [second, requests, retries]
+        self._lock = Lock()
+
+    def _bucket(self) -> list:
+        second = int(monotonic())
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        return self._buckets[-1]
+
+    def deposit(self) -> None:
+        """Count a request"""
+        with self._lock:
+            self._bucket()[1] += 1
+
+    def withdraw(self) -> bool:
+        """Take a retry from the budget, return False if none is left"""
+        with self._lock:
+            bucket = self._bucket()
+            requests = sum(counts[1] for counts in self._buckets)
+            retries = sum(counts[2] for counts in self._buckets)
+            if retries >= self.min_retries + self.ratio * requests:
+                return False
+            bucket[2] += 1
+            return True
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of one endpoint
+
+    Opens after `failure_threshold` consecutive failures, then rejects calls
+    for `reset_timeout` seconds. After that one trial call is let through per
+    `reset_timeout` (half open): success closes the circuit, failure keeps it
+    open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._lock = Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            # Let this trial call through, and hold the others back until it
+            # resolves or another reset_timeout passes
+            self._opened_at = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self._opened_at = monotonic()
+
+
+class RetryPolicy(object):
+    """
+    Retry policy shared by the calls of a client
+
+    Retries wait with decorrelated jitter between `base` and `cap` seconds,
+    are limited to `max_retries` per call and drawn from a client-wide
+    `RetryBudget`. HTTP 5xx and connection errors are retried, so are
+    `APIError` with `retryable_codes`; other API errors are permanent (e.g.
+    903 參數錯誤, 954 簽名有誤, 998 AppID 不符合規定) and raised right away.
+
+    Each endpoint of `utils.build_api_url` has its own `CircuitBreaker`,
+    calls to an endpoint whose circuit is open raise `CircuitOpen`.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base: float = 0.1,
+        cap: float = 10,
+        budget: Union[RetryBudget, None] = None,
+        retryable_codes: Iterable[int] = RETRYABLE_CODES,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+    ):
+        self.max_retries = max_retries
+        self.base = base
+        self.cap = cap
+        self.budget = budget or RetryBudget()
+        self.retryable_codes = {int(code) for code in retryable_codes}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = Lock()
+
+    def backoff(self, previous: Union[float, None] = None) -> float:
+        """Seconds to wait before the next retry, given the previous wait"""
+        return min(self.cap, uniform(self.base, (previous or self.base) * 3))
+
+    def retryable(self, error: Exception) -> bool:
+        if isinstance(error, APIError):
+            return int(error.code) in self.retryable_codes
+        return True
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self.breakers[endpoint]
+
+    def check(self, endpoint: str) -> CircuitBreaker:
+        """Return the breaker of `endpoint`, raise CircuitOpen if it is open"""
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpen(endpoint)
+        return breaker
+
+
+class PolicyRetry(Retry):
+    """
+    urllib3 Retry waiting and budgeting by a RetryPolicy, if any
+
+    With a `rate_limiter`, each retry also takes a token of its endpoint
+    after the backoff, so retries of throttled requests stay within budget.
+    """
+
+    def __init__(
+        self,
+        *args,
+        policy: Union[RetryPolicy, None] = None,
+        rate_limiter: Union["RateLimiter", None] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.policy = policy
+        self.rate_limiter = rate_limiter
+        self.delay = None
+        self.endpoint = None
+
+    def new(self, **kwargs) -> "PolicyRetry":
+        retry = super().new(**kwargs)
+        retry.policy = self.policy
+        retry.rate_limiter = self.rate_limiter
+        retry.delay = self.delay
+        retry.endpoint = self.endpoint
+        return retry
+
+    def increment(
+        self,
+        method=None,
+        url=None,
+        response=None,
+        error=None,
+        _pool=None,
+        _stacktrace=None,
+    ) -> "PolicyRetry":
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if url is not None:
+            retry.endpoint = ENDPOINTS.get(urlsplit(url).path)
+        if self.policy is not None:
+            if not self.policy.budget.withdraw():
+                reason = error or ResponseError("retry budget exhausted")
+                raise MaxRetryError(_pool, url, reason) from reason
+            retry.delay = self.policy.backoff(self.delay)
+        return retry
+
+    def get_backoff_time(self) -> float:
+        if self.policy is None:
+            return super().get_backoff_time()
+        return self.delay or 0
+
+    def sleep(self, response=None) -> None:
+        super().sleep(response)
+        if self.rate_limiter is not None and self.endpoint is not None:
+            self.rate_limiter.acquire(self.endpoint)
@@ -0,0 +1,202 @@
+import codecs
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, List, Union
+
+from .exception import APIError
+from .schema import Invoice
+
+WHITESPACE = " \t\n\r"
+
+
+class JSONArrayStreamParser(object):
+    """
+    Incremental parser of a JSON object that holds one large array
+
+    Text is pushed with `feed()`, which returns the items of the `array_key`
+    array completed so far. All other members are collected in `envelope`.
+    Memory use is bounded by the largest single item, not the whole document.
+    """
+
+    def __init__(self, array_key: str):
+        self.array_key = array_key
+        self.envelope = {}
+        self.done = False
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._state = "start"
+        self._key = None
+
+    def _skip(self, position: int, chars: str = WHITESPACE) -> int:
+        while position < len(self._buffer) and self._buffer[position] in chars:
+            position += 1
+        return position
+
+    def _decode(self, position: int, final: bool):
+        """Decode one value, return (value, end) or None if it is incomplete"""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, position)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        # A number at the end of buffer may continue in the next chunk
+        if end == len(self._buffer) and not final:
+            return None
+        return value, end
+
+    def _expect(self, position: int, char: str) -> int:
+        if self._buffer[position] != char:
+            raise ValueError(
+                f"Expecting {char!r} at {position}, got {self._buffer[position]!r}"
+            )
+        return position + 1
+
+    def feed(self, text: str, final: bool = False) -> List[Any]:
+        self._buffer += text
+        items = []
+        position = 0
+        while not self.done:
+            position = self._skip(position, WHITESPACE + ",")
+            if position >= len(self._buffer):
+                break
+            if self._state == "start":
+                position = self._expect(self._skip(position), "{")
+                self._state = "key"
+            elif self._state == "key":
+                if self._buffer[position] == "}":
+                    position += 1
+                    self.done = True
+                    break
+                decoded = self._decode(position, final)
+                if decoded is None:
+                    break
+                key, end = decoded
+                colon = self._skip(end)
+                if colon >= len(self._buffer):
+                    break
+                position = self._expect(colon, ":")
+                self._key = key
+                self._state = "value"
+            elif self._state == "value":
+                # Error responses may carry e.g. `null` instead of the array,
+                # it is kept in the envelope like other members
+                if self._key == self.array_key and self._buffer[position] == "[":
+                    position += 1
+                    self._state = "items"
+                    continue
+                decoded = self._decode(position, final)
+                if decoded is None:
+                    break
+                self.envelope[self._key], position = decoded
+                self._state = "key"
+            elif self._state == "items":
+                if self._buffer[position] == "]":
+                    position += 1
+                    self._state = "key"
+                    continue
+                decoded = self._decode(position, final)
+                if decoded is None:
+                    break
+                item, position = decoded
+                items.append(item)
+        self._buffer = self._buffer[position:]
+        if final and not self.done:
+            raise ValueError("Unexpected end of JSON document")
+        return items
+
+
+class _CarrierInvoicesHeaderStream(object):
+    def __init__(self, skip_validation: bool = False):
+        self.skip_validation = skip_validation
+        self._parser = JSONArrayStreamParser("details")
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    @property
+    def envelope(self) -> dict:
+        """Members of the response other than `details` parsed so far"""
+        return self._parser.envelope
+
+    @property
+    def v(self) -> Union[str, None]:
+        return self.envelope.get("v")
+
+    @property
+    def code(self) -> Union[int, None]:
+        code = self.envelope.get("code")
+        return None if code is None else int(code)
+
+    @property
+    def msg(self) -> Union[str, None]:
+        return self.envelope.get("msg")
+
+    @property
+    def onlyWinningInv(self) -> Union[str, None]:
+        return self.envelope.get("onlyWinningInv")
+
+    def _feed(self, chunk: bytes, final: bool = False) -> List[Union[Invoice, dict]]:
+        text = self._text_decoder.decode(chunk, final)
+        items = self._parser.feed(text, final)
+        if self.code is not None and self.code != 200:
+            if "msg" in self.envelope or self._parser.done:
+                raise APIError(self.code, self.msg)
+        if self.skip_validation:
+            return items
+        return [Invoice.parse_obj(item) for item in items]
+
+
+class CarrierInvoicesHeaderStream(_CarrierInvoicesHeaderStream):
+    """
+    Streamed carrier invoices header response
+
+    Iterate to get the invoices one at a time while the body is still being
+    downloaded. Envelope fields (`v`, `code`, `msg`, `onlyWinningInv`) are
+    available as soon as they have been received, and in full once the
+    iteration ends. APIError is raised from the iteration on error codes.
+
+    The response is closed once the iteration ends or stops early; use as a
+    context manager, or call `close()`, when it may not be iterated at all.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[bytes],
+        skip_validation: bool = False,
+        response: Any = None,
+    ):
+        super().__init__(skip_validation)
+        self._chunks = chunks
+        self.response = response
+
+    def __enter__(self) -> "CarrierInvoicesHeaderStream":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the response and release its connection back to the pool"""
+        if self.response is not None:
+            self.response.close()
+
+    def __iter__(self) -> Iterator[Union[Invoice, dict]]:
+        try:
+            for chunk in self._chunks:
+                yield from self._feed(chunk)
+            yield from self._feed(b"", final=True)
+        finally:
+            self.close()
+
+
+class AsyncCarrierInvoicesHeaderStream(_CarrierInvoicesHeaderStream):
+    """Streamed carrier invoices header response, iterate with `async for`"""
+
+    def __init__(self, chunks: AsyncIterable[bytes], skip_validation: bool = False):
+        super().__init__(skip_validation)
+        self._chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[Union[Invoice, dict]]:
+        async for chunk in self._chunks:
+            for item in self._feed(chunk):
+                yield item
+        for item in self._feed(b"", final=True):
+            yield item
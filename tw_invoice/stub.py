@@ -0,0 +1,368 @@
+import argparse
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Dict, Tuple, Union
+from urllib.parse import parse_qsl
+
+from .utils import API_PATHS, sign, validate_invoice_term
+
+ENDPOINTS = {path: endpoint for endpoint, path in API_PATHS.items()}
+ACTIONS = {
+    "invapp": {"QryWinningList", "qryInvHeader", "qryInvDetail"},
+    "lovecode": {"qryLoveCode"},
+    "invserv": {"carrierInvChk", "carrierInvDetail"},
+    "donate": {"carrierInvDnt"},
+    "carrier": {"qryCarrierAgg"},
+}
+SIGNED_ACTIONS = {"carrierInvDnt", "qryCarrierAgg"}
+MESSAGES = {
+    200: "執行成功",
+    500: "系統執行錯誤",
+    901: "無此期別資料",
+    902: "期別錯誤",
+    903: "參數錯誤",
+    904: "錯誤的查詢種類",
+    915: "查無此發票詳細資料",
+    950: "超過最大查詢次數",
+    951: "連線逾時",
+    954: "簽名有誤（偽造之訊息、傳遞不完整）",
+    998: "AppID 不符合規定（可能是被停權或是從未申請該 AppID）",
+    999: "未知錯誤（以避免程式當機）",
+}
+TAIPEI = timezone(timedelta(hours=8))
+
+
+def _digits(seed: str, length: int = 8) -> str:
+    number = int(hashlib.sha256(seed.encode("utf-8")).hexdigest(), 16)
+    return f"{number % 10**length:0{length}d}"
+
+
+def _roc_term(day: datetime) -> str:
+    return f"{day.year - 1911}{(day.month + 1) // 2 * 2:02d}"
+
+
+def _invoice_date(day: datetime) -> dict:
+    # java.util.Date fields, as served by the carrier invoices header query
+    return {
+        "year": day.year - 1900,
+        "month": day.month - 1,
+        "date": day.day,
+        "day": (day.weekday() + 1) % 7,
+        "hours": day.hour,
+        "minutes": day.minute,
+        "seconds": day.second,
+        "time": int(day.timestamp() * 1000),
+        "timezoneOffset": -480,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = dict(parse_qsl(self.rfile.read(length).decode("utf-8")))
+        status, payload = self.server.stub.handle(self.path, form)
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class StubServer(object):
+    """
+    Local stand-in of the e-invoice platform for load and integration testing
+
+    Serves every path of `utils.build_api_url` with schema-conformant payloads
+    for all actions used by AppAPIClient, and verifies `appID` and the
+    `signature` of donate and aggregate calls. Behaviour is configurable:
+
+    `latency`: seconds to wait before answering each request
+    `error_codes`: action to API error code, answered instead of results
+    `payload_size`: number of rows in list responses
+    `fail_next()`: answer the next requests with a 5xx status
+
+    Point a client at it with `AppAPIClient(..., base_url=server.url)`.
+    """
+
+    def __init__(
+        self,
+        app_id: str = "stub_app_id",
+        api_key: str = "stub_api_key",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        error_codes: Union[Dict[str, int], None] = None,
+        payload_size: int = 10,
+    ):
+        self.app_id = app_id
+        self.api_key = api_key
+        self.latency = latency
+        self.error_codes = error_codes or {}
+        self.payload_size = payload_size
+        self.counts: Dict[str, int] = {}
+        self._failures = []
+        self._lock = Lock()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fail_next(self, count: int, status: int = 503) -> None:
+        """Answer the next `count` requests with HTTP `status`"""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def start(self) -> "StubServer":
+        self._thread = Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def handle(self, path: str, form: dict) -> Tuple[int, dict]:
+        """Answer a request, return HTTP status and JSON payload"""
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            failure = self._failures.pop(0) if self._failures else None
+            action = form.get("action", "")
+            self.counts[action] = self.counts.get(action, 0) + 1
+        if failure:
+            return failure, {"code": 500, "msg": MESSAGES[500]}
+        endpoint = ENDPOINTS.get(path)
+        if endpoint is None:
+            return 404, {"code": 404, "msg": "Not Found"}
+        if action not in ACTIONS[endpoint]:
+            return 200, self._error(904)
+        if form.get("appID") != self.app_id:
+            return 200, self._error(998)
+        if action in SIGNED_ACTIONS:
+            signature = form.pop("signature", None)
+            if signature != sign(form, self.api_key):
+                return 200, self._error(954)
+        if action in self.error_codes:
+            return 200, self._error(self.error_codes[action])
+        try:
+            return 200, getattr(self, f"_{action}")(form)
+        except (KeyError, ValueError):
+            return 200, self._error(903)
+
+    def _error(self, code: int) -> dict:
+        return {"code": code, "msg": MESSAGES.get(code, MESSAGES[999])}
+
+    def _ok(self, version: str, code: Union[int, str] = 200, **results) -> dict:
+        # invapp and lovecode serve the code as a string, the others as a number
+        return {"v": version, "code": code, "msg": MESSAGES[200], **results}
+
+    def _QryWinningList(self, form: dict) -> dict:
+        term = form["invTerm"]
+        if not validate_invoice_term(term):
+            return self._error(902)
+        results = {
+            "invoYm": term,
+            "superPrizeNo": _digits(f"{term}super"),
+            "spcPrizeNo": _digits(f"{term}special"),
+            "superPrizeAmt": "10000000",
+            "spcPrizeAmt": "2000000",
+            "firstPrizeAmt": "200000",
+            "secondPrizeAmt": "40000",
+            "thirdPrizeAmt": "10000",
+            "fourthPrizeAmt": "4000",
+            "fifthPrizeAmt": "1000",
+            "sixthPrizeAmt": "200",
+        }
+        for i in range(1, 4):
+            results[f"firstPrizeNo{i}"] = _digits(f"{term}first{i}")
+        results["sixthPrizeNo1"] = _digits(f"{term}sixth", 3)
+        return self._ok("0.2", "200", **results)
+
+    def _header(self, invoice_number: str, invoice_date: str) -> dict:
+        day = datetime.strptime(invoice_date, "%Y/%m/%d")
+        return {
+            "invNum": invoice_number,
+            "invDate": day.strftime("%Y%m%d"),
+            "sellerName": f"商家{_digits(invoice_number, 4)}",
+            "invStatus": "已確認",
+            "invPeriod": _roc_term(day),
+            "sellerBan": _digits(f"{invoice_number}ban"),
+            "sellerAddress": "臺北市大安區",
+            "invoiceTime": "12:00:00",
+            "buyerBan": "",
+            "currency": "",
+        }
+
+    def _details(self, seed: str) -> list:
+        return [
+            {
+                "rowNum": str(i),
+                "description": f"商品{i}",
+                "quantity": "1",
+                "unitPrice": str(int(_digits(f"{seed}{i}", 3)) + 1),
+                "amount": str(int(_digits(f"{seed}{i}", 3)) + 1),
+            }
+            for i in range(1, self.payload_size + 1)
+        ]
+
+    def _qryInvHeader(self, form: dict) -> dict:
+        return self._ok("0.5", "200", **self._header(form["invNum"], form["invDate"]))
+
+    def _qryInvDetail(self, form: dict) -> dict:
+        details = self._details(form["invNum"])
+        amount = sum(int(detail["amount"]) for detail in details)
+        return self._ok(
+            "0.6",
+            "200",
+            **self._header(form["invNum"], form["invDate"]),
+            amount=str(amount),
+            details=details,
+        )
+
+    def _qryLoveCode(self, form: dict) -> dict:
+        query = form.get("qKey", "")
+        details = [
+            {
+                "rowNum": i,
+                "SocialWelfareBAN": _digits(f"{query}{i}"),
+                "LoveCode": str(int(_digits(f"{query}{i}", 5)) + 100),
+                "SocialWelfareName": f"財團法人{query}基金會{i}",
+                "SocialWelfareAbbrev": f"{query}{i}",
+            }
+            for i in range(1, self.payload_size + 1)
+        ]
+        return self._ok("0.2", "200", details=details)
+
+    def _carrierInvChk(self, form: dict) -> dict:
+        start = datetime.strptime(form["startDate"], "%Y/%m/%d")
+        end = datetime.strptime(form["endDate"], "%Y/%m/%d")
+        if (start.year, start.month) != (end.year, end.month) or start > end:
+            return self._error(903)
+        days = (end - start).days + 1
+        details = []
+        for i in range(self.payload_size):
+            day = (start + timedelta(days=i % days, hours=12)).replace(tzinfo=TAIPEI)
+            invoice_number = f"ST{_digits(form['cardNo'] + str(day.date()) + str(i))}"
+            details.append(
+                {
+                    "rowNum": str(i + 1),
+                    "invNum": invoice_number,
+                    "cardType": form["cardType"],
+                    "cardNo": form["cardNo"],
+                    "sellerName": f"商家{_digits(invoice_number, 4)}",
+                    "invStatus": "已確認",
+                    "invDonatable": True,
+                    "amount": str(int(_digits(invoice_number, 3)) + 1),
+                    "invPeriod": _roc_term(day),
+                    "donateMark": 0,
+                    "sellerBan": _digits(f"{invoice_number}ban"),
+                    "sellerAddress": "臺北市大安區",
+                    "invoiceTime": "12:00:00",
+                    "buyerBan": "",
+                    "currency": "",
+                    "invDate": _invoice_date(day),
+                }
+            )
+        return self._ok("0.5", onlyWinningInv=form["onlyWinningInv"], details=details)
+
+    def _carrierInvDetail(self, form: dict) -> dict:
+        header = self._header(form["invNum"], form["invDate"])
+        return self._ok(
+            "0.5",
+            invNum=header["invNum"],
+            invDate=header["invDate"],
+            sellerName=form.get("sellerName") or header["sellerName"],
+            amount=form.get("amount") or "0",
+            invStatus=header["invStatus"],
+            invPeriod=header["invPeriod"],
+            details=self._details(form["invNum"]),
+            sellerBan=header["sellerBan"],
+            sellerAddress=header["sellerAddress"],
+            invoiceTime=header["invoiceTime"],
+            currency="TWD",
+        )
+
+    def _carrierInvDnt(self, form: dict) -> dict:
+        return self._ok(
+            "0.1",
+            hashSerial=_digits(form["serial"], 16),
+            invNum=form["invNum"],
+            invDate=form["invDate"],
+            NPOBan=form["npoBan"],
+            invStatus="已捐贈",
+            invDntTimeStamp=str(int(time())),
+        )
+
+    def _qryCarrierAgg(self, form: dict) -> dict:
+        carriers = [
+            {
+                "carrierType": "1K0001",
+                "carrierId2": _digits(f"{form['cardNo']}{i}", 16),
+                "carrierName": f"悠遊卡{i}",
+            }
+            for i in range(1, self.payload_size + 1)
+        ]
+        return self._ok(
+            "1.0",
+            hashSerial=_digits(form["serial"], 16),
+            cardType=form["cardType"],
+            cardNo=form["cardNo"],
+            carriers=carriers,
+        )
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in e-invoice server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--app-id", default="stub_app_id")
+    parser.add_argument("--api-key", default="stub_api_key")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--payload-size", type=int, default=10)
+    options = parser.parse_args(args)
+    server = StubServer(
+        app_id=options.app_id,
+        api_key=options.api_key,
+        host=options.host,
+        port=options.port,
+        latency=options.latency,
+        payload_size=options.payload_size,
+    )
+    print(f"Serving on {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import sqlite3
+from datetime import date
+from threading import Lock
+from typing import Iterator, NamedTuple, Union
+
+from .app_client import AppAPIClient, CarrierInvoiceDetailResult
+from .utils import as_dict, parse_invoice_date
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    card_type TEXT NOT NULL,
+    card_number TEXT NOT NULL,
+    inv_date TEXT NOT NULL,
+    inv_num TEXT,
+    PRIMARY KEY (card_type, card_number)
+);
+CREATE TABLE IF NOT EXISTS invoices (
+    card_type TEXT NOT NULL,
+    card_number TEXT NOT NULL,
+    inv_num TEXT NOT NULL,
+    inv_date TEXT NOT NULL,
+    header TEXT NOT NULL,
+    detail TEXT NOT NULL,
+    fingerprint TEXT,
+    PRIMARY KEY (card_type, card_number, inv_num)
+);
+CREATE INDEX IF NOT EXISTS invoices_inv_date
+    ON invoices (card_type, card_number, inv_date);
+"""
+
+
+class Watermark(NamedTuple):
+    inv_date: date
+    inv_num: Union[str, None]
+
+
+def earliest_query_date(today: date) -> date:
+    """載具發票最早查詢起始時間為查詢當日前 6 個月 1 日"""
+    month = today.year * 12 + today.month - 1 - 6
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def _fingerprint(header: dict) -> str:
+    # rowNum only reflects the position in a response, not the invoice itself
+    text = json.dumps(
+        {key: value for key, value in header.items() if key != "rowNum"},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class CarrierSync(object):
+    """
+    Incremental carrier invoices sync backed by a SQLite database at `path`
+
+    Each card keeps a watermark of the last synced invoice date. A run only
+    queries headers from the watermark onwards, and only fetches details of
+    invoices that are new or whose header changed (e.g. `invStatus`). Every
+    invoice is committed together with its detail, and the watermark is only
+    advanced once a run finishes, so an interrupted run resumes where it
+    stopped without refetching the details it already stored.
+    """
+
+    def __init__(self, client: AppAPIClient, path: str):
+        self.client = client
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self) -> None:
+        # Databases created before fingerprints were stored
+        columns = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(invoices)")
+        }
+        if "fingerprint" in columns:
+            return
+        self._connection.execute("ALTER TABLE invoices ADD COLUMN fingerprint TEXT")
+        rows = self._connection.execute("SELECT rowid, header FROM invoices")
+        self._connection.executemany(
+            "UPDATE invoices SET fingerprint = ? WHERE rowid = ?",
+            [(_fingerprint(json.loads(header)), rowid) for rowid, header in rows],
+        )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def watermark(self, card_type: str, card_number: str) -> Union[Watermark, None]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT inv_date, inv_num FROM watermarks "
+                "WHERE card_type = ? AND card_number = ?",
+                (card_type, card_number),
+            ).fetchone()
+        if row is None:
+            return None
+        return Watermark(date.fromisoformat(row[0]), row[1])
+
+    def set_watermark(
+        self, card_type: str, card_number: str, watermark: Watermark
+    ) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)",
+                (
+                    card_type,
+                    card_number,
+                    watermark.inv_date.isoformat(),
+                    watermark.inv_num,
+                ),
+            )
+
+    def invoices(self, card_type: str, card_number: str) -> Iterator[dict]:
+        """Yield stored invoice headers, with their detail under `detail`"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT header, detail FROM invoices "
+                "WHERE card_type = ? AND card_number = ? ORDER BY inv_date, inv_num",
+                (card_type, card_number),
+            ).fetchall()
+        for header, detail in rows:
+            yield dict(json.loads(header), detail=json.loads(detail))
+
+    def _stored_fingerprints(
+        self, card_type: str, card_number: str, start_date: date
+    ) -> dict:
+        """Fingerprints of the stored headers dated from `start_date` onwards"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT inv_num, fingerprint FROM invoices "
+                "WHERE card_type = ? AND card_number = ? AND inv_date >= ?",
+                (card_type, card_number, start_date.isoformat()),
+            ).fetchall()
+        return dict(rows)
+
+    def _store(
+        self, card_type: str, card_number: str, header: dict, detail: dict
+    ) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO invoices (card_type, card_number, inv_num, "
+                "inv_date, header, detail, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    card_type,
+                    card_number,
+                    header["invNum"],
+                    parse_invoice_date(header["invDate"]).isoformat(),
+                    json.dumps(header, ensure_ascii=False),
+                    json.dumps(detail, ensure_ascii=False),
+                    _fingerprint(header),
+                ),
+            )
+
+    def sync(
+        self,
+        card_type: str,
+        card_number: str,
+        card_encrypt: str,
+        start_date: Union[date, None] = None,
+        end_date: Union[date, None] = None,
+        max_workers: int = 8,
+    ) -> Iterator[CarrierInvoiceDetailResult]:
+        """
+        Sync a card, yielding the invoices fetched in this run
+
+        `start_date` is only used for the first run of a card, later runs start
+        from the watermark. Dates are clamped to the earliest date the platform
+        accepts. Failed invoices are yielded with `error` set and are retried
+        on the next run.
+        """
+        end_date = end_date or date.today()
+        earliest = earliest_query_date(end_date)
+        watermark = self.watermark(card_type, card_number)
+        if watermark:
+            start_date = watermark.inv_date
+        start_date = max(start_date or earliest, earliest)
+
+        headers = [
+            as_dict(invoice)
+            for invoice in self.client.iter_carrier_invoices_header(
+                card_type=card_type,
+                card_number=card_number,
+                start_date=start_date,
+                end_date=end_date,
+                card_encrypt=card_encrypt,
+            )
+        ]
+        # Only stored headers as recent as the queried ones can match, so the
+        # cost follows the size of the query window, not the card history
+        stored = {}
+        if headers:
+            stored = self._stored_fingerprints(
+                card_type,
+                card_number,
+                min(parse_invoice_date(header["invDate"]) for header in headers),
+            )
+        pending = [
+            header
+            for header in headers
+            if stored.get(header["invNum"]) != _fingerprint(header)
+        ]
+
+        failed_dates = []
+        for result in self.client.iter_carrier_invoices_detail(
+            card_type=card_type,
+            card_number=card_number,
+            invoices=pending,
+            card_encrypt=card_encrypt,
+            max_workers=max_workers,
+        ):
+            if result.error is None:
+                self._store(
+                    card_type, card_number, result.invoice, as_dict(result.detail)
+                )
+            else:
+                failed_dates.append(parse_invoice_date(result.invoice["invDate"]))
+            yield result
+
+        if not headers:
+            return
+        latest = max(
+            headers,
+            key=lambda header: (
+                parse_invoice_date(header["invDate"]),
+                header["invNum"],
+            ),
+        )
+        new_watermark = Watermark(
+            parse_invoice_date(latest["invDate"]), latest["invNum"]
+        )
+        if failed_dates:
+            new_watermark = Watermark(min(failed_dates), None)
+        if watermark is None or new_watermark.inv_date >= watermark.inv_date:
+            self.set_watermark(card_type, card_number, new_watermark)
@@ -0,0 +1,256 @@
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Union
+
+from .utils import parse_invoice_date
+
+TAIPEI = timezone(timedelta(hours=8))
+INVOICE_NUMBER_LENGTH = 10
+# Interned columns: (attribute, invoice field)
+CATEGORY_FIELDS = (
+    ("card_type", "cardType"),
+    ("card_number", "cardNo"),
+    ("seller_name", "sellerName"),
+    ("seller_ban", "sellerBan"),
+    ("seller_address", "sellerAddress"),
+    ("buyer_ban", "buyerBan"),
+    ("status", "invStatus"),
+    ("period", "invPeriod"),
+    ("currency", "currency"),
+)
+
+
+class InvoiceRow(NamedTuple):
+    invoice_number: str
+    card_type: str
+    card_number: str
+    seller_name: str
+    seller_ban: str
+    seller_address: Union[str, None]
+    buyer_ban: Union[str, None]
+    status: str
+    period: str
+    currency: Union[str, None]
+    amount: int
+    donatable: bool
+    donated: bool
+    timestamp: int  # Epoch seconds of the invoice date and time
+
+    @property
+    def invoice_datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp, TAIPEI)
+
+    @property
+    def invoice_date(self) -> date:
+        return self.invoice_datetime.date()
+
+
+class Categories(object):
+    """Interned values of a column, stored as indices into `values`"""
+
+    def __init__(self):
+        self.values: List[Any] = []
+        self.codes: Dict[Any, int] = {}
+
+    def code(self, value: Any) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _field(invoice: Any, name: str) -> Any:
+    if isinstance(invoice, dict):
+        return invoice.get(name)
+    return getattr(invoice, name, None)
+
+
+def _timestamp(invoice_date: Any, invoice_time: Union[str, None]) -> int:
+    # java.util.Date `time` is the epoch milliseconds of the date in Taipei
+    milliseconds = _field(invoice_date, "time")
+    if milliseconds is None:
+        day = parse_invoice_date(invoice_date)
+        seconds = int(datetime(day.year, day.month, day.day, tzinfo=TAIPEI).timestamp())
+    else:
+        seconds = int(milliseconds) // 1000
+    if invoice_time:
+        hours, minutes, rest = invoice_time.split(":")
+        seconds += int(hours) * 3600 + int(minutes) * 60 + int(rest)
+    return seconds
+
+
+class InvoiceTable(object):
+    """
+    Columnar table of carrier invoice headers
+
+    Each field is kept in an `array` column, strings repeated across
+    invoices (seller, BANs, card, status, ...) are interned as codes, amounts
+    are integers and the invoice date and time is an epoch timestamp.
+    `rowNum`, which only reflects the position in a response, is dropped.
+    Rows are built as `InvoiceRow` on access.
+    """
+
+    def __init__(self):
+        self._invoice_numbers = bytearray()
+        self._categories = {attribute: Categories() for attribute, _ in CATEGORY_FIELDS}
+        self._codes = {attribute: array("I") for attribute, _ in CATEGORY_FIELDS}
+        self.amounts = array("q")
+        self.timestamps = array("q")
+        self._flags = bytearray()  # bit 0 donatable, bit 1 donated
+
+    @classmethod
+    def from_responses(
+        cls, responses: Iterable[Any], unique: bool = True
+    ) -> "InvoiceTable":
+        """
+        Build from carrier invoices header responses, as models or dicts
+
+        With `unique`, invoices already in the table are skipped, as across
+        the overlapping windows of `iter_carrier_invoices_header`.
+        """
+        table = cls()
+        seen = set() if unique else None
+        for response in responses:
+            table.extend(_field(response, "details"), seen)
+        return table
+
+    def extend(self, invoices: Iterable[Any], seen: Union[set, None] = None) -> None:
+        """Append invoice rows, skipping numbers in `seen` if it is given"""
+        codes = [
+            (self._codes[attribute].append, self._categories[attribute].code, field)
+            for attribute, field in CATEGORY_FIELDS
+        ]
+        for invoice in invoices:
+            number = _field(invoice, "invNum").encode("ascii")
+            if len(number) != INVOICE_NUMBER_LENGTH:
+                raise ValueError(f"Invalid invoice number: {number!r}")
+            if seen is not None:
+                if number in seen:
+                    continue
+                seen.add(number)
+            self._invoice_numbers += number
+            for append, code, field in codes:
+                append(code(_field(invoice, field)))
+            self.amounts.append(int(_field(invoice, "amount")))
+            self.timestamps.append(
+                _timestamp(_field(invoice, "invDate"), _field(invoice, "invoiceTime"))
+            )
+            self._flags.append(
+                bool(_field(invoice, "invDonatable"))
+                | bool(int(_field(invoice, "donateMark") or 0)) << 1
+            )
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def invoice_number(self, index: int) -> str:
+        start = index * INVOICE_NUMBER_LENGTH
+        return self._invoice_numbers[start : start + INVOICE_NUMBER_LENGTH].decode()
+
+    def __getitem__(self, index: int) -> InvoiceRow:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("InvoiceTable index out of range")
+        flags = self._flags[index]
+        return InvoiceRow(
+            self.invoice_number(index),
+            *(
+                self._categories[attribute].values[self._codes[attribute][index]]
+                for attribute, _ in CATEGORY_FIELDS
+            ),
+            self.amounts[index],
+            bool(flags & 1),
+            bool(flags & 2),
+            self.timestamps[index],
+        )
+
+    def __iter__(self) -> Iterator[InvoiceRow]:
+        return (self[index] for index in range(len(self)))
+
+    def column(self, attribute: str) -> Sequence:
+        """Values of a column of `InvoiceRow`, decoded for interned ones"""
+        if attribute in self._codes:
+            values = self._categories[attribute].values
+            return [values[code] for code in self._codes[attribute]]
+        if attribute == "invoice_number":
+            return [self.invoice_number(index) for index in range(len(self))]
+        if attribute in ("donatable", "donated"):
+            bit = 1 if attribute == "donatable" else 2
+            return [bool(flags & bit) for flags in self._flags]
+        return getattr(self, f"{attribute}s")
+
+    def take(self, indices: Iterable[int]) -> "InvoiceTable":
+        """New table of the rows at `indices`, sharing the interned values"""
+        indices = list(indices)
+        table = InvoiceTable()
+        table._categories = self._categories
+        for attribute, codes in self._codes.items():
+            table._codes[attribute] = array("I", [codes[index] for index in indices])
+        numbers = self._invoice_numbers
+        for index in indices:
+            start = index * INVOICE_NUMBER_LENGTH
+            table._invoice_numbers += numbers[start : start + INVOICE_NUMBER_LENGTH]
+        table.amounts = array("q", [self.amounts[index] for index in indices])
+        table.timestamps = array("q", [self.timestamps[index] for index in indices])
+        table._flags = bytearray(self._flags[index] for index in indices)
+        return table
+
+    def where(
+        self,
+        min_amount: Union[int, None] = None,
+        max_amount: Union[int, None] = None,
+        start: Union[datetime, date, None] = None,
+        end: Union[datetime, date, None] = None,
+        **equals: Any,
+    ) -> "InvoiceTable":
+        """
+        Rows with amount and timestamp in range, and interned columns equal
+        to the given values, e.g. `where(seller_ban="12345678", min_amount=100)`
+
+        `end` is exclusive, dates are taken at midnight in Taipei.
+        """
+        indices = None
+        for attribute, value in equals.items():
+            if attribute not in self._codes:
+                raise ValueError(f"Not an interned column: {attribute}")
+            code = self._categories[attribute].codes.get(value)
+            codes = self._codes[attribute]
+            if indices is None:
+                indices = [index for index, item in enumerate(codes) if item == code]
+            else:
+                indices = [index for index in indices if codes[index] == code]
+        if indices is None:
+            indices = range(len(self))
+        if min_amount is not None or max_amount is not None:
+            amounts = self.amounts
+            low = min(amounts, default=0) if min_amount is None else min_amount
+            high = max(amounts, default=0) if max_amount is None else max_amount
+            indices = [index for index in indices if low <= amounts[index] <= high]
+        if start is not None or end is not None:
+            timestamps = self.timestamps
+            begin = min(timestamps, default=0) if start is None else _epoch(start)
+            stop = max(timestamps, default=0) + 1 if end is None else _epoch(end)
+            indices = [index for index in indices if begin <= timestamps[index] < stop]
+        return self.take(indices)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the columns, not counting the interned values"""
+        return (
+            len(self._invoice_numbers)
+            + len(self._flags)
+            + sum(
+                column.itemsize * len(column)
+                for column in (self.amounts, self.timestamps, *self._codes.values())
+            )
+        )
+
+
+def _epoch(value: Union[datetime, date]) -> int:
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day, tzinfo=TAIPEI)
+    elif value.tzinfo is None:
+        value = value.replace(tzinfo=TAIPEI)
+    return int(value.timestamp())
@@ -1,75 +1,287 @@
 import hashlib
 import hmac
 import re
+import sys
 from base64 import b64encode
-from urllib.parse import urlencode, urljoin
-
-from requests.models import Response
+from datetime import date, timedelta
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    List,
+    NamedTuple,
+    Pattern,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+from urllib.parse import urljoin
 
 from .exception import APIError
 
+if TYPE_CHECKING:  # pragma: no cover
+    from pydantic import BaseModel
+    from requests.models import Response
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+BASE_URL = "https://api.einvoice.nat.gov.tw"
+API_PATHS = {
+    "invapp": "/PB2CAPIVAN/invapp/InvApp",
+    "lovecode": "/PB2CAPIVAN/loveCodeapp/qryLoveCode",
+    "invserv": "/PB2CAPIVAN/invServ/InvServ",
+    "donate": "/PB2CAPIVAN/CarInv/Donate",
+    "carrier": "/PB2CAPIVAN/Carrier/Aggregate",
+}
+
+
+def build_api_url(id: str, base_url: str = BASE_URL) -> str:
+    return urljoin(base_url, API_PATHS[id])
+
 
-def build_api_url(id: str) -> str:
-    BASE_URL = "https://api.einvoice.nat.gov.tw"
-    PATHS = {
-        "invapp": "/PB2CAPIVAN/invapp/InvApp",
-        "lovecode": "/PB2CAPIVAN/loveCodeapp/qryLoveCode",
-        "invserv": "/PB2CAPIVAN/invServ/InvServ",
-        "donate": "/PB2CAPIVAN/CarInv/Donate",
-        "carrier": "/PB2CAPIVAN/Carrier/Aggregate",
-    }
-    return urljoin(BASE_URL, PATHS[id])
+class Signer(object):
+    """
+    HMAC-SHA256 request signer pre-keyed with `key`
+
+    The keyed HMAC state is copied for each signature instead of rehashing the
+    key, and the sorted field order is reused for requests with the same fields.
+    """
+
+    def __init__(self, key: str):
+        self._hmac = hmac.new(key.encode("utf-8"), digestmod=hashlib.sha256)
+        self._orders: Dict[Tuple[str, ...], List[str]] = {}
+
+    def sign(self, data: dict) -> str:
+        fields = tuple(data)
+        order = self._orders.get(fields)
+        if order is None:
+            order = self._orders[fields] = sorted(fields)
+        query_string = "&".join(f"{name}={data[name]}" for name in order if data[name])
+        signature = self._hmac.copy()
+        signature.update(query_string.encode("utf-8"))
+        return b64encode(signature.digest()).decode("utf-8")
 
 
 def sign(data: dict, key: str) -> str:
     """Generate signature"""
-    data_pairs = [(name, value) for name, value in data.items() if value]
-    data_pairs.sort(key=lambda x: x[0])
-    query_string = urlencode(data_pairs, quote_via=lambda k, safe, encoding, errors: k)
-    signature = b64encode(
-        hmac.new(
-            key=key.encode("utf-8"),
-            msg=query_string.encode("utf-8"),
-            digestmod=hashlib.sha256,
-        ).digest()
-    ).decode("utf-8")
-    return signature
-
-
-def check_api_error(response: Response) -> dict:
+    return Signer(key).sign(data)
+
+
+def split_date_range(start_date: date, end_date: date) -> List[Tuple[date, date]]:
+    """Split a date range into windows that do not cross calendar months"""
+    if start_date > end_date:
+        raise ValueError("start_date must not be later than end_date")
+    windows = []
+    while start_date <= end_date:
+        next_month = (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+        window_end = min(next_month - timedelta(days=1), end_date)
+        windows.append((start_date, window_end))
+        start_date = next_month
+    return windows
+
+
+def check_api_error(response: "Response") -> dict:
     """Check API error"""
+    from requests.models import Response
+
     if not isinstance(response, Response):
         raise TypeError("response must be a Response object")
     response.raise_for_status()
-    data = response.json()
+    return check_api_code(response.json())
+
+
+def check_api_code(data: dict) -> dict:
+    """Check API response code"""
     if int(data["code"]) != 200:
         raise APIError(data["code"], data["msg"])
     return data
 
 
+def decode_content(
+    content: bytes, model: Union[Type["BaseModel"], None] = None
+) -> Union["BaseModel", dict]:
+    """Decode response body into `model` (or dict if None) and check API error"""
+    if model is not None and hasattr(model, "model_validate_json"):
+        from pydantic import ValidationError
+
+        # pydantic v2 validates straight from JSON without an intermediate dict
+        try:
+            results = model.model_validate_json(content)
+        except ValidationError:
+            pass  # Error responses do not fit the model, decode them below
+        else:
+            if int(results.code) != 200:
+                raise APIError(results.code, results.msg)
+            return results
+    results = check_api_code(json_loads(content))
+    return results if model is None else model.parse_obj(results)
+
+
+def decode_response(
+    response: "Response", model: Union[Type["BaseModel"], None] = None
+) -> Union["BaseModel", dict]:
+    """Check API error and decode response into `model` in a single pass"""
+    from requests.models import Response
+
+    if not isinstance(response, Response):
+        raise TypeError("response must be a Response object")
+    response.raise_for_status()
+    return decode_content(response.content, model)
+
+
+INVOICE_NUMBER_PATTERN = re.compile(r"^[A-Z]{2}\d{8}$")
+INVOICE_RANDOM_PATTERN = re.compile(r"^\d{4}$")
+INVOICE_TERM_PATTERN = re.compile(r"^\d{3}(02|04|06|08|10|12)$")
+PHONE_BARCODE_PATTERN = re.compile(r"^\/[A-Z0-9+.-]{7}$")
+BAN_PATTERN = re.compile(r"^\d{8}$")
+
+UPPERCASE = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+DIGITS = "0123456789"
+
+
+class ValidationResult(NamedTuple):
+    mask: Sequence[bool]  # list, or numpy bool array for numpy input
+    failures: List[int]
+
+
 def validate_invoice_number(invoice_number: str) -> bool:
     """Validate einvoice number"""
     if not isinstance(invoice_number, str):
         return False
-    return bool(re.match(r"^[A-Z]{2}\d{8}$", invoice_number))
+    return bool(INVOICE_NUMBER_PATTERN.match(invoice_number))
 
 
 def validate_invoice_random(invoice_random: str) -> bool:
     """Validate invoice random"""
     if not isinstance(invoice_random, str):
         return False
-    return bool(re.match(r"^\d{4}$", invoice_random))
+    return bool(INVOICE_RANDOM_PATTERN.match(invoice_random))
 
 
 def validate_invoice_term(invoice_term: str) -> bool:
     """Validate invoice term"""
     if not isinstance(invoice_term, str):
         return False
-    return bool(re.match(r"^\d{3}(02|04|06|08|10|12)$", invoice_term))
+    return bool(INVOICE_TERM_PATTERN.match(invoice_term))
 
 
 def validate_phone_barcode(phone_barcode: str) -> bool:
     """Validate phone barcode"""
     if not isinstance(phone_barcode, str):
         return False
-    return bool(re.match(r"^\/[A-Z0-9+.-]{7}$", phone_barcode))
+    return bool(PHONE_BARCODE_PATTERN.match(phone_barcode))
+
+
+def validate_ban(ban: str) -> bool:
+    """Validate BAN (統一編號)"""
+    if not isinstance(ban, str):
+        return False
+    return bool(BAN_PATTERN.match(ban))
+
+
+def _match_ascii(numpy, array, positions: Sequence[str]):
+    """Vectorized check of a numpy str array against allowed chars per position"""
+    width = len(positions)
+    # One extra column tells apart longer strings, shorter ones are zero padded
+    codes = array.astype(f"U{width + 1}").view(numpy.uint32).reshape(-1, width + 1)
+    mask = codes[:, width] == 0
+    codes = numpy.minimum(codes[:, :width], 127)
+    for position, chars in enumerate(positions):
+        allowed = numpy.zeros(128, dtype=bool)
+        allowed[[ord(char) for char in chars]] = True
+        mask &= allowed[codes[:, position]]
+    return mask, codes
+
+
+def _validate_many(
+    values, pattern: Pattern, positions: Sequence[str], check=None
+) -> ValidationResult:
+    # numpy is optional and slow to import; input can only be a numpy array
+    # once the caller has imported it
+    numpy = sys.modules.get("numpy")
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        array = values.ravel()
+        if array.dtype.kind == "U":
+            mask, codes = _match_ascii(numpy, array, positions)
+            if check is not None:
+                mask &= check(codes)
+            # Recheck rejected values with the regex, which also accepts
+            # e.g. non-ASCII digits, so results equal the scalar validators
+            for index in numpy.flatnonzero(~mask):
+                mask[index] = bool(pattern.match(array[index]))
+        else:
+            mask = numpy.array(
+                [
+                    isinstance(value, str) and bool(pattern.match(value))
+                    for value in array
+                ],
+                dtype=bool,
+            )
+        return ValidationResult(mask, numpy.flatnonzero(~mask).tolist())
+    match = pattern.match
+    # Iterators can only be consumed once, the fallback below needs another pass
+    values = values if isinstance(values, (list, tuple)) else list(values)
+    try:
+        mask = [result is not None for result in map(match, values)]
+    except TypeError:
+        mask = [isinstance(value, str) and bool(match(value)) for value in values]
+    return ValidationResult(
+        mask, [index for index, valid in enumerate(mask) if not valid]
+    )
+
+
+def _even_month(codes):
+    tens, ones = codes[:, 3] - ord("0"), codes[:, 4] - ord("0")
+    return ((tens == 0) & (ones != 0)) | ((tens == 1) & (ones <= 2))
+
+
+def validate_invoice_numbers(invoice_numbers) -> ValidationResult:
+    """Validate einvoice numbers in batch, from a sequence or numpy str array"""
+    return _validate_many(
+        invoice_numbers, INVOICE_NUMBER_PATTERN, [UPPERCASE] * 2 + [DIGITS] * 8
+    )
+
+
+def validate_invoice_randoms(invoice_randoms) -> ValidationResult:
+    """Validate invoice randoms in batch, from a sequence or numpy str array"""
+    return _validate_many(invoice_randoms, INVOICE_RANDOM_PATTERN, [DIGITS] * 4)
+
+
+def validate_invoice_terms(invoice_terms) -> ValidationResult:
+    """Validate invoice terms in batch, from a sequence or numpy str array"""
+    return _validate_many(
+        invoice_terms,
+        INVOICE_TERM_PATTERN,
+        [DIGITS] * 3 + ["01", "02468"],
+        _even_month,
+    )
+
+
+def validate_phone_barcodes(phone_barcodes) -> ValidationResult:
+    """Validate phone barcodes in batch, from a sequence or numpy str array"""
+    return _validate_many(
+        phone_barcodes, PHONE_BARCODE_PATTERN, ["/"] + [UPPERCASE + DIGITS + "+.-"] * 7
+    )
+
+
+def validate_bans(bans) -> ValidationResult:
+    """Validate BANs (統一編號) in batch, from a sequence or numpy str array"""
+    return _validate_many(bans, BAN_PATTERN, [DIGITS] * 8)
+
+
+def as_dict(value: Union["BaseModel", dict]) -> dict:
+    """Response or invoice row as a dict, whether validated into a model or not"""
+    return value if isinstance(value, dict) else value.dict()
+
+
+def parse_invoice_date(invoice_date) -> date:
+    """Convert invDate of carrier invoices header (java.util.Date fields) to date"""
+    if isinstance(invoice_date, dict):
+        year, month, day = (invoice_date[key] for key in ("year", "month", "date"))
+    else:
+        year, month, day = invoice_date.year, invoice_date.month, invoice_date.date
+    return date(int(year) + 1900, int(month) + 1, int(day))